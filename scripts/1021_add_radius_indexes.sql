@@ -91,9 +91,5 @@ BEGIN
   END IF;
 END $$;
 
--- Add constraints for speed
-ALTER TABLE radcheck ADD CONSTRAINT IF NOT EXISTS radcheck_unique 
-UNIQUE (username, attribute);
-
-ALTER TABLE radreply ADD CONSTRAINT IF NOT EXISTS radreply_unique 
-UNIQUE (username, attribute);
+-- Unique (username, attribute) on radcheck and radreply: deduped and built CONCURRENTLY by
+--   python3 scripts/migrate.py radius_username_attribute_unique
@@ -0,0 +1,53 @@
+-- Incremental RADIUS sync state
+-- Keeps a change watermark so sync_radius_delta.py only touches services changed since its last run
+-- This script is idempotent and safe to run multiple times
+
+CREATE TABLE IF NOT EXISTS radius_sync_state (
+  name VARCHAR(64) PRIMARY KEY,
+  watermark TIMESTAMP,
+  last_run_at TIMESTAMP DEFAULT NOW(),
+  services_synced INTEGER DEFAULT 0
+);
+
+-- Username last written to radcheck for each service, so renames and deactivations can be deprovisioned
+CREATE TABLE IF NOT EXISTS radius_synced_services (
+  service_id INTEGER PRIMARY KEY,
+  username VARCHAR(255) NOT NULL,
+  synced_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_radius_synced_services_username ON radius_synced_services(username);
+
+-- The watermark relies on updated_at being bumped on every change, not only when the app remembers to set it
+ALTER TABLE customer_services ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE service_plans ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+CREATE OR REPLACE FUNCTION update_updated_at_column()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+-- No-op UPDATEs (e.g. rewriting unchanged credentials) must not move rows past the sync watermark
+DROP TRIGGER IF EXISTS update_customer_services_updated_at ON customer_services;
+CREATE TRIGGER update_customer_services_updated_at
+    BEFORE UPDATE ON customer_services
+    FOR EACH ROW
+    WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE FUNCTION update_updated_at_column();
+
+DROP TRIGGER IF EXISTS update_service_plans_updated_at ON service_plans;
+CREATE TRIGGER update_service_plans_updated_at
+    BEFORE UPDATE ON service_plans
+    FOR EACH ROW
+    WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE FUNCTION update_updated_at_column();
+
+CREATE INDEX IF NOT EXISTS idx_customer_services_updated_at ON customer_services(updated_at);
+CREATE INDEX IF NOT EXISTS idx_customer_services_service_plan_id ON customer_services(service_plan_id);
+CREATE INDEX IF NOT EXISTS idx_service_plans_updated_at ON service_plans(updated_at);
+
+COMMENT ON TABLE radius_sync_state IS 'Change watermarks for incremental RADIUS sync runs';
+COMMENT ON TABLE radius_synced_services IS 'Username last provisioned to radcheck per service (used to deprovision renamed/inactive services)';
@@ -0,0 +1,22 @@
+-- Retry scheduling for provisioning_queue workers
+-- provisioning_worker.py claims rows with FOR UPDATE SKIP LOCKED and backs off failed rows via next_attempt_at
+-- This script is idempotent and safe to run multiple times
+
+ALTER TABLE provisioning_queue ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP DEFAULT NOW();
+ALTER TABLE provisioning_queue ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(100);
+
+-- Every row is schedulable, so the claim can filter and order on the bare column (and its index)
+UPDATE provisioning_queue SET next_attempt_at = COALESCE(created_at, NOW()) WHERE next_attempt_at IS NULL;
+ALTER TABLE provisioning_queue ALTER COLUMN next_attempt_at SET DEFAULT NOW();
+ALTER TABLE provisioning_queue ALTER COLUMN next_attempt_at SET NOT NULL;
+
+-- Claim query: pending rows that are due, oldest first
+CREATE INDEX IF NOT EXISTS idx_provisioning_queue_pending_due
+ON provisioning_queue(next_attempt_at, id) WHERE status = 'pending';
+
+-- Lease recovery: rows left in 'processing' by a crashed worker
+CREATE INDEX IF NOT EXISTS idx_provisioning_queue_processing
+ON provisioning_queue(updated_at) WHERE status = 'processing';
+
+COMMENT ON COLUMN provisioning_queue.next_attempt_at IS 'Earliest time a worker may (re)try this row; pushed back exponentially on failure';
+COMMENT ON COLUMN provisioning_queue.claimed_by IS 'Worker that currently holds the row (host:pid:worker)';
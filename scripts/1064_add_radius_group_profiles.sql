@@ -0,0 +1,27 @@
+-- Group-based rate-limit profiles
+-- radius_groups.py materialises one radgroupreply profile per service plan ('plan-<id>')
+-- and maps users to it through radusergroup, so a plan speed change is one UPDATE
+-- This script is idempotent and safe to run multiple times
+
+-- Remove duplicate rows so the unique indexes below can be built
+DELETE FROM radgroupreply a
+USING radgroupreply b
+WHERE a.groupname = b.groupname
+AND a.attribute = b.attribute
+AND a.id < b.id;
+
+DELETE FROM radusergroup a
+USING radusergroup b
+WHERE a.username = b.username
+AND a.groupname = b.groupname
+AND a.id < b.id;
+
+-- Allow ON CONFLICT upserts for profiles and memberships
+CREATE UNIQUE INDEX IF NOT EXISTS radgroupreply_groupname_attribute_unique
+ON radgroupreply(groupname, attribute);
+
+CREATE UNIQUE INDEX IF NOT EXISTS radusergroup_username_groupname_unique
+ON radusergroup(username, groupname);
+
+-- Membership cleanup looks up plan groups by name
+CREATE INDEX IF NOT EXISTS radusergroup_groupname ON radusergroup(groupname);
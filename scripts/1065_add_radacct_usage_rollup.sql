@@ -0,0 +1,54 @@
+-- Per-subscriber usage rollup
+-- radacct_rollup.py folds radacct octet deltas into subscriber_usage_daily so usage queries
+-- are index lookups on a small table instead of scans over the accounting partitions
+-- This script is idempotent and safe to run multiple times
+
+CREATE TABLE IF NOT EXISTS subscriber_usage_daily (
+  username VARCHAR(64) NOT NULL,
+  day DATE NOT NULL,
+  input_octets BIGINT NOT NULL DEFAULT 0,
+  output_octets BIGINT NOT NULL DEFAULT 0,
+  session_time BIGINT NOT NULL DEFAULT 0,
+  sessions INTEGER NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT NOW(),
+  PRIMARY KEY (username, day)
+);
+
+CREATE INDEX IF NOT EXISTS idx_subscriber_usage_daily_day ON subscriber_usage_daily(day);
+
+CREATE OR REPLACE VIEW subscriber_usage_monthly AS
+SELECT
+  username,
+  DATE_TRUNC('month', day)::date AS month,
+  SUM(input_octets) AS input_octets,
+  SUM(output_octets) AS output_octets,
+  SUM(session_time) AS session_time,
+  SUM(sessions) AS sessions
+FROM subscriber_usage_daily
+GROUP BY username, DATE_TRUNC('month', day);
+
+-- Counters already folded per accounting row, so interim updates only add their delta
+-- and a counter that goes backwards (session restart on the NAS) is treated as a fresh start
+CREATE TABLE IF NOT EXISTS radacct_rollup_sessions (
+  radacctid BIGINT PRIMARY KEY,
+  username VARCHAR(64) NOT NULL,
+  input_octets BIGINT NOT NULL DEFAULT 0,
+  output_octets BIGINT NOT NULL DEFAULT 0,
+  session_time BIGINT NOT NULL DEFAULT 0,
+  stopped_at TIMESTAMP WITH TIME ZONE,
+  updated_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_radacct_rollup_sessions_stopped
+ON radacct_rollup_sessions(stopped_at) WHERE stopped_at IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS radacct_rollup_state (
+  name VARCHAR(64) PRIMARY KEY,
+  last_radacctid BIGINT NOT NULL DEFAULT 0,
+  last_run_at TIMESTAMP WITH TIME ZONE,
+  rows_folded BIGINT DEFAULT 0
+);
+
+-- Sessions closed since the last run are found through idx_radacct_stoptime on radacct(acctstoptime).
+-- It is built per partition with CREATE INDEX CONCURRENTLY, which cannot run from this file:
+--   python3 scripts/migrate.py radacct_stoptime_index
@@ -0,0 +1,64 @@
+-- Real-time RADIUS change notifications
+-- radius_listener.py LISTENs on radius_changes and provisions just the services named in the payloads:
+--   service:<id>  a customer_services row was inserted, deleted or had a RADIUS-relevant column change
+--   plan:<id>     a service plan's speeds or vendor_map changed (every service on it is re-rendered)
+-- Notifications are delivered on commit, and identical payloads within one transaction are sent once
+-- This script is idempotent and safe to run multiple times
+
+CREATE OR REPLACE FUNCTION notify_radius_service_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    relevant TEXT[] := ARRAY['status', 'is_suspended', 'pppoe_username', 'pppoe_password',
+                             'service_plan_id', 'ip_address'];
+    col TEXT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('radius_changes', 'service:' || OLD.id);
+        RETURN OLD;
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        -- to_jsonb so columns missing from older schemas simply compare as NULL
+        FOREACH col IN ARRAY relevant LOOP
+            IF to_jsonb(OLD) -> col IS DISTINCT FROM to_jsonb(NEW) -> col THEN
+                PERFORM pg_notify('radius_changes', 'service:' || NEW.id);
+                RETURN NEW;
+            END IF;
+        END LOOP;
+        RETURN NEW;
+    END IF;
+    PERFORM pg_notify('radius_changes', 'service:' || NEW.id);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION notify_radius_plan_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    relevant TEXT[] := ARRAY['download_speed', 'upload_speed', 'speed_download', 'speed_upload',
+                             'vendor_map'];
+    col TEXT;
+BEGIN
+    FOREACH col IN ARRAY relevant LOOP
+        IF to_jsonb(OLD) -> col IS DISTINCT FROM to_jsonb(NEW) -> col THEN
+            PERFORM pg_notify('radius_changes', 'plan:' || NEW.id);
+            RETURN NEW;
+        END IF;
+    END LOOP;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS notify_customer_services_radius ON customer_services;
+CREATE TRIGGER notify_customer_services_radius
+    AFTER INSERT OR UPDATE OR DELETE ON customer_services
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_radius_service_change();
+
+DROP TRIGGER IF EXISTS notify_service_plans_radius ON service_plans;
+CREATE TRIGGER notify_service_plans_radius
+    AFTER UPDATE ON service_plans
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_radius_plan_change();
+
+COMMENT ON FUNCTION notify_radius_service_change() IS 'NOTIFY radius_changes ''service:<id>'' for radius_listener.py';
+COMMENT ON FUNCTION notify_radius_plan_change() IS 'NOTIFY radius_changes ''plan:<id>'' for radius_listener.py';
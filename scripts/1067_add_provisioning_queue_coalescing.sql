@@ -0,0 +1,12 @@
+-- Per-router coalescing for provisioning_queue
+-- router_push.py pushes only the newest pending action per (router_id, username); older pending
+-- rows for the same user are marked 'superseded' when a newer one is enqueued or claimed
+-- This script is idempotent and safe to run multiple times
+
+-- Newest action per router and user (in any status: a completed newer action still outranks an
+-- older row reclaimed from a crashed session), and the older rows it supersedes
+DROP INDEX IF EXISTS idx_provisioning_queue_router_user_open;
+CREATE INDEX IF NOT EXISTS idx_provisioning_queue_router_user
+ON provisioning_queue(router_id, username, id);
+
+COMMENT ON COLUMN provisioning_queue.status IS 'pending, processing, completed, failed, or superseded (replaced by a newer action for the same router and username)';
@@ -0,0 +1,19 @@
+-- One radcheck/radreply row per (username, attribute)
+-- The provisioning scripts upsert with ON CONFLICT (username, attribute), which needs a unique index
+-- on both tables (1021's ADD CONSTRAINT IF NOT EXISTS is not valid PostgreSQL and never created it).
+-- This removes the duplicates, keeping each pair's newest row. The unique indexes are then built
+-- CONCURRENTLY, which cannot run from a script like this one:
+--   python3 scripts/migrate.py radius_username_attribute_unique    (runs this file first)
+-- This script is idempotent and safe to run multiple times
+
+DELETE FROM radcheck a
+USING radcheck b
+WHERE a.username = b.username
+AND a.attribute = b.attribute
+AND a.id < b.id;
+
+DELETE FROM radreply a
+USING radreply b
+WHERE a.username = b.username
+AND a.attribute = b.attribute
+AND a.id < b.id;
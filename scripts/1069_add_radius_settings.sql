@@ -0,0 +1,11 @@
+-- Persisted RADIUS provisioning settings
+-- group_profiles = 'on' (set by radius_groups.py migrate, cleared by radius_groups.py disable)
+-- makes every provisioning script point users at their plan's radgroupreply profile through
+-- radusergroup instead of writing the plan's reply attributes per user
+-- This script is idempotent and safe to run multiple times
+
+CREATE TABLE IF NOT EXISTS radius_settings (
+    name VARCHAR(100) PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Low-latency service activation
+Provisions specific services to FreeRADIUS by service id or customer id: the parameterised,
+batch-capable form of provision_customer_2004.py, meant for payment-triggered activation.
+
+The connection stays open in autocommit with its statements prepared, and plans are compiled
+once by PlanAttributes. Activating a service costs one round trip to look it up and one
+statement (db.STATEMENTS["radius_user_apply"]) that upserts radcheck and radreply and removes
+stale reply attributes; in group profiles mode (radius_groups.py migrate) the same statement sets
+the user's plan group instead of writing the plan's attributes. Services missing PPPoE
+credentials get them generated first.
+
+As a long-lived process (--stdin) it reads one request per line and answers with a JSON line:
+    service 1234
+    service 1234,1235
+    customer 2004
+
+--benchmark times single-service activations on a warm connection and reports p50/p95/p99
+against the 10 ms target.
+
+Usage:
+    python3 scripts/activate_services.py --service 1234 --service 1235
+    python3 scripts/activate_services.py --customer 2004 --dry-run
+    python3 scripts/activate_services.py --stdin < requests.txt
+    python3 scripts/activate_services.py --benchmark 1000
+"""
+
+import argparse
+import json
+import math
+import sys
+import time
+
+import psycopg2
+
+import db
+import instrumentation
+import pppoe_credentials
+import radius_groups
+from plan_attributes import PlanAttributes
+from username_allocator import UsernameAllocator
+
+TARGET_P99_MS = 10.0
+
+
+class Activator:
+    """Activates services over one warm, autocommit connection"""
+
+    def __init__(self, conn, plans=None, plan_refresh_seconds=60):
+        self.conn = conn
+        self.conn.autocommit = True
+        self.cur = conn.cursor()
+        self.plans = plans or PlanAttributes.load(conn)
+        radius_groups.ensure_profiles(conn, self.plans)
+        self.plan_refresh_seconds = plan_refresh_seconds
+        self._plans_loaded = time.monotonic()
+        for name in ("activation_services", "radius_user_apply"):
+            db.prepare(conn, name)
+
+    def _refresh_plans(self, rows):
+        # Pick up plan edits periodically, and immediately for a plan we have never seen
+        stale = time.monotonic() - self._plans_loaded > self.plan_refresh_seconds
+        unknown = any(row[5] is not None and row[5] not in self.plans.plans for row in rows)
+        if stale or unknown:
+            self.plans.refresh(self.conn)
+            radius_groups.ensure_profiles(self.conn, self.plans)
+            self._plans_loaded = time.monotonic()
+
+    def _fill_credentials(self, rows):
+        """Generate missing credentials (rare: pppoe_credentials.py normally fills them)"""
+        missing = [(r[0], r[1], r[2], r[3], r[4]) for r in rows if not r[3] or not r[4]]
+        if not missing:
+            return rows
+        # Loaded fresh so names allocated by other processes since start-up are seen
+        allocator = UsernameAllocator.load(self.conn)
+        written = {
+            service_id: (username, password)
+            for service_id, username, password in pppoe_credentials.fill_credentials(self.cur, missing, allocator)
+        }
+        return [
+            row[:3] + written[row[0]] + row[5:] if row[0] in written else row
+            for row in rows
+        ]
+
+    def lookup(self, service_ids=(), customer_ids=()):
+        db.execute_prepared(self.conn, "activation_services",
+                            (list(service_ids), list(customer_ids)), cur=self.cur)
+        rows = self.cur.fetchall()
+        self._refresh_plans(rows)
+        return rows
+
+    def replies(self, plan_id, ip_address):
+        replies = dict(self.plans.user_attributes(plan_id))
+        replies['Framed-IP-Address'] = ip_address or '0.0.0.0'
+        return replies
+
+    def activate(self, service_ids=(), customer_ids=(), dry_run=False):
+        """Activate the matching services; returns one result dict per service"""
+        rows = self.lookup(service_ids, customer_ids)
+        if not dry_run:
+            rows = self._fill_credentials(rows)
+
+        results = []
+        for service_id, customer_id, _, username, password, plan_id, ip_address in rows:
+            replies = self.replies(plan_id, ip_address)
+            group = self.plans.group(plan_id)
+            result = {'service_id': service_id, 'customer_id': customer_id, 'username': username}
+            if dry_run:
+                result['replies'] = replies
+                result['group'] = group
+            else:
+                db.execute_prepared(self.conn, "radius_user_apply",
+                                    (username, password, list(replies), list(replies.values()), group),
+                                    cur=self.cur)
+                result['writes'] = self.cur.fetchone()[0]
+            results.append(result)
+        return results
+
+    def close(self):
+        self.cur.close()
+
+
+def parse_request(line):
+    """'service 1,2' / 'customer 2004' -> (service_ids, customer_ids)"""
+    kind, _, ids = line.strip().partition(" ")
+    ids = [int(i) for i in ids.replace(",", " ").split()]
+    if kind in ("service", "services"):
+        return ids, []
+    if kind in ("customer", "customers"):
+        return [], ids
+    raise ValueError(f"unknown request '{kind}' (expected 'service <ids>' or 'customer <ids>')")
+
+
+def serve(activator, lines, out=sys.stdout):
+    """Answer one JSON line per request line until EOF"""
+    for line in lines:
+        if not line.strip():
+            continue
+        started = time.perf_counter()
+        try:
+            service_ids, customer_ids = parse_request(line)
+            results = activator.activate(service_ids, customer_ids)
+            response = {'ok': True, 'services': results}
+        except ValueError as e:
+            response = {'ok': False, 'error': str(e)}
+        except psycopg2.Error as e:
+            response = {'ok': False, 'error': str(e).strip()}
+            if activator.conn.closed:
+                raise
+        response['ms'] = round((time.perf_counter() - started) * 1000, 3)
+        out.write(json.dumps(response) + "\n")
+        out.flush()
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def benchmark(activator, count, rounds=2):
+    """Time single-service activations; round 1 writes, later rounds are the no-change path"""
+    activator.cur.execute("""
+        SELECT id FROM customer_services
+        WHERE status = 'active' AND COALESCE(is_suspended, false) = false
+        AND pppoe_username IS NOT NULL AND pppoe_password IS NOT NULL
+        ORDER BY random()
+        LIMIT %s
+    """, (count,))
+    service_ids = [row[0] for row in activator.cur.fetchall()]
+    if not service_ids:
+        return []
+
+    reports = []
+    for round_number in range(1, rounds + 1):
+        latencies = []
+        writes = 0
+        for service_id in service_ids:
+            started = time.perf_counter()
+            results = activator.activate([service_id])
+            latencies.append((time.perf_counter() - started) * 1000)
+            writes += sum(r['writes'] for r in results)
+        latencies.sort()
+        reports.append({
+            'round': round_number,
+            'activations': len(latencies),
+            'writes': writes,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': latencies[-1],
+        })
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Activate services in FreeRADIUS by service or customer id")
+    parser.add_argument("--service", type=int, action="append", default=[], help="service id (repeatable)")
+    parser.add_argument("--customer", type=int, action="append", default=[],
+                        help="activate all active services of this customer (repeatable)")
+    parser.add_argument("--stdin", action="store_true",
+                        help="long-lived mode: read 'service <ids>' / 'customer <ids>' lines from stdin")
+    parser.add_argument("--benchmark", type=int, metavar="N",
+                        help="time N single-service activations on a warm connection")
+    parser.add_argument("--rounds", type=int, default=2, help="benchmark rounds over the same services")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="show the attributes that would be written without writing them")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.start(args)
+
+    if not (args.service or args.customer or args.stdin or args.benchmark):
+        parser.error("pass --service/--customer ids, --stdin or --benchmark")
+
+    db.require_database_url()
+    conn = db.connect()
+    activator = Activator(conn)
+
+    try:
+        if args.stdin:
+            serve(activator, sys.stdin)
+            return
+
+        if args.benchmark:
+            print("=" * 60)
+            print("ACTIVATION LATENCY BENCHMARK")
+            print("=" * 60)
+            reports = benchmark(activator, args.benchmark, args.rounds)
+            if not reports:
+                print("❌ No active services with PPPoE credentials to activate")
+                exit(1)
+            for r in reports:
+                status = "✓" if r['p99_ms'] < TARGET_P99_MS else "❌"
+                print(f"{status} round {r['round']}: {r['activations']} activations, {r['writes']} rows written")
+                print(f"    p50 {r['p50_ms']:.2f} ms  p95 {r['p95_ms']:.2f} ms  "
+                      f"p99 {r['p99_ms']:.2f} ms  max {r['max_ms']:.2f} ms  (target p99 < {TARGET_P99_MS:.0f} ms)")
+            return
+
+        started = time.perf_counter()
+        results = activator.activate(args.service, args.customer, dry_run=args.dry_run)
+        elapsed = (time.perf_counter() - started) * 1000
+        if not results:
+            print("❌ No active services found for the given ids")
+            exit(1)
+        for result in results:
+            print(f"✅ Service {result['service_id']} (customer {result['customer_id']}): {result['username']}")
+            if args.dry_run:
+                for attribute, value in result['replies'].items():
+                    print(f"    {attribute} := {value}")
+                if result['group']:
+                    print(f"    group {result['group']}")
+            else:
+                print(f"    {result['writes']} row(s) written")
+        found = {r['service_id'] for r in results}
+        for service_id in args.service:
+            if service_id not in found:
+                print(f"⚠️  Service {service_id} is not active (or suspended), skipped")
+        print(f"\n✓ {len(results)} service(s) {'checked' if args.dry_run else 'activated'} in {elapsed:.1f} ms")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        exit(1)
+    finally:
+        activator.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
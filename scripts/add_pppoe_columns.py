@@ -1,30 +1,18 @@
-import os
-import psycopg2
+import db
+import migrate
 
-# Get database URL from environment
-database_url = os.environ.get('DATABASE_URL')
-
-if not database_url:
-    print("ERROR: DATABASE_URL environment variable not set")
-    exit(1)
+db.require_database_url()
 
 try:
-    # Connect to database
-    conn = psycopg2.connect(database_url)
-    cursor = conn.cursor()
-    
     print("Adding pppoe_username and pppoe_password columns to customer_services table...")
     
-    # Add columns if they don't exist
-    cursor.execute("""
-        ALTER TABLE customer_services 
-        ADD COLUMN IF NOT EXISTS pppoe_username VARCHAR(100),
-        ADD COLUMN IF NOT EXISTS pppoe_password VARCHAR(100);
-    """)
-    
-    conn.commit()
+    # Applied through the migration ledger with lock_timeout and retries
+    migrate.run(["customer_services_pppoe_credentials"])
     print("✓ Successfully added PPPoE columns to customer_services table")
     
+    conn = db.connect()
+    cursor = conn.cursor()
+    
     # Verify columns were added
     cursor.execute("""
         SELECT column_name, data_type 
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Chunked online backfill engine
+Populates a newly added column by walking the table by primary key in small chunks,
+committing each chunk, instead of one UPDATE over every row (long row locks, replication
+lag and a table's worth of dead tuples at once). Progress is stored in backfill_state in the
+same transaction as each chunk, so an interrupted run resumes from its last key.
+
+Throttling:
+    --max-rows-per-sec N   sleep between chunks to stay under N updated rows per second
+    --max-lag-seconds S    pause while any replica's replay lag exceeds S seconds
+
+Usage:
+    python3 scripts/backfill.py payroll_employee_name
+    python3 scripts/backfill.py pppoe_credentials --chunk-size 2000 --max-rows-per-sec 5000
+    python3 scripts/backfill.py pppoe_credentials --reset    # start again from the first key
+
+run_chunks() is the same engine for any keyed walk; check_and_provision_radius.py and
+provision_all_radius_users.py use it for their resumable --chunked runs.
+"""
+
+import argparse
+import time
+
+import db
+import pppoe_credentials
+from username_allocator import UsernameAllocator
+
+EMPLOYEE_NAME_SQL = """
+    UPDATE payroll_records pr
+    SET employee_name = e.first_name || ' ' || e.last_name
+    FROM employees e
+    WHERE pr.employee_id = e.employee_id
+    AND pr.employee_name IS NULL
+    AND pr.id > %(lo)s AND pr.id <= %(hi)s
+"""
+
+PPPOE_CHUNK_QUERY = """
+    SELECT
+        cs.id as service_id,
+        cs.customer_id,
+        c.name as customer_name,
+        cs.pppoe_username,
+        cs.pppoe_password
+    FROM customer_services cs
+    JOIN customers c ON cs.customer_id = c.id
+    WHERE cs.status = 'active'
+    AND (cs.pppoe_username IS NULL OR cs.pppoe_password IS NULL)
+    AND cs.id > %(lo)s AND cs.id <= %(hi)s
+    ORDER BY cs.id
+"""
+
+
+def pppoe_chunk(cur, lo, hi, allocator):
+    """Generate missing PPPoE credentials for active services with lo < id <= hi"""
+    cur.execute(PPPOE_CHUNK_QUERY, {'lo': lo, 'hi': hi})
+    return len(pppoe_credentials.fill_credentials(cur, cur.fetchall(), allocator))
+
+
+def sql_chunk(sql):
+    def apply(cur, lo, hi, context):
+        cur.execute(sql, {'lo': lo, 'hi': hi})
+        return cur.rowcount
+    return apply
+
+
+# name -> table walked by its integer "id" key, optional setup(conn) -> context, and
+# apply(cur, lo, hi, context) -> rows updated for keys in (lo, hi]
+JOBS = {
+    'pppoe_credentials': {
+        'table': 'customer_services',
+        'setup': UsernameAllocator.load,
+        'apply': pppoe_chunk,
+    },
+    'payroll_employee_name': {
+        'table': 'payroll_records',
+        'apply': sql_chunk(EMPLOYEE_NAME_SQL),
+    },
+}
+
+
+def ensure_state(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS backfill_state (
+                name VARCHAR(64) PRIMARY KEY,
+                last_key BIGINT NOT NULL DEFAULT 0,
+                rows_updated BIGINT NOT NULL DEFAULT 0,
+                started_at TIMESTAMP DEFAULT NOW(),
+                updated_at TIMESTAMP DEFAULT NOW(),
+                completed_at TIMESTAMP
+            )
+        """)
+    conn.commit()
+
+
+def load_state(cur, name, reset=False, restart_completed=False):
+    """
+    Return (last key, rows updated so far), creating or resetting the state row.
+    With restart_completed, a run that finished last time starts again from the first key.
+    """
+    if reset:
+        cur.execute("DELETE FROM backfill_state WHERE name = %s", (name,))
+    cur.execute("""
+        INSERT INTO backfill_state (name) VALUES (%(name)s)
+        ON CONFLICT (name) DO UPDATE
+        SET completed_at = NULL,
+            last_key = CASE WHEN %(restart)s AND backfill_state.completed_at IS NOT NULL
+                            THEN 0 ELSE backfill_state.last_key END,
+            rows_updated = CASE WHEN %(restart)s AND backfill_state.completed_at IS NOT NULL
+                                THEN 0 ELSE backfill_state.rows_updated END,
+            started_at = CASE WHEN %(restart)s AND backfill_state.completed_at IS NOT NULL
+                              THEN NOW() ELSE backfill_state.started_at END
+        RETURNING last_key, rows_updated
+    """, {'name': name, 'restart': restart_completed})
+    return cur.fetchone()
+
+
+def next_chunk_end(cur, table, lo, chunk_size):
+    """Key of the chunk_size-th row after lo, or None when the table is exhausted"""
+    cur.execute(f"""
+        SELECT MAX(id) FROM (
+            SELECT id FROM {table} WHERE id > %s ORDER BY id LIMIT %s
+        ) chunk
+    """, (lo, chunk_size))
+    return cur.fetchone()[0]
+
+
+def replication_lag(cur):
+    """Worst replay lag in seconds across connected replicas (0 without replicas)"""
+    cur.execute("""
+        SELECT COALESCE(MAX(EXTRACT(EPOCH FROM replay_lag)), 0) FROM pg_stat_replication
+    """)
+    return float(cur.fetchone()[0])
+
+
+def wait_for_replicas(conn, max_lag_seconds, poll_seconds=1.0):
+    with conn.cursor() as cur:
+        lag = replication_lag(cur)
+        while lag > max_lag_seconds:
+            print(f"    replica lag {lag:.1f}s > {max_lag_seconds}s, pausing")
+            time.sleep(poll_seconds)
+            lag = replication_lag(cur)
+    conn.commit()
+
+
+def add_chunk_arguments(parser):
+    """--chunked run options for scripts that walk customer_services through run_chunks()"""
+    group = parser.add_argument_group("chunked run")
+    group.add_argument("--chunked", action="store_true",
+                       help="commit per chunk of service ids and resume an interrupted run")
+    group.add_argument("--chunk-size", type=int, default=1000, help="service ids per transaction")
+    group.add_argument("--max-rows-per-sec", type=float, help="throttle to this many services/sec")
+    group.add_argument("--max-lag-seconds", type=float, help="pause while replica lag exceeds this")
+    group.add_argument("--reset", action="store_true", help="ignore saved progress and start over")
+
+
+def run(conn, name, chunk_size=1000, max_rows_per_sec=None, max_lag_seconds=None,
+        reset=False, on_chunk=None):
+    """Run (or resume) a backfill job; returns (rows updated this run, seconds)"""
+    job = JOBS[name]
+    return run_chunks(conn, name, job['table'], job['apply'], job.get('setup'),
+                      chunk_size=chunk_size, max_rows_per_sec=max_rows_per_sec,
+                      max_lag_seconds=max_lag_seconds, reset=reset, on_chunk=on_chunk)
+
+
+def run_chunks(conn, name, table, apply, setup=None, chunk_size=1000, max_rows_per_sec=None,
+               max_lag_seconds=None, reset=False, restart_completed=False, on_chunk=None):
+    """
+    Walk table by id in committed chunks, calling apply(cur, lo, hi, context) for keys in
+    (lo, hi]; progress is saved under name in the chunk's transaction. Also used by the
+    provisioning scripts' --chunked mode. Returns (rows this run, seconds).
+    """
+    ensure_state(conn)
+    cur = conn.cursor()
+    last_key, previous_rows = load_state(cur, name, reset=reset, restart_completed=restart_completed)
+    conn.commit()
+    context = setup(conn) if setup else None
+
+    started = time.perf_counter()
+    updated = 0
+    while True:
+        hi = next_chunk_end(cur, table, last_key, chunk_size)
+        if hi is None:
+            break
+
+        rows = apply(cur, last_key, hi, context)
+        cur.execute("""
+            UPDATE backfill_state
+            SET last_key = %s, rows_updated = rows_updated + %s, updated_at = NOW()
+            WHERE name = %s
+        """, (hi, rows, name))
+        conn.commit()
+
+        last_key = hi
+        updated += rows
+        if on_chunk:
+            on_chunk(last_key, updated)
+
+        if max_rows_per_sec:
+            # Sleep until the run is back under the target rate
+            ahead = updated / max_rows_per_sec - (time.perf_counter() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+        if max_lag_seconds is not None:
+            wait_for_replicas(conn, max_lag_seconds)
+
+    cur.execute("UPDATE backfill_state SET completed_at = NOW() WHERE name = %s", (name,))
+    conn.commit()
+    cur.close()
+    return updated, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill a column in committed primary-key chunks")
+    parser.add_argument("job", choices=sorted(JOBS))
+    parser.add_argument("--chunk-size", type=int, default=1000, help="keys walked per transaction")
+    parser.add_argument("--max-rows-per-sec", type=float, help="throttle to this many updated rows/sec")
+    parser.add_argument("--max-lag-seconds", type=float, help="pause while replica lag exceeds this")
+    parser.add_argument("--reset", action="store_true", help="ignore saved progress and start over")
+    args = parser.parse_args()
+
+    conn = db.connect()
+
+    def report(last_key, updated):
+        print(f"  ✓ up to id {last_key}: {updated:,} rows updated")
+
+    print(f"Backfilling {args.job}...")
+    try:
+        updated, elapsed = run(conn, args.job, chunk_size=args.chunk_size,
+                               max_rows_per_sec=args.max_rows_per_sec,
+                               max_lag_seconds=args.max_lag_seconds,
+                               reset=args.reset, on_chunk=report)
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Backfill stopped: {e}")
+        print("   Re-run the same command to resume from the last committed chunk")
+        exit(1)
+    finally:
+        conn.close()
+
+    print(f"\n✓ {args.job}: {updated:,} rows updated in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
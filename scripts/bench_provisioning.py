@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Provisioning benchmark harness
+Seeds a disposable PostgreSQL database with synthetic customers, service_plans and
+customer_services (RADIUS tables from create_standard_radius_schema.sql), then runs each
+Python provisioning script end to end in three phases:
+
+    cold   - empty radcheck/radreply, everything is created
+    warm   - immediate re-run, nothing should change
+    churn  - after changing --churn percent of passwords and one plan's speeds
+
+Results (seconds, rows/sec, statement counts, peak RSS per run) are written as JSON so runs
+at 1k/10k/100k subscribers can be compared across changes.
+
+THIS DROPS AND RECREATES TABLES in the target database. Point it at a scratch database:
+    BENCH_DATABASE_URL=postgresql://localhost/isp_bench \\
+        python3 scripts/bench_provisioning.py --reset --subscribers 1000 10000 --output bench.json
+
+With --ephemeral, a throwaway server is started via the optional testing.postgresql package.
+"""
+
+import argparse
+import json
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+import psycopg2
+
+import migrate
+import radius_bulk
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (script, extra args) pairs timed by default
+SCENARIOS = [
+    ("provision_all_radius_users.py", []),
+    ("provision_all_radius_users.py", ["--bulk"]),
+    ("provision_all_radius_users.py", ["--group-profiles"]),
+    ("provision_async.py", []),
+    ("sync_radius_delta.py", ["--full"]),
+    ("check_and_provision_radius.py", ["--stream"]),
+    ("complete_radius_setup.py", ["--stream"]),
+]
+
+# Repo SQL migrations applied on top of the base schema, in order
+MIGRATIONS = [
+    "1020_add_provisioning_queue.sql",
+    "1062_add_radius_sync_watermark.sql",
+    "1063_add_provisioning_queue_retry.sql",
+    "1064_add_radius_group_profiles.sql",
+    "1069_add_radius_settings.sql",
+]
+
+# migrate.py migrations the scripts depend on (the ON CONFLICT (username, attribute) targets)
+PY_MIGRATIONS = ["radius_username_attribute_unique"]
+
+APP_SCHEMA = """
+    DROP TABLE IF EXISTS customer_services, service_plans, customers, network_devices,
+        radcheck, radreply, radgroupcheck, radgroupreply, radusergroup, radacct, radpostauth, nas,
+        provisioning_queue, radius_sync_state, radius_synced_services, radius_settings,
+        schema_migrations CASCADE;
+
+    CREATE TABLE network_devices (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(255),
+        type VARCHAR(50),
+        ip_address INET
+    );
+
+    CREATE TABLE customers (
+        id SERIAL PRIMARY KEY,
+        first_name VARCHAR(100),
+        last_name VARCHAR(100),
+        name VARCHAR(255),
+        email VARCHAR(255),
+        phone VARCHAR(50),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE service_plans (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(255),
+        download_speed INTEGER,
+        upload_speed INTEGER,
+        speed_download INTEGER,
+        speed_upload INTEGER,
+        data_limit INTEGER,
+        price DECIMAL(10, 2),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE customer_services (
+        id SERIAL PRIMARY KEY,
+        customer_id INTEGER REFERENCES customers(id) ON DELETE CASCADE,
+        service_plan_id INTEGER REFERENCES service_plans(id) ON DELETE SET NULL,
+        status VARCHAR(50) DEFAULT 'active',
+        ip_address VARCHAR(45),
+        pppoe_username VARCHAR(255),
+        pppoe_password VARCHAR(255),
+        service_start TIMESTAMP,
+        service_end TIMESTAMP,
+        is_active BOOLEAN DEFAULT false,
+        is_suspended BOOLEAN DEFAULT false,
+        router_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX idx_customer_services_pppoe_username ON customer_services(pppoe_username);
+"""
+
+# radius_settings too: provision_all --group-profiles persists the mode for later scenarios
+RADIUS_TABLES = ("radcheck", "radreply", "radusergroup", "radgroupreply",
+                 "radius_synced_services", "radius_sync_state", "radius_settings")
+
+
+def radius_schema_sql():
+    """The table/index part of create_standard_radius_schema.sql (before its data migration)"""
+    with open(os.path.join(SCRIPTS_DIR, "create_standard_radius_schema.sql")) as f:
+        sql = f.read()
+    return sql.split("-- Migrate data from radius_users")[0]
+
+
+def create_schema(conn):
+    cur = conn.cursor()
+    cur.execute(APP_SCHEMA)
+    cur.execute(radius_schema_sql())
+    for name in MIGRATIONS:
+        with open(os.path.join(SCRIPTS_DIR, name)) as f:
+            cur.execute(f.read())
+    conn.commit()
+    cur.close()
+    migrate.run(PY_MIGRATIONS, conn=conn)
+
+
+def random_password(rng, length=12):
+    return ''.join(rng.choice(string.ascii_letters + string.digits) for _ in range(length))
+
+
+def seed(conn, subscribers, plans, missing_credentials, seed_value=42):
+    """Truncate and COPY synthetic data; a fraction of services start without credentials"""
+    rng = random.Random(seed_value)
+    cur = conn.cursor()
+    cur.execute("TRUNCATE customer_services, customers, service_plans, "
+                + ", ".join(RADIUS_TABLES) + " RESTART IDENTITY CASCADE")
+
+    speeds = [5, 10, 20, 30, 50, 100, 200, 500, 1000]
+    plan_rows = []
+    for plan_id in range(1, plans + 1):
+        down = rng.choice(speeds)
+        up = max(1, down // rng.choice((1, 2, 4)))
+        plan_rows.append((plan_id, f"Plan {plan_id}", down, up, down, up, 0, 1000 + plan_id))
+    radius_bulk.copy_rows(cur, "service_plans", (
+        "id", "name", "download_speed", "upload_speed", "speed_download", "speed_upload",
+        "data_limit", "price"), plan_rows)
+
+    first_names = ["john", "mary", "peter", "grace", "james", "faith", "paul", "ann"]
+    customer_rows = []
+    service_rows = []
+    missing = []
+    for customer_id in range(1, subscribers + 1):
+        first = rng.choice(first_names)
+        last = f"doe{rng.randint(1, subscribers)}"
+        # Deliberately shared email prefixes to exercise username collision handling
+        email = f"{first}.{last}@example.com"
+        customer_rows.append((customer_id, first, last, f"{first} {last}", email, f"07{customer_id:08d}"))
+        if rng.random() < missing_credentials:
+            missing.append(customer_id)
+        service_rows.append((customer_id, customer_id, rng.randint(1, plans), "active",
+                             f"10.{customer_id // 65536 % 256}.{customer_id // 256 % 256}.{customer_id % 256}",
+                             f"bench{customer_id}", random_password(rng)))
+
+    radius_bulk.copy_rows(cur, "customers",
+                          ("id", "first_name", "last_name", "name", "email", "phone"), customer_rows)
+    radius_bulk.copy_rows(cur, "customer_services", (
+        "id", "customer_id", "service_plan_id", "status", "ip_address",
+        "pppoe_username", "pppoe_password"), service_rows)
+    if missing:
+        cur.execute("""
+            UPDATE customer_services SET pppoe_username = NULL, pppoe_password = NULL
+            WHERE id = ANY(%s)
+        """, (missing,))
+
+    for table in ("customers", "service_plans", "customer_services"):
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))")
+    cur.execute("ANALYZE")
+    conn.commit()
+    cur.close()
+
+
+def churn(conn, percent, seed_value=7):
+    """Change passwords for percent% of services and the speeds of one plan"""
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE customer_services
+        SET pppoe_password = md5(random()::text || id::text)
+        WHERE pppoe_password IS NOT NULL
+        AND (hashtext(id::text || %s) & 2147483647) %% 100 < %s
+    """, (str(seed_value), percent))
+    changed = cur.rowcount
+    cur.execute("UPDATE service_plans SET download_speed = download_speed + 1 WHERE id = 1")
+    conn.commit()
+    cur.close()
+    return changed
+
+
+def reset_radius(conn):
+    cur = conn.cursor()
+    cur.execute("TRUNCATE " + ", ".join(RADIUS_TABLES))
+    conn.commit()
+    cur.close()
+
+
+def statement_stats_available(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_stat_statements_reset()")
+        conn.commit()
+        return True
+    except psycopg2.Error:
+        conn.rollback()
+        return False
+    finally:
+        cur.close()
+
+
+def statement_count(conn):
+    """Statements executed against this database since the last reset (pg_stat_statements)"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT COALESCE(SUM(calls), 0) FROM pg_stat_statements
+        WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+    """)
+    count = int(cur.fetchone()[0])
+    cur.close()
+    return count
+
+
+def run_script(database_url, script, args):
+    """
+    Run one script as a child process; returns (exit code, seconds, peak RSS MB, output, metrics).
+    metrics is the script's own instrumentation JSON (phases, statements by query) if it opts in.
+    """
+    fd, metrics_path = tempfile.mkstemp(prefix="bench-metrics-", suffix=".json")
+    os.close(fd)
+    os.unlink(metrics_path)
+    env = dict(os.environ, DATABASE_URL=database_url, PYTHONUNBUFFERED="1", METRICS_JSON=metrics_path)
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(SCRIPTS_DIR, script), *args],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env, cwd=SCRIPTS_DIR,
+    )
+    output = proc.stdout.read()
+    # wait4 gives the resource usage of this specific child
+    _, status, rusage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - started
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    peak_rss = rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    metrics = None
+    if os.path.exists(metrics_path):
+        with open(metrics_path) as f:
+            metrics = json.load(f)
+        os.unlink(metrics_path)
+    return proc.returncode, seconds, peak_rss, output.decode(errors="replace"), metrics
+
+
+def run_benchmark(database_url, sizes, plans, churn_percent, missing_credentials, scenarios, verbose=False):
+    conn = psycopg2.connect(database_url)
+    has_statements = statement_stats_available(conn)
+    if not has_statements:
+        print("⚠️  pg_stat_statements not available - statement counts will be null")
+
+    results = []
+    for subscribers in sizes:
+        for script, args in scenarios:
+            print(f"\n=== {subscribers} subscribers: {script} {' '.join(args)} ===")
+            started = time.perf_counter()
+            seed(conn, subscribers, plans, missing_credentials)
+            reset_radius(conn)
+            seed_seconds = time.perf_counter() - started
+            print(f"  seed: {seed_seconds:.2f}s")
+
+            for phase in ("cold", "warm", "churn"):
+                changed = None
+                if phase == "churn":
+                    changed = churn(conn, churn_percent)
+                if has_statements:
+                    statement_stats_available(conn)
+                code, seconds, peak_rss, output, metrics = run_script(database_url, script, args)
+                statements = statement_count(conn) if has_statements else None
+                result = {
+                    "subscribers": subscribers,
+                    "plans": plans,
+                    "script": script,
+                    "args": args,
+                    "phase": phase,
+                    "exit_code": code,
+                    "seconds": round(seconds, 4),
+                    "rows_per_second": round(subscribers / seconds, 1) if seconds > 0 else None,
+                    "statements": statements,
+                    "peak_rss_mb": round(peak_rss, 1),
+                    "seed_seconds": round(seed_seconds, 4),
+                    "services_changed": changed,
+                    "phases": metrics["phases"] if metrics else None,
+                    "queries": metrics["queries"] if metrics else None,
+                }
+                results.append(result)
+                status = "✓" if code == 0 else "❌"
+                print(f"  {status} {phase}: {seconds:.2f}s, {result['rows_per_second']} rows/sec, "
+                      f"{statements} statements, {peak_rss:.1f} MB")
+                if code != 0 or verbose:
+                    print(output[-2000:])
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RADIUS provisioning scripts")
+    parser.add_argument("--database-url", default=os.environ.get("BENCH_DATABASE_URL"),
+                        help="scratch database (default: BENCH_DATABASE_URL)")
+    parser.add_argument("--ephemeral", action="store_true",
+                        help="start a throwaway server with testing.postgresql")
+    parser.add_argument("--reset", action="store_true",
+                        help="required: acknowledge that the benchmark tables are dropped and recreated")
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--plans", type=int, default=20)
+    parser.add_argument("--churn", type=int, default=5, help="percent of passwords changed in the churn phase")
+    parser.add_argument("--missing-credentials", type=float, default=0.1,
+                        help="fraction of services seeded without PPPoE credentials")
+    parser.add_argument("--script", action="append",
+                        help="only run scenarios for this script (repeatable)")
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--verbose", action="store_true", help="print script output for every run")
+    args = parser.parse_args()
+
+    postgresql = None
+    database_url = args.database_url
+    if args.ephemeral:
+        try:
+            import testing.postgresql
+        except ImportError:
+            print("❌ --ephemeral needs the testing.postgresql package (pip install testing.postgresql)")
+            exit(1)
+        postgresql = testing.postgresql.Postgresql()
+        database_url = postgresql.url()
+    elif not database_url:
+        print("❌ Set BENCH_DATABASE_URL or pass --database-url (or use --ephemeral)")
+        exit(1)
+    elif not args.reset:
+        print("❌ Refusing to drop tables without --reset")
+        exit(1)
+
+    scenarios = [s for s in SCENARIOS if not args.script or s[0] in args.script]
+
+    try:
+        conn = psycopg2.connect(database_url)
+        create_schema(conn)
+        conn.close()
+        results = run_benchmark(database_url, args.subscribers, args.plans, args.churn,
+                                args.missing_credentials, scenarios, verbose=args.verbose)
+    finally:
+        if postgresql:
+            postgresql.stop()
+
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,43 @@
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import argparse
+from psycopg2.extras import NamedTupleCursor, RealDictCursor, execute_values
 
-# Get database URL from environment
-DATABASE_URL = os.environ.get('DATABASE_URL')
+import backfill
+import db
+import instrumentation
+import radius_groups
+from plan_attributes import PlanAttributes
+from username_allocator import UsernameAllocator, email_base
 
-if not DATABASE_URL:
-    print("❌ DATABASE_URL environment variable not set")
-    exit(1)
+parser = argparse.ArgumentParser(description="Check and provision RADIUS users for active services")
+parser.add_argument("--stream", action="store_true",
+                    help="scan active services through a server-side cursor in bounded memory")
+parser.add_argument("--itersize", type=int, default=db.DEFAULT_ITERSIZE,
+                    help="rows fetched per round trip in --stream mode")
+backfill.add_chunk_arguments(parser)
+instrumentation.add_arguments(parser)
+args = parser.parse_args()
+instrumentation.start(args)
+if args.stream and args.chunked:
+    parser.error("--stream and --chunked are mutually exclusive")
+
+db.require_database_url()
+
+ACTIVE_SERVICES_QUERY = """
+    SELECT cs.id, cs.customer_id, cs.status,
+           c.name as customer_name, c.email, c.phone,
+           sp.id as plan_id, sp.name as service_plan, 
+           sp.download_speed, sp.upload_speed,
+           cs.pppoe_username, cs.pppoe_password
+    FROM customer_services cs
+    JOIN customers c ON cs.customer_id = c.id
+    LEFT JOIN service_plans sp ON cs.service_plan_id = sp.id
+    WHERE cs.status = 'active'
+    AND COALESCE(cs.is_suspended, false) = false
+"""
 
 try:
     # Connect to database
-    conn = psycopg2.connect(DATABASE_URL)
+    conn = db.connect()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     print("=== Checking Current RADIUS Users ===")
@@ -52,76 +78,119 @@ try:
     # Now provision RADIUS users for services without credentials
     print("\n=== Provisioning RADIUS Users ===")
     
-    cursor.execute("""
-        SELECT cs.id, cs.customer_id, cs.status,
-               c.name as customer_name, c.email, c.phone,
-               sp.id as plan_id, sp.name as service_plan, 
-               sp.download_speed, sp.upload_speed,
-               cs.pppoe_username, cs.pppoe_password
-        FROM customer_services cs
-        JOIN customers c ON cs.customer_id = c.id
-        LEFT JOIN service_plans sp ON cs.service_plan_id = sp.id
-        WHERE cs.status = 'active'
-    """)
-    
-    active_services = cursor.fetchall()
     provisioned = 0
+    scanned = 0
+    
+    # Every existing radcheck/customer_services username, loaded once
+    with instrumentation.phase("load_usernames"):
+        allocator = UsernameAllocator.load(conn)
+        plans = PlanAttributes.load(conn)
+        # Group profiles mode: users get their plan group, so the profiles must be current
+        radius_groups.ensure_profiles(conn, plans)
     
-    for service in active_services:
-        username = service['pppoe_username']
-        password = service['pppoe_password']
+    def provision_service(service):
+        """Store credentials and create the RADIUS user if missing; True when provisioned"""
+        username = service.pppoe_username
+        password = service.pppoe_password
         
         # Generate credentials if missing
         if not username:
-            # Use customer email or phone as base
-            base = service['email'].split('@')[0] if service['email'] else f"user{service['customer_id']}"
-            username = f"{base}_ppp"
+            # Use customer email or id as base, suffixed until unique
+            username = allocator.allocate(email_base(service.email, service.customer_id, "_ppp"))
         
         if not password:
             import random
             import string
             password = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
         
-        # Update customer service with credentials
+        # Store generated credentials (only then, so unchanged services keep their updated_at)
+        if username != service.pppoe_username or password != service.pppoe_password:
+            cursor.execute("""
+                UPDATE customer_services 
+                SET pppoe_username = %s, pppoe_password = %s
+                WHERE id = %s
+            """, (username, password, service.id))
+        
+        # Check if user already exists in radcheck (in memory, no round trip)
+        if username in allocator.in_radcheck:
+            return False
+        allocator.in_radcheck.add(username)
+        # Insert into radcheck (authentication)
         cursor.execute("""
-            UPDATE customer_services 
-            SET pppoe_username = %s, pppoe_password = %s
-            WHERE id = %s
-        """, (username, password, service['id']))
+            INSERT INTO radcheck (username, attribute, op, value)
+            VALUES (%s, 'Cleartext-Password', ':=', %s)
+        """, (username, password))
         
-        # Check if user already exists in radcheck
-        cursor.execute("SELECT username FROM radcheck WHERE username = %s", (username,))
-        existing = cursor.fetchone()
+        # Insert plan attributes (speed limits) into radreply, or the plan group in group profiles mode
+        download_speed, upload_speed = plans.speeds(service.plan_id)
+        replies = dict(plans.user_attributes(service.plan_id))
+        replies.setdefault('Framed-IP-Address', '0.0.0.0')
+        execute_values(cursor, """
+            INSERT INTO radreply (username, attribute, op, value)
+            VALUES %s
+        """, [(username, attribute, ':=', value) for attribute, value in replies.items()])
+        group = plans.group(service.plan_id)
+        if group:
+            db.execute_prepared(conn, "radius_user_group", (username, group), cur=cursor)
         
-        if not existing:
-            # Insert into radcheck (authentication)
-            cursor.execute("""
-                INSERT INTO radcheck (username, attribute, op, value)
-                VALUES (%s, 'Cleartext-Password', ':=', %s)
-            """, (username, password))
-            
-            # Insert speed limits into radreply
-            download_speed = service['download_speed'] or 10
-            upload_speed = service['upload_speed'] or 10
-            
-            cursor.execute("""
-                INSERT INTO radreply (username, attribute, op, value)
-                VALUES 
-                    (%s, 'Mikrotik-Rate-Limit', ':=', %s),
-                    (%s, 'Framed-IP-Address', ':=', '0.0.0.0')
-            """, (username, f"{upload_speed}M/{download_speed}M", username))
-            
-            provisioned += 1
-            print(f"✓ Provisioned: {username} (Customer: {service['customer_name']}, Speed: {download_speed}M/{upload_speed}M)")
+        print(f"✓ Provisioned: {username} (Customer: {service.customer_name}, Speed: {download_speed}M/{upload_speed}M)")
+        return True
     
-    conn.commit()
+    if args.chunked:
+        chunk_query = ACTIVE_SERVICES_QUERY + """
+    AND cs.id > %(lo)s AND cs.id <= %(hi)s
+    ORDER BY cs.id
+"""
+        scan = conn.cursor(cursor_factory=NamedTupleCursor)
+        
+        def provision_chunk(chunk_cur, lo, hi, context):
+            global provisioned
+            scan.execute(chunk_query, {'lo': lo, 'hi': hi})
+            chunk = scan.fetchall()
+            for service in chunk:
+                if provision_service(service):
+                    provisioned += 1
+            return len(chunk)
+        
+        # Each chunk commits with its progress in backfill_state; a re-run resumes after the last one
+        try:
+            with instrumentation.phase("provision"):
+                scanned, _ = backfill.run_chunks(
+                    conn, "check_and_provision_radius", "customer_services", provision_chunk,
+                    chunk_size=args.chunk_size, max_rows_per_sec=args.max_rows_per_sec,
+                    max_lag_seconds=args.max_lag_seconds, reset=args.reset, restart_completed=True,
+                    on_chunk=lambda last_key, done: print(f"  ✓ up to service id {last_key}: {done:,} services"),
+                )
+        except Exception:
+            conn.rollback()
+            print("   Re-run with --chunked to resume from the last committed chunk")
+            raise
+    else:
+        if args.stream:
+            # Rows arrive itersize at a time from a server-side cursor
+            active_services = db.stream(conn, ACTIVE_SERVICES_QUERY, itersize=args.itersize)
+        else:
+            scan = conn.cursor(cursor_factory=NamedTupleCursor)
+            scan.execute(ACTIVE_SERVICES_QUERY)
+            active_services = scan.fetchall()
+        
+        with instrumentation.phase("provision"):
+            for service in active_services:
+                scanned += 1
+                if provision_service(service):
+                    provisioned += 1
+        
+        with instrumentation.phase("commit"):
+            conn.commit()
+    instrumentation.add_rows(scanned)
     
     print(f"\n=== Summary ===")
     print(f"Total RADIUS users provisioned: {provisioned}")
     print(f"Total users in radcheck now: {radcheck_count + provisioned}")
+    print(f"Active services scanned: {scanned} (peak RSS {db.peak_rss_mb():.1f} MB)")
     
     # If no active services, create test user
-    if len(active_services) == 0:
+    if scanned == 0:
         print("\n⚠️  No active customer services found. Creating test user...")
         cursor.execute("""
             INSERT INTO radcheck (username, attribute, op, value)
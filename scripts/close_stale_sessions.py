@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Close stale radacct sessions
+Sessions stay open (acctstoptime IS NULL) forever when a NAS reboots or loses its RADIUS
+link without sending Accounting-Stop. This closes them in set-based, committed batches:
+
+    --stale     sessions with no interim update for N x the interim interval; closed at their
+                last update with Acct-Terminate-Cause 'Stale-Session'
+    --nas IP    every open session of that NAS (e.g. after a reboot); closed now with
+                'NAS-Reboot', like FreeRADIUS does on Accounting-On
+
+acctsessiontime is computed server-side from acctstarttime. Uses the radacct_bulk_timeout
+and radacct_bulk_close indexes from create_standard_radius_schema.sql; on the partitioned
+1021 table (no AcctUpdateTime) the last update is acctstarttime + acctsessiontime.
+
+Usage:
+    python3 scripts/close_stale_sessions.py --stale --interim-interval 300 --multiplier 3
+    python3 scripts/close_stale_sessions.py --nas 10.0.0.1 --nas 10.0.0.2
+"""
+
+import argparse
+import time
+
+import db
+
+CLOSE_QUERY = """
+    WITH batch AS (
+        SELECT radacctid
+        FROM radacct
+        WHERE acctstoptime IS NULL
+        AND {where}
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    closed AS (
+        UPDATE radacct r
+        SET acctstoptime = {stop},
+            acctsessiontime = GREATEST(0, EXTRACT(EPOCH FROM ({stop}) - r.acctstarttime))::bigint,
+            acctterminatecause = %(cause)s
+            {set_update_time}
+        FROM batch
+        WHERE r.radacctid = batch.radacctid
+        AND r.acctstoptime IS NULL
+        RETURNING r.nasipaddress
+    )
+    SELECT host(nasipaddress), COUNT(*) FROM closed GROUP BY 1
+"""
+
+COUNT_QUERY = """
+    SELECT host(nasipaddress), COUNT(*)
+    FROM radacct
+    WHERE acctstoptime IS NULL
+    AND {where}
+    GROUP BY 1
+"""
+
+
+def has_update_time(cur):
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'radacct' AND column_name = 'acctupdatetime'
+    """)
+    return cur.fetchone() is not None
+
+
+def stale_clause(with_update_time):
+    """(where, stop expression) for sessions silent for longer than the cutoff"""
+    if with_update_time:
+        # Split so each branch can use radacct_bulk_timeout / the start-time index
+        where = """(
+            acctupdatetime < NOW() - make_interval(secs => %(silence)s)
+            OR (acctupdatetime IS NULL AND acctstarttime < NOW() - make_interval(secs => %(silence)s))
+        )"""
+        stop = "COALESCE(r.acctupdatetime, r.acctstarttime + make_interval(secs => COALESCE(r.acctsessiontime, 0)))"
+    else:
+        where = """acctstarttime + make_interval(secs => COALESCE(acctsessiontime, 0))
+            < NOW() - make_interval(secs => %(silence)s)"""
+        stop = "r.acctstarttime + make_interval(secs => COALESCE(r.acctsessiontime, 0))"
+    return where, stop
+
+
+def nas_clause():
+    where = "nasipaddress = %(nas)s::inet AND acctstarttime <= %(before)s"
+    return where, "%(before)s::timestamptz"
+
+
+def close_sessions(conn, where, stop, params, cause, batch_size, with_update_time, on_batch=None):
+    """Close matching sessions batch by batch; returns {nas: sessions closed}"""
+    set_update_time = f", acctupdatetime = {stop}" if with_update_time else ""
+    query = CLOSE_QUERY.format(where=where, stop=stop, set_update_time=set_update_time)
+    params = dict(params, limit=batch_size, cause=cause)
+    per_nas = {}
+    cur = conn.cursor()
+    while True:
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        conn.commit()
+        closed = 0
+        for nas, count in rows:
+            per_nas[nas] = per_nas.get(nas, 0) + count
+            closed += count
+        if on_batch:
+            on_batch(closed)
+        if closed < batch_size:
+            break
+    cur.close()
+    return per_nas
+
+
+def count_sessions(conn, where, params):
+    cur = conn.cursor()
+    cur.execute(COUNT_QUERY.format(where=where), params)
+    per_nas = dict(cur.fetchall())
+    cur.close()
+    conn.rollback()
+    return per_nas
+
+
+def print_report(title, per_nas):
+    print(f"\n{title}")
+    if not per_nas:
+        print("  (none)")
+        return
+    for nas, count in sorted(per_nas.items(), key=lambda item: -item[1]):
+        print(f"  {nas:<18} {count:>8}")
+    print(f"  {'total':<18} {sum(per_nas.values()):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Close stale radacct sessions in batches")
+    parser.add_argument("--stale", action="store_true",
+                        help="close sessions without an interim update for multiplier x interval")
+    parser.add_argument("--interim-interval", type=int, default=300,
+                        help="Acct-Interim-Interval the NASes use, in seconds (default 300)")
+    parser.add_argument("--multiplier", type=float, default=3.0,
+                        help="missed interim updates before a session counts as stale")
+    parser.add_argument("--nas", action="append", default=[],
+                        help="close every open session of this NAS IP (repeatable)")
+    parser.add_argument("--before", help="with --nas, only sessions started before this timestamp "
+                                         "(default: now)")
+    parser.add_argument("--batch-size", type=int, default=5000, help="sessions per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be closed")
+    args = parser.parse_args()
+
+    if not args.stale and not args.nas:
+        parser.error("nothing to do: pass --stale and/or --nas")
+
+    conn = db.connect()
+    cur = conn.cursor()
+    with_update_time = has_update_time(cur)
+    cur.execute("SELECT COALESCE(%s::timestamptz, NOW())", (args.before,))
+    before = cur.fetchone()[0]
+    cur.close()
+    conn.commit()
+
+    started = time.perf_counter()
+    try:
+        if args.stale:
+            where, stop = stale_clause(with_update_time)
+            params = {'silence': args.interim_interval * args.multiplier}
+            if args.dry_run:
+                per_nas = count_sessions(conn, where, params)
+            else:
+                per_nas = close_sessions(conn, where, stop, params, 'Stale-Session',
+                                         args.batch_size, with_update_time)
+            print_report(f"Stale sessions (no update for {params['silence']:.0f}s)"
+                         f"{' - dry run' if args.dry_run else ' closed'}:", per_nas)
+
+        for nas in args.nas:
+            where, stop = nas_clause()
+            params = {'nas': nas, 'before': before}
+            if args.dry_run:
+                per_nas = count_sessions(conn, where, params)
+            else:
+                per_nas = close_sessions(conn, where, stop, params, 'NAS-Reboot',
+                                         args.batch_size, with_update_time)
+            print_report(f"Open sessions on {nas}{' - dry run' if args.dry_run else ' closed'}:", per_nas)
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Error: {e}")
+        exit(1)
+    finally:
+        conn.close()
+
+    print(f"\n✓ Done in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
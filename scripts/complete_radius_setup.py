@@ -1,27 +1,42 @@
-import os
-import psycopg2
-import random
-import string
+import argparse
 
-def generate_password(length=12):
-    """Generate a secure random password"""
-    chars = string.ascii_letters + string.digits + "!@#$%"
-    return ''.join(random.choice(chars) for _ in range(length))
+import db
+import instrumentation
+import pppoe_credentials
+import radius_groups
+from plan_attributes import PlanAttributes
 
-def generate_username(customer_name, customer_id):
-    """Generate PPPoE username from customer name"""
-    # Remove special characters and spaces, convert to lowercase
-    clean_name = ''.join(c for c in customer_name if c.isalnum()).lower()
-    return f"{clean_name}{customer_id}"
+RADIUS_USERS_QUERY = """
+    SELECT 
+        cs.pppoe_username,
+        cs.pppoe_password,
+        cs.service_plan_id,
+        c.name as customer_name
+    FROM customer_services cs
+    JOIN customers c ON cs.customer_id = c.id
+    WHERE cs.status = 'active'
+    AND COALESCE(cs.is_suspended, false) = false
+    AND cs.pppoe_username IS NOT NULL
+    AND cs.pppoe_password IS NOT NULL
+"""
+
+parser = argparse.ArgumentParser(description="Complete RADIUS setup for active services")
+parser.add_argument("--stream", action="store_true",
+                    help="read services to provision through a server-side cursor in bounded memory")
+parser.add_argument("--itersize", type=int, default=db.DEFAULT_ITERSIZE,
+                    help="rows fetched per round trip in --stream mode")
+parser.add_argument("--chunk-size", type=int, default=5000,
+                    help="services per credential-generation UPDATE/commit")
+instrumentation.add_arguments(parser)
+args = parser.parse_args()
+instrumentation.start(args)
 
 # Connect to PostgreSQL
-DATABASE_URL = os.environ.get('DATABASE_URL')
-if not DATABASE_URL:
-    print("❌ DATABASE_URL environment variable not set")
-    exit(1)
+db.require_database_url()
+conn = None
 
 try:
-    conn = psycopg2.connect(DATABASE_URL)
+    conn = db.connect()
     cur = conn.cursor()
     
     print("=" * 60)
@@ -38,100 +53,60 @@ try:
     conn.commit()
     print("✓ PPPoE columns added to customer_services table")
     
-    # Step 2: Get all active customer services without PPPoE credentials
+    # Step 2: Count active customer services without PPPoE credentials
     print("\n[2/4] Finding active services without PPPoE credentials...")
-    cur.execute("""
-        SELECT 
-            cs.id as service_id,
-            cs.customer_id,
-            c.name as customer_name,
-            cs.status,
-            sp.name as plan_name,
-            sp.download_speed,
-            sp.upload_speed
-        FROM customer_services cs
-        JOIN customers c ON cs.customer_id = c.id
-        LEFT JOIN service_plans sp ON cs.service_plan_id = sp.id
-        WHERE cs.status = 'active'
-        AND (cs.pppoe_username IS NULL OR cs.pppoe_password IS NULL)
-        LIMIT 100;
-    """)
-    services = cur.fetchall()
-    print(f"✓ Found {len(services)} active services needing PPPoE credentials")
+    pending = pppoe_credentials.count_pending(cur)
+    print(f"✓ Found {pending} active services needing PPPoE credentials")
     
-    # Step 3: Generate and save PPPoE credentials
+    # Step 3: Generate and save PPPoE credentials in committed chunks
     print("\n[3/4] Generating PPPoE credentials...")
-    provisioned_count = 0
     
-    for service in services:
-        service_id, customer_id, customer_name, status, plan_name, download_speed, upload_speed = service
-        
-        # Generate credentials
-        username = generate_username(customer_name, customer_id)
-        password = generate_password()
-        
-        # Save to customer_services
-        cur.execute("""
-            UPDATE customer_services
-            SET pppoe_username = %s, pppoe_password = %s
-            WHERE id = %s
-        """, (username, password, service_id))
-        
-        print(f"  Generated: {username} for customer {customer_name}")
-        provisioned_count += 1
+    def report_chunk(done, values):
+        print(f"  Generated {done}/{pending} (last: {values[-1][1]})")
     
-    conn.commit()
-    print(f"✓ Generated credentials for {provisioned_count} services")
+    with instrumentation.phase("generate_credentials"):
+        provisioned_count, seconds = pppoe_credentials.generate_credentials(
+            conn, chunk_size=args.chunk_size, on_chunk=report_chunk
+        )
+    print(f"✓ Generated credentials for {provisioned_count} services in {seconds:.2f}s")
     
     # Step 4: Provision to FreeRADIUS radcheck and radreply tables
     print("\n[4/4] Provisioning to FreeRADIUS tables...")
     
+    # Service plans and their reply attributes, loaded once
+    plans = PlanAttributes.load(conn)
+    radius_groups.ensure_profiles(conn, plans)
+    
     # Get all services with PPPoE credentials
-    cur.execute("""
-        SELECT 
-            cs.pppoe_username,
-            cs.pppoe_password,
-            sp.download_speed,
-            sp.upload_speed,
-            c.name as customer_name
-        FROM customer_services cs
-        JOIN customers c ON cs.customer_id = c.id
-        LEFT JOIN service_plans sp ON cs.service_plan_id = sp.id
-        WHERE cs.status = 'active'
-        AND cs.pppoe_username IS NOT NULL
-        AND cs.pppoe_password IS NOT NULL;
-    """)
-    radius_users = cur.fetchall()
+    if args.stream:
+        # Plain tuples, itersize rows per round trip from a server-side cursor
+        radius_users = db.stream(conn, RADIUS_USERS_QUERY, itersize=args.itersize, cursor_factory=None)
+    else:
+        cur.execute(RADIUS_USERS_QUERY)
+        radius_users = cur.fetchall()
     
     radius_count = 0
-    for username, password, download_speed, upload_speed, customer_name in radius_users:
-        # Insert into radcheck (authentication)
-        cur.execute("""
-            INSERT INTO radcheck (username, attribute, op, value)
-            VALUES (%s, 'Cleartext-Password', ':=', %s)
-            ON CONFLICT (username, attribute) 
-            DO UPDATE SET value = EXCLUDED.value;
-        """, (username, password))
+    with instrumentation.phase("provision"):
+        for username, password, plan_id, customer_name in radius_users:
+            # Insert into radcheck (authentication)
+            db.execute_prepared(conn, "radcheck_upsert", (username, password), cur=cur)
         
-        # Insert into radreply (speed limits in MikroTik format)
-        download_limit = f"{int(download_speed or 10)}M/{int(download_speed or 10)}M"
-        upload_limit = f"{int(upload_speed or 10)}M/{int(upload_speed or 10)}M"
+            # Insert into radreply (plan attributes, rendered once per plan), or point the
+            # user at the plan's group profile in group profiles mode
+            for attribute, value in plans.user_attributes(plan_id).items():
+                db.execute_prepared(conn, "radreply_upsert", (username, attribute, value), cur=cur)
+            group = plans.group(plan_id)
+            if group:
+                db.execute_prepared(conn, "radius_user_group", (username, group), cur=cur)
         
-        # MikroTik-Rate-Limit format: "upload/download"
-        rate_limit = f"{upload_limit} {download_limit}"
-        
-        cur.execute("""
-            INSERT INTO radreply (username, attribute, op, value)
-            VALUES (%s, 'Mikrotik-Rate-Limit', ':=', %s)
-            ON CONFLICT (username, attribute)
-            DO UPDATE SET value = EXCLUDED.value;
-        """, (username, rate_limit))
-        
-        print(f"  Provisioned: {username} ({download_speed}↓/{upload_speed}↑ Mbps)")
-        radius_count += 1
+            download_speed, upload_speed = plans.speeds(plan_id)
+            print(f"  Provisioned: {username} ({download_speed}↓/{upload_speed}↑ Mbps)")
+            radius_count += 1
     
-    conn.commit()
-    print(f"✓ Provisioned {radius_count} users to FreeRADIUS")
+    with instrumentation.phase("commit"):
+        conn.commit()
+    instrumentation.add_rows(radius_count)
+    print(f"✓ Provisioned {radius_count} users to FreeRADIUS (peak RSS {db.peak_rss_mb():.1f} MB)")
     
     # Summary
     print("\n" + "=" * 60)
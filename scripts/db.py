@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Shared database access for the Python scripts
+One place for DATABASE_URL handling, connection settings (application_name, statement_timeout),
+a thread-safe connection pool for loops/workers and server-side prepared statements for the
+hot provisioning queries.
+
+    import db
+    conn = db.connect()                      # single connection, tagged in pg_stat_activity
+    with db.pooled() as conn:                # borrowed from the shared pool
+        db.execute_prepared(conn, "radcheck_upsert", (username, password))
+    for row in db.stream(conn, query):       # server-side cursor, bounded memory
+        ...
+"""
+
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extras import NamedTupleCursor
+from psycopg2.pool import ThreadedConnectionPool
+
+import instrumentation
+from plan_attributes import GROUP_PREFIX, GROUP_PRIORITY
+
+DEFAULT_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '300000'))
+DEFAULT_ITERSIZE = 2000
+
+# Hot provisioning statements, prepared once per connection on first use
+STATEMENTS = {
+    "radcheck_exists": (
+        "(text)",
+        "SELECT username FROM radcheck WHERE username = $1 LIMIT 1",
+    ),
+    "radcheck_upsert": (
+        "(text, text)",
+        """
+        INSERT INTO radcheck (username, attribute, op, value)
+        VALUES ($1, 'Cleartext-Password', ':=', $2)
+        ON CONFLICT (username, attribute) DO UPDATE
+        SET op = EXCLUDED.op, value = EXCLUDED.value
+        WHERE radcheck.op IS DISTINCT FROM EXCLUDED.op
+           OR radcheck.value IS DISTINCT FROM EXCLUDED.value
+        """,
+    ),
+    "radreply_upsert": (
+        "(text, text, text)",
+        """
+        INSERT INTO radreply (username, attribute, op, value)
+        VALUES ($1, $2, ':=', $3)
+        ON CONFLICT (username, attribute) DO UPDATE
+        SET op = EXCLUDED.op, value = EXCLUDED.value
+        WHERE radreply.op IS DISTINCT FROM EXCLUDED.op
+           OR radreply.value IS DISTINCT FROM EXCLUDED.value
+        """,
+    ),
+    "radius_user_state": (
+        "(text)",
+        """
+        SELECT 'radcheck', attribute, op, value FROM radcheck WHERE username = $1
+        UNION ALL
+        SELECT 'radreply', attribute, op, value FROM radreply WHERE username = $1
+        """,
+    ),
+    "radius_user_delete": (
+        "(text)",
+        """
+        WITH c AS (DELETE FROM radcheck WHERE username = $1)
+        DELETE FROM radreply WHERE username = $1
+        """,
+    ),
+    # A subscriber's password, reply attributes ($3 names, $4 values), stale-reply cleanup and,
+    # in group profiles mode, plan group ($5; NULL leaves radusergroup alone) in one statement;
+    # returns the number of rows written
+    "radius_user_apply": (
+        "(text, text, text[], text[], text)",
+        """
+        WITH check_row AS (
+            INSERT INTO radcheck (username, attribute, op, value)
+            VALUES ($1, 'Cleartext-Password', ':=', $2)
+            ON CONFLICT (username, attribute) DO UPDATE
+            SET op = EXCLUDED.op, value = EXCLUDED.value
+            WHERE radcheck.op IS DISTINCT FROM EXCLUDED.op
+               OR radcheck.value IS DISTINCT FROM EXCLUDED.value
+            RETURNING 1
+        ),
+        reply_row AS (
+            INSERT INTO radreply (username, attribute, op, value)
+            SELECT $1, r.attribute, ':=', r.value
+            FROM unnest($3::text[], $4::text[]) AS r(attribute, value)
+            ON CONFLICT (username, attribute) DO UPDATE
+            SET op = EXCLUDED.op, value = EXCLUDED.value
+            WHERE radreply.op IS DISTINCT FROM EXCLUDED.op
+               OR radreply.value IS DISTINCT FROM EXCLUDED.value
+            RETURNING 1
+        ),
+        stale AS (
+            DELETE FROM radreply
+            WHERE username = $1 AND attribute <> ALL($3::text[])
+            RETURNING 1
+        ),
+        group_row AS (
+            INSERT INTO radusergroup (username, groupname, priority)
+            SELECT $1, $5, {GROUP_PRIORITY}
+            WHERE $5 IS NOT NULL
+            ON CONFLICT (username, groupname) DO NOTHING
+            RETURNING 1
+        ),
+        stale_group AS (
+            DELETE FROM radusergroup
+            WHERE $5 IS NOT NULL AND username = $1
+            AND groupname LIKE '{GROUP_PREFIX}%' AND groupname <> $5
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM check_row) + (SELECT COUNT(*) FROM reply_row)
+             + (SELECT COUNT(*) FROM stale)
+             + (SELECT COUNT(*) FROM group_row) + (SELECT COUNT(*) FROM stale_group)
+        """.format(GROUP_PREFIX=GROUP_PREFIX, GROUP_PRIORITY=GROUP_PRIORITY),
+    ),
+    # Point a subscriber at one plan group ($2), dropping their other plan groups; returns the
+    # number of rows written
+    "radius_user_group": (
+        "(text, text)",
+        """
+        WITH group_row AS (
+            INSERT INTO radusergroup (username, groupname, priority)
+            VALUES ($1, $2, {GROUP_PRIORITY})
+            ON CONFLICT (username, groupname) DO NOTHING
+            RETURNING 1
+        ),
+        stale_group AS (
+            DELETE FROM radusergroup
+            WHERE username = $1 AND groupname LIKE '{GROUP_PREFIX}%' AND groupname <> $2
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM group_row) + (SELECT COUNT(*) FROM stale_group)
+        """.format(GROUP_PREFIX=GROUP_PREFIX, GROUP_PRIORITY=GROUP_PRIORITY),
+    ),
+    # Active, unsuspended services by service id ($1) or customer id ($2)
+    "activation_services": (
+        "(integer[], integer[])",
+        """
+        SELECT
+            cs.id, cs.customer_id, c.name, cs.pppoe_username, cs.pppoe_password,
+            cs.service_plan_id, NULLIF(split_part(cs.ip_address::text, '/', 1), '')
+        FROM customer_services cs
+        JOIN customers c ON cs.customer_id = c.id
+        WHERE (cs.id = ANY($1) OR cs.customer_id = ANY($2))
+        AND cs.status = 'active'
+        AND COALESCE(cs.is_suspended, false) = false
+        ORDER BY cs.id
+        """,
+    ),
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class Connection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers which STATEMENTS it has prepared"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+    def cursor(self, *args, **kwargs):
+        # Statement timing only when a script opted in to instrumentation
+        if instrumentation.enabled():
+            factory = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+            kwargs["cursor_factory"] = instrumentation.timed_cursor(factory)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        if not instrumentation.enabled():
+            return super().commit()
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            instrumentation.record_query("commit", time.perf_counter() - started)
+
+
+def require_database_url():
+    """Return DATABASE_URL or exit with the scripts' usual error message"""
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print("❌ DATABASE_URL environment variable not set")
+        exit(1)
+    return database_url
+
+
+def default_application_name():
+    """Tag connections with the running script so they are identifiable in pg_stat_activity"""
+    script = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+    return f"isp-scripts/{script}"[:63]
+
+
+def connection_kwargs(application_name=None, statement_timeout_ms=None):
+    options = []
+    timeout = DEFAULT_STATEMENT_TIMEOUT_MS if statement_timeout_ms is None else statement_timeout_ms
+    if timeout:
+        options.append(f"-c statement_timeout={int(timeout)}")
+    kwargs = {
+        "application_name": application_name or default_application_name(),
+        "connection_factory": Connection,
+    }
+    if options:
+        kwargs["options"] = " ".join(options)
+    return kwargs
+
+
+def connect(application_name=None, statement_timeout_ms=None, database_url=None):
+    """Open a single connection with the shared settings"""
+    return psycopg2.connect(
+        database_url or require_database_url(),
+        **connection_kwargs(application_name, statement_timeout_ms),
+    )
+
+
+def get_pool(maxconn=10, minconn=1, application_name=None, statement_timeout_ms=None):
+    """Create (once) and return the process-wide ThreadedConnectionPool"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(
+                minconn, maxconn, require_database_url(),
+                **connection_kwargs(application_name, statement_timeout_ms),
+            )
+        return _pool
+
+
+@contextmanager
+def pooled(**pool_kwargs):
+    """Borrow a connection from the shared pool; it is rolled back if left mid-transaction"""
+    pool = get_pool(**pool_kwargs)
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        pool.putconn(conn, close=bool(conn.closed))
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+def prepare(conn, name):
+    """PREPARE a statement from STATEMENTS on this connection if it is not already prepared"""
+    if name in conn.prepared:
+        return
+    arg_types, query = STATEMENTS[name]
+    with conn.cursor() as cur:
+        cur.execute(f"PREPARE {name} {arg_types} AS {query}")
+    conn.prepared.add(name)
+
+
+def execute_prepared(conn, name, params=(), cur=None):
+    """EXECUTE a prepared statement, preparing it lazily; returns the cursor used"""
+    prepare(conn, name)
+    cur = cur or conn.cursor()
+    if params:
+        placeholders = ", ".join(["%s"] * len(params))
+        cur.execute(f"EXECUTE {name} ({placeholders})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+    return cur
+
+
+def stream(conn, query, params=None, itersize=DEFAULT_ITERSIZE, cursor_factory=NamedTupleCursor):
+    """
+    Yield rows from a named (server-side) cursor, fetching itersize rows per round trip,
+    so large scans run in bounded client memory. The cursor lives in the current
+    transaction: do not commit on this connection until iteration is finished.
+    """
+    name = f"stream_{uuid.uuid4().hex[:12]}"
+    with conn.cursor(name=name, cursor_factory=cursor_factory) as cur:
+        cur.itersize = itersize
+        cur.execute(query, params)
+        yield from cur
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
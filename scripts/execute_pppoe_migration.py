@@ -4,46 +4,26 @@ Execute PPPoE credentials migration immediately
 Adds pppoe_username and pppoe_password columns to customer_services table
 """
 
-import os
-import psycopg2
-from psycopg2 import sql
+import db
+import migrate
 
 def execute_migration():
     """Execute the PPPoE credentials migration"""
     
-    # Get database URL from environment
-    database_url = os.environ.get('DATABASE_URL')
-    if not database_url:
-        print("ERROR: DATABASE_URL environment variable not set")
-        return False
-    
     try:
-        # Connect to database
-        print("Connecting to database...")
-        conn = psycopg2.connect(database_url)
-        cur = conn.cursor()
-        
         print("Adding pppoe_username and pppoe_password columns...")
         
-        # Add columns
-        cur.execute("""
-            ALTER TABLE customer_services 
-            ADD COLUMN IF NOT EXISTS pppoe_username VARCHAR(255),
-            ADD COLUMN IF NOT EXISTS pppoe_password VARCHAR(255)
-        """)
-        
-        # Add index
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_customer_services_pppoe_username 
-            ON customer_services(pppoe_username)
-        """)
-        
-        # Commit changes
-        conn.commit()
+        # Columns under lock_timeout with retries, index built CONCURRENTLY
+        migrate.run(["customer_services_pppoe_credentials"])
         
         print("✓ Successfully added PPPoE credential columns")
         print("✓ Created index on pppoe_username")
         
+        # Connect to database
+        print("Connecting to database...")
+        conn = db.connect()
+        cur = conn.cursor()
+        
         # Verify columns exist
         cur.execute("""
             SELECT column_name 
@@ -69,5 +49,6 @@ def execute_migration():
         return False
 
 if __name__ == "__main__":
+    db.require_database_url()
     success = execute_migration()
     exit(0 if success else 1)
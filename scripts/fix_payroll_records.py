@@ -1,41 +1,25 @@
-import os
-import psycopg2
-from urllib.parse import urlparse
+import backfill
+import db
+import migrate
 
-# Get database URL from environment
-database_url = os.environ.get('DATABASE_URL')
-
-if not database_url:
-    print("ERROR: DATABASE_URL environment variable not found")
-    exit(1)
-
-# Parse the database URL
-result = urlparse(database_url)
+db.require_database_url()
 
 try:
-    # Connect to PostgreSQL
-    conn = psycopg2.connect(
-        database=result.path[1:],
-        user=result.username,
-        password=result.password,
-        host=result.hostname,
-        port=result.port
-    )
-    
-    cursor = conn.cursor()
-    
-    print("Connected to database successfully")
-    
     # Add the employee_name column if it doesn't exist
     print("Adding employee_name column to payroll_records table...")
-    cursor.execute("""
-        ALTER TABLE payroll_records 
-        ADD COLUMN IF NOT EXISTS employee_name VARCHAR(255);
-    """)
-    
-    conn.commit()
+    migrate.run(["payroll_records_employee_name"])
     print("✓ Successfully added employee_name column")
     
+    # Connect to PostgreSQL
+    conn = db.connect()
+    
+    # Populate employee_name from employees in committed chunks (resumable)
+    print("Backfilling employee_name from employees...")
+    updated, elapsed = backfill.run(conn, "payroll_employee_name")
+    print(f"✓ Filled employee_name on {updated} payroll records in {elapsed:.2f}s")
+    
+    cursor = conn.cursor()
+    
     # Verify the column was added
     cursor.execute("""
         SELECT column_name, data_type 
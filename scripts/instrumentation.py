@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Opt-in instrumentation for the provisioning scripts
+Records wall-clock time per phase, statement counts and latency histograms by query name,
+rows processed and peak RSS, and writes them as JSON and/or a Prometheus textfile
+(for node_exporter's textfile collector). --profile dumps a cProfile of the whole run.
+
+    import instrumentation
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.start(args)             # writes the outputs at exit
+    with instrumentation.phase("select"):
+        cur.execute(...)                    # statements on db.connect() connections are timed
+    instrumentation.add_rows(len(services))
+
+Statements are named after the prepared statement (EXECUTE radcheck_upsert), a leading
+/* name: ... */ comment, or otherwise "<verb> <table>" (e.g. "select radcheck").
+Outputs can also be requested with METRICS_JSON / METRICS_PROM / PROFILE_OUTPUT.
+"""
+
+import atexit
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Statement latency buckets in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NAMED = re.compile(r"^\s*/\*\s*name:\s*([\w.-]+)\s*\*/", re.IGNORECASE)
+_PREPARED = re.compile(r"^\s*EXECUTE\s+(\w+)", re.IGNORECASE)
+_VERB = re.compile(r"^\s*(?:WITH\b.*?\)\s*)?(SELECT|INSERT|UPDATE|DELETE|COPY|PREPARE|CREATE|ALTER|TRUNCATE|ANALYZE|SET)\b",
+                   re.IGNORECASE | re.DOTALL)
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE|COPY)\s+(?:ONLY\s+)?([\w.]+)", re.IGNORECASE)
+
+_lock = threading.Lock()
+_enabled = False
+_started = None
+_script = None
+_phases = {}
+_queries = {}
+_rows = 0
+_outputs = {}
+_profiler = None
+
+
+def enabled():
+    return _enabled
+
+
+def query_name(sql):
+    """Stable, low-cardinality name for a statement"""
+    if isinstance(sql, bytes):
+        sql = sql.decode(errors="replace")
+    sql = str(sql)
+    for pattern in (_NAMED, _PREPARED):
+        match = pattern.match(sql)
+        if match:
+            return match.group(1)
+    verb = _VERB.match(sql)
+    verb = verb.group(1).lower() if verb else sql.split(None, 1)[0].lower() if sql.strip() else "empty"
+    table = _TABLE.search(sql)
+    return f"{verb} {table.group(1).lower()}" if table else verb
+
+
+def record_query(name, seconds):
+    with _lock:
+        entry = _queries.get(name)
+        if entry is None:
+            entry = _queries[name] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(BUCKETS)}
+        entry["count"] += 1
+        entry["sum"] += seconds
+        entry["max"] = max(entry["max"], seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                entry["buckets"][i] += 1
+                break
+
+
+def add_rows(n):
+    global _rows
+    with _lock:
+        _rows += n
+
+
+@contextmanager
+def phase(name):
+    """Time a block; repeated phases accumulate"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        with _lock:
+            _phases[name] = _phases.get(name, 0.0) + elapsed
+
+
+class _Timed:
+    """Mixin timing execute/executemany/copy_expert on any psycopg2 cursor class"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query_name(query), time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(query_name(query), time.perf_counter() - started)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_query(query_name(sql), time.perf_counter() - started)
+
+
+_timed_classes = {}
+
+
+def timed_cursor(cursor_class):
+    """Subclass of cursor_class (RealDictCursor, NamedTupleCursor, ...) with statement timing"""
+    with _lock:
+        timed = _timed_classes.get(cursor_class)
+        if timed is None:
+            timed = type(f"Timed{cursor_class.__name__}", (_Timed, cursor_class), {})
+            _timed_classes[cursor_class] = timed
+        return timed
+
+
+def peak_rss_bytes():
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def snapshot():
+    """Current metrics as a plain dict"""
+    with _lock:
+        queries = {
+            name: {
+                "count": q["count"],
+                "total_seconds": round(q["sum"], 6),
+                "max_seconds": round(q["max"], 6),
+                "buckets": {str(b): n for b, n in zip(BUCKETS, q["buckets"]) if n},
+            }
+            for name, q in sorted(_queries.items())
+        }
+        return {
+            "script": _script,
+            "seconds": round(time.perf_counter() - _started, 6) if _started else None,
+            "phases": {name: round(s, 6) for name, s in _phases.items()},
+            "statements": sum(q["count"] for q in queries.values()),
+            "queries": queries,
+            "rows_processed": _rows,
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(data):
+    script = _label(data["script"])
+    lines = [
+        "# HELP isp_script_duration_seconds Wall-clock duration of the last run",
+        "# TYPE isp_script_duration_seconds gauge",
+        f'isp_script_duration_seconds{{script="{script}"}} {data["seconds"]}',
+        "# HELP isp_script_phase_seconds Wall-clock seconds per phase in the last run",
+        "# TYPE isp_script_phase_seconds gauge",
+    ]
+    for name, seconds in data["phases"].items():
+        lines.append(f'isp_script_phase_seconds{{script="{script}",phase="{_label(name)}"}} {seconds}')
+    lines += [
+        "# HELP isp_script_rows_processed Rows processed in the last run",
+        "# TYPE isp_script_rows_processed gauge",
+        f'isp_script_rows_processed{{script="{script}"}} {data["rows_processed"]}',
+        "# HELP isp_script_peak_rss_bytes Peak resident set size of the last run",
+        "# TYPE isp_script_peak_rss_bytes gauge",
+        f'isp_script_peak_rss_bytes{{script="{script}"}} {data["peak_rss_bytes"]}',
+        "# HELP isp_script_statement_duration_seconds Statement latency by query name in the last run",
+        "# TYPE isp_script_statement_duration_seconds histogram",
+    ]
+    with _lock:
+        queries = {name: dict(q, buckets=list(q["buckets"])) for name, q in _queries.items()}
+    for name, q in sorted(queries.items()):
+        labels = f'script="{script}",query="{_label(name)}"'
+        cumulative = 0
+        for bound, n in zip(BUCKETS, q["buckets"]):
+            cumulative += n
+            lines.append(f'isp_script_statement_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'isp_script_statement_duration_seconds_bucket{{{labels},le="+Inf"}} {q["count"]}')
+        lines.append(f"isp_script_statement_duration_seconds_sum{{{labels}}} {q['sum']:.6f}")
+        lines.append(f"isp_script_statement_duration_seconds_count{{{labels}}} {q['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path, text):
+    # The textfile collector must never see a half-written file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def write_outputs():
+    if not _enabled:
+        return
+    data = snapshot()
+    if _outputs.get("json"):
+        _write_atomic(_outputs["json"], json.dumps(data, indent=2) + "\n")
+    if _outputs.get("prom"):
+        _write_atomic(_outputs["prom"], prometheus_text(data))
+    if _profiler is not None:
+        _profiler.disable()
+        path = _outputs.get("profile") or f"{data['script']}.prof"
+        _profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(_profiler, stream=out).sort_stats("cumulative").print_stats(25)
+        print(f"\nProfile written to {path} (top 25 by cumulative time):")
+        print(out.getvalue())
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("instrumentation")
+    group.add_argument("--metrics-json", default=os.environ.get("METRICS_JSON"),
+                       help="write phase/statement metrics as JSON to this file")
+    group.add_argument("--metrics-prom", default=os.environ.get("METRICS_PROM"),
+                       help="write metrics in Prometheus textfile format to this file")
+    group.add_argument("--profile", nargs="?", const="", default=os.environ.get("PROFILE_OUTPUT"),
+                       help="run under cProfile and dump stats (optionally to this path)")
+
+
+def start(args=None, script=None):
+    """Enable collection (if any output was requested) and register the exit hook"""
+    global _enabled, _started, _script, _profiler
+    json_path = getattr(args, "metrics_json", None)
+    prom_path = getattr(args, "metrics_prom", None)
+    profile = getattr(args, "profile", None)
+    if not (json_path or prom_path or profile is not None):
+        return False
+
+    _script = script or os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+    _started = time.perf_counter()
+    _outputs.update(json=json_path, prom=prom_path, profile=profile)
+    _enabled = True
+    if profile is not None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    atexit.register(write_outputs)
+    return True
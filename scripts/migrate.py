@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Lock-aware migration runner
+Applies the Python-side schema migrations in MIGRATIONS and records each one in the
+schema_migrations ledger, so applied migrations are skipped without probing the catalog.
+
+Every DDL step runs with a short lock_timeout: if the table is busy (e.g. payment
+activations holding row locks on customer_services) the step gives up quickly instead of
+queueing an ACCESS EXCLUSIVE lock that stalls every writer behind it, then retries with
+backoff. Index builds run CREATE INDEX CONCURRENTLY outside a transaction; on a partitioned
+table (radacct) each partition is built concurrently and attached to an index created ON ONLY
+the parent. The time each step held its lock is reported.
+
+Steps must be idempotent (IF NOT EXISTS): a migration interrupted between steps is re-run
+from the start.
+
+Usage:
+    python3 scripts/migrate.py                  # apply everything pending
+    python3 scripts/migrate.py --list
+    python3 scripts/migrate.py customer_services_pppoe_credentials
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import re
+import time
+
+import psycopg2
+from psycopg2 import errors
+
+import db
+
+DEFAULT_LOCK_TIMEOUT_MS = 2000
+DEFAULT_RETRIES = 10
+
+# Only one runner at a time
+LOCK_KEY = 1066
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def step(sql):
+    """A DDL statement run in its own transaction under lock_timeout"""
+    return {"sql": sql.strip(), "concurrent": False}
+
+
+def concurrent_index(sql):
+    """A CREATE INDEX CONCURRENTLY statement, run outside any transaction"""
+    return {"sql": sql.strip(), "concurrent": True}
+
+
+def sql_file(name):
+    """A numbered SQL migration from this directory, run as one step"""
+    with open(os.path.join(SCRIPTS_DIR, name)) as f:
+        return step(f.read())
+
+
+def partitioned_index(name, table, columns):
+    """CREATE INDEX CONCURRENTLY that also works when table is partitioned (one build per partition)"""
+    sql = f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table}({columns})"
+    return {"sql": sql, "concurrent": True, "partitioned": (name, table, columns)}
+
+
+MIGRATIONS = [
+    ("customer_services_pppoe_credentials", [
+        step("""
+            ALTER TABLE customer_services
+            ADD COLUMN IF NOT EXISTS pppoe_username VARCHAR(255),
+            ADD COLUMN IF NOT EXISTS pppoe_password VARCHAR(255)
+        """),
+        concurrent_index("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_customer_services_pppoe_username
+            ON customer_services(pppoe_username)
+        """),
+    ]),
+    ("payroll_records_employee_name", [
+        step("""
+            ALTER TABLE payroll_records
+            ADD COLUMN IF NOT EXISTS employee_name VARCHAR(255)
+        """),
+    ]),
+    # ON CONFLICT (username, attribute) target for every provisioning write path
+    ("radius_username_attribute_unique", [
+        sql_file("1068_dedupe_radius_username_attribute.sql"),
+        concurrent_index("""
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS radcheck_username_attribute_unique
+            ON radcheck(username, attribute)
+        """),
+        concurrent_index("""
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS radreply_username_attribute_unique
+            ON radreply(username, attribute)
+        """),
+    ]),
+    # Sessions closed since radacct_rollup.py's last run are found through this index
+    ("radacct_stoptime_index", [
+        partitioned_index("idx_radacct_stoptime", "radacct", "acctstoptime"),
+    ]),
+]
+
+_INDEX_NAME = re.compile(r"INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+
+
+def checksum(steps):
+    return hashlib.sha256("\n;\n".join(s["sql"] for s in steps).encode()).hexdigest()[:16]
+
+
+def ensure_ledger(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name VARCHAR(255) PRIMARY KEY,
+                checksum VARCHAR(64),
+                applied_at TIMESTAMP DEFAULT NOW(),
+                duration_ms INTEGER,
+                lock_ms INTEGER
+            )
+        """)
+
+
+def applied_migrations(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT name, checksum, applied_at FROM schema_migrations")
+        return {name: (digest, applied_at) for name, digest, applied_at in cur.fetchall()}
+
+
+def drop_invalid_index(cur, sql):
+    """A failed CONCURRENTLY build leaves an INVALID index that IF NOT EXISTS would skip"""
+    match = _INDEX_NAME.search(sql)
+    if not match:
+        return
+    cur.execute("""
+        SELECT 1 FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid
+    """, (match.group(1),))
+    if cur.fetchone():
+        print(f"    dropping invalid index {match.group(1)} left by an earlier attempt")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+
+def build_partitioned_index(cur, sql, name, table, columns):
+    """
+    Build an index without blocking writes on a plain or partitioned table. CONCURRENTLY is not
+    allowed on a partitioned table, so the parent gets an (initially invalid) index ON ONLY itself,
+    each partition is built concurrently and attached; the parent index turns valid with the last.
+    """
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    if not row or row[0] != 'p':
+        drop_invalid_index(cur, sql)
+        cur.execute(sql)
+        return
+
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table}({columns})")
+    cur.execute("""
+        SELECT child.relname,
+               EXISTS (
+                   SELECT 1 FROM pg_inherits ii
+                   JOIN pg_index x ON x.indexrelid = ii.inhrelid
+                   WHERE ii.inhparent = to_regclass(%s) AND x.indrelid = child.oid
+               ) AS attached
+        FROM pg_inherits i
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        ORDER BY child.relname
+    """, (name, table))
+    for partition, attached in cur.fetchall():
+        if attached:
+            continue
+        partition_index = f"{name}_{partition}"[:63]
+        partition_sql = (f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} "
+                         f"ON {partition}({columns})")
+        drop_invalid_index(cur, partition_sql)
+        cur.execute(partition_sql)
+        cur.execute(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}")
+        print(f"    built and attached {partition_index}")
+
+
+def run_step(conn, migration_step, lock_timeout_ms, retries):
+    """
+    Run one step, retrying when lock_timeout fires. Returns (attempts, lock_ms, blocking):
+    lock_ms is how long the step held its lock (statement start to commit).
+    """
+    sql = migration_step["sql"]
+    for attempt in range(1, retries + 1):
+        try:
+            if migration_step["concurrent"]:
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute("SET lock_timeout = %s", (f"{lock_timeout_ms}ms",))
+                    started = time.perf_counter()
+                    if migration_step.get("partitioned"):
+                        build_partitioned_index(cur, sql, *migration_step["partitioned"])
+                    else:
+                        drop_invalid_index(cur, sql)
+                        cur.execute(sql)
+                    held = time.perf_counter() - started
+                # SHARE UPDATE EXCLUSIVE: reads and writes continue during the build
+                return attempt, held * 1000, False
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL lock_timeout = %s", (f"{lock_timeout_ms}ms",))
+                started = time.perf_counter()
+                cur.execute(sql)
+            conn.commit()
+            return attempt, (time.perf_counter() - started) * 1000, True
+        except (errors.LockNotAvailable, errors.DeadlockDetected) as e:
+            if not conn.autocommit:
+                conn.rollback()
+            if attempt == retries:
+                raise
+            delay = min(30.0, 0.5 * (2 ** (attempt - 1))) * random.uniform(0.5, 1.0)
+            print(f"    lock not available ({e.pgerror.strip() if e.pgerror else e}), "
+                  f"retrying in {delay:.1f}s [{attempt}/{retries}]")
+            time.sleep(delay)
+        finally:
+            if conn.autocommit:
+                # The session-level lock_timeout would otherwise apply to everything the caller
+                # runs on this connection afterwards
+                if not conn.closed:
+                    with conn.cursor() as cur:
+                        cur.execute("RESET lock_timeout")
+                conn.autocommit = False
+
+
+def apply_migration(conn, name, steps, lock_timeout_ms, retries):
+    started = time.perf_counter()
+    lock_total = 0.0
+    for i, migration_step in enumerate(steps, 1):
+        attempts, lock_ms, blocking = run_step(conn, migration_step, lock_timeout_ms, retries)
+        kind = "blocking lock" if blocking else "non-blocking build"
+        first_line = " ".join(migration_step["sql"].split())[:70]
+        print(f"  ✓ step {i}: {first_line}")
+        print(f"    {kind} held {lock_ms:.0f} ms, {attempts} attempt(s)")
+        if blocking:
+            lock_total += lock_ms
+
+    duration_ms = (time.perf_counter() - started) * 1000
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO schema_migrations (name, checksum, duration_ms, lock_ms)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (name) DO UPDATE
+            SET checksum = EXCLUDED.checksum, applied_at = NOW(),
+                duration_ms = EXCLUDED.duration_ms, lock_ms = EXCLUDED.lock_ms
+        """, (name, checksum(steps), int(duration_ms), int(lock_total)))
+    conn.commit()
+    return duration_ms, lock_total
+
+
+def run(names=None, lock_timeout_ms=DEFAULT_LOCK_TIMEOUT_MS, retries=DEFAULT_RETRIES, conn=None):
+    """Apply pending migrations (all, or only the given names); returns the names applied"""
+    known = dict(MIGRATIONS)
+    unknown = [n for n in names or () if n not in known]
+    if unknown:
+        raise ValueError(f"unknown migration(s): {', '.join(unknown)}")
+
+    # No statement_timeout: concurrent index builds on big tables take a while
+    own_conn = conn is None
+    conn = conn or db.connect(statement_timeout_ms=0)
+    applied = []
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (LOCK_KEY,))
+        ensure_ledger(conn)
+        done = applied_migrations(conn)
+        # CONCURRENTLY steps switch to autocommit, which needs no open transaction
+        conn.commit()
+
+        for name, steps in MIGRATIONS:
+            if names and name not in names:
+                continue
+            if name in done:
+                if done[name][0] != checksum(steps):
+                    print(f"⚠️  {name} changed since it was applied on {done[name][1]}; not re-running")
+                else:
+                    print(f"- {name} already applied")
+                continue
+            print(f"Applying {name}...")
+            duration_ms, lock_ms = apply_migration(conn, name, steps, lock_timeout_ms, retries)
+            print(f"✓ {name} applied in {duration_ms:.0f} ms (writes blocked for {lock_ms:.0f} ms)")
+            applied.append(name)
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+        conn.commit()
+        if own_conn:
+            conn.close()
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations with lock_timeout and retries")
+    parser.add_argument("names", nargs="*", help="migrations to apply (default: all pending)")
+    parser.add_argument("--list", action="store_true", help="show migrations and whether they are applied")
+    parser.add_argument("--lock-timeout-ms", type=int, default=DEFAULT_LOCK_TIMEOUT_MS,
+                        help="give up waiting for a lock after this long and retry")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help="attempts per step before failing")
+    args = parser.parse_args()
+
+    db.require_database_url()
+
+    if args.list:
+        conn = db.connect()
+        ensure_ledger(conn)
+        conn.commit()
+        done = applied_migrations(conn)
+        conn.close()
+        for name, steps in MIGRATIONS:
+            status = f"applied {done[name][1]}" if name in done else "pending"
+            print(f"  {name}: {status}")
+        return
+
+    try:
+        applied = run(args.names, lock_timeout_ms=args.lock_timeout_ms, retries=args.retries)
+    except (psycopg2.Error, ValueError) as e:
+        print(f"❌ Migration failed: {e}")
+        exit(1)
+    print(f"\n✓ {len(applied)} migration(s) applied")
+
+
+if __name__ == "__main__":
+    main()
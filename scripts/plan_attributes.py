@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Compiled per-plan RADIUS reply attributes
+Loads every service plan once and renders its full reply-attribute set: the canonical
+MikroTik rate limit plus anything in service_plans.vendor_map (1020_add_provisioning_queue.sql).
+Rendered sets are memoised by (plan id, updated_at), so provisioning 100k users on 20 plans
+renders 20 attribute sets instead of building a string per subscriber.
+
+Canonical rate limit (same as the app's lib/radius-provisioning.ts): MikroTik "rx/tx" from the
+router's side, i.e. "{upload}M/{download}M" with speeds in Mbps.
+
+vendor_map may hold plain attributes, which apply everywhere, and per-vendor sections, which
+apply when that vendor is selected. A null value removes an attribute. Values may use
+{download}, {upload}, {download_kbps}, {upload_kbps}, {download_bps} and {upload_bps}:
+
+    {"Acct-Interim-Interval": "300",
+     "juniper": {"ERX-Ingress-Policy-Name": "rate-limit-{download_kbps}k"}}
+
+    plans = PlanAttributes.load(conn)
+    replies = plans.attributes(service['service_plan_id'])
+
+With group profiles switched on (radius_groups.py migrate, stored in radius_settings by
+1069_add_radius_settings.sql) a plan's attributes live in its radgroupreply profile instead:
+user_attributes() is then empty for that plan and group() names the profile to point the user at.
+"""
+
+import json
+
+DEFAULT_SPEED_MBPS = 10
+DEFAULT_VENDORS = ("mikrotik",)
+RATE_LIMIT_ATTRIBUTE = "Mikrotik-Rate-Limit"
+
+GROUP_PREFIX = "plan-"
+GROUP_PRIORITY = 10
+GROUP_PROFILES_SETTING = "group_profiles"
+
+
+def group_name(plan_id):
+    return f"{GROUP_PREFIX}{plan_id}"
+
+
+def group_profiles_enabled(conn):
+    """Whether plan attributes are served from group profiles (False before 1069 is applied)"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('radius_settings') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return False
+        cur.execute("SELECT value FROM radius_settings WHERE name = %s", (GROUP_PROFILES_SETTING,))
+        row = cur.fetchone()
+    return bool(row) and row[0] == 'on'
+
+
+def _mbps(value):
+    """Speed as a plain number (NUMERIC columns come back as Decimal('10.00'))"""
+    value = float(value or DEFAULT_SPEED_MBPS)
+    return int(value) if value.is_integer() else value
+
+
+def rate_limit(download, upload):
+    """Canonical Mikrotik-Rate-Limit value for speeds in Mbps"""
+    return f"{_mbps(upload)}M/{_mbps(download)}M"
+
+
+class _Placeholders(dict):
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+
+def render(download, upload, vendor_map=None, vendors=DEFAULT_VENDORS):
+    """Full reply-attribute set for one plan"""
+    download = _mbps(download)
+    upload = _mbps(upload)
+    attributes = {RATE_LIMIT_ATTRIBUTE: rate_limit(download, upload)}
+
+    if isinstance(vendor_map, str):
+        vendor_map = json.loads(vendor_map or "{}")
+    vendor_map = vendor_map or {}
+    # Plain attributes first, then the selected vendors' sections in order
+    sections = [{k: v for k, v in vendor_map.items() if not isinstance(v, dict)}]
+    sections += [vendor_map[v] for v in vendors if isinstance(vendor_map.get(v), dict)]
+
+    values = _Placeholders(
+        download=download, upload=upload,
+        download_kbps=int(download * 1000), upload_kbps=int(upload * 1000),
+        download_bps=int(download * 1000000), upload_bps=int(upload * 1000000),
+    )
+    for section in sections:
+        for attribute, value in section.items():
+            if value is None:
+                attributes.pop(attribute, None)
+            else:
+                attributes[attribute] = str(value).format_map(values) if "{" in str(value) else str(value)
+    return attributes
+
+
+def _plan_columns(cur):
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = 'service_plans'
+    """)
+    return {row[0] for row in cur.fetchall()}
+
+
+def _speed_expression(columns, *names):
+    present = [name for name in names if name in columns]
+    if not present:
+        return "NULL::numeric"
+    return present[0] if len(present) == 1 else f"COALESCE({', '.join(present)})"
+
+
+class PlanAttributes:
+    """Per-plan attribute sets, rendered once per plan version"""
+
+    def __init__(self, plans=None, vendors=DEFAULT_VENDORS):
+        self.vendors = tuple(vendors)
+        # plan id -> (version, download, upload, vendor_map)
+        self.plans = dict(plans or {})
+        self.group_profiles = False
+        self._cache = {}
+        self.renders = 0
+
+    @classmethod
+    def load(cls, conn, vendors=DEFAULT_VENDORS):
+        compiler = cls(vendors=vendors)
+        compiler.refresh(conn)
+        return compiler
+
+    def refresh(self, conn):
+        """Reload plan rows; plans whose updated_at is unchanged keep their rendered set"""
+        cur = conn.cursor()
+        # Older schemas only have one of the speed column pairs, vendor_map or updated_at
+        columns = _plan_columns(cur)
+        cur.execute(f"""
+            SELECT
+                id,
+                {_speed_expression(columns, 'download_speed', 'speed_download')},
+                {_speed_expression(columns, 'upload_speed', 'speed_upload')},
+                {'vendor_map' if 'vendor_map' in columns else 'NULL'},
+                {'updated_at' if 'updated_at' in columns else 'NULL'}
+            FROM service_plans
+        """)
+        self.plans = {
+            plan_id: (updated_at, download, upload, vendor_map)
+            for plan_id, download, upload, vendor_map, updated_at in cur.fetchall()
+        }
+        cur.close()
+        self.load_mode(conn)
+        return self
+
+    def load_mode(self, conn):
+        """Re-read the group profiles setting alone (cheap enough to call per batch)"""
+        self.group_profiles = group_profiles_enabled(conn)
+        return self.group_profiles
+
+    def attributes(self, plan_id):
+        """Reply attributes for a plan (defaults for an unknown/missing plan). Do not mutate."""
+        version, download, upload, vendor_map = self.plans.get(plan_id, (None, None, None, None))
+        key = (plan_id, version)
+        if version is None:
+            # No updated_at to go by: key on the plan's content instead
+            key = (plan_id, download, upload, json.dumps(vendor_map, sort_keys=True, default=str))
+        cached = self._cache.get(key)
+        if cached is None:
+            cached = render(download, upload, vendor_map, self.vendors)
+            self._cache[key] = cached
+            self.renders += 1
+        return cached
+
+    def group(self, plan_id):
+        """The radgroupreply profile carrying this plan's attributes, or None when written per user"""
+        if self.group_profiles and plan_id in self.plans:
+            return group_name(plan_id)
+        return None
+
+    def user_attributes(self, plan_id):
+        """Reply attributes to write to radreply for a user on this plan. Do not mutate."""
+        if self.group(plan_id):
+            return {}
+        return self.attributes(plan_id)
+
+    def speeds(self, plan_id):
+        """(download, upload) in Mbps with the defaults applied"""
+        _, download, upload, _ = self.plans.get(plan_id, (None, None, None, None))
+        return _mbps(download), _mbps(upload)
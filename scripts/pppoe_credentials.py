@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Batched PPPoE credential generation
+Generates usernames/passwords for every active service that is missing them, walking
+customer_services by id in chunks. Username collisions are resolved in memory by
+UsernameAllocator, and each chunk is written with a single UPDATE ... FROM (VALUES ...)
+and committed.
+"""
+
+import secrets
+import string
+import time
+
+from psycopg2.extras import execute_values
+
+from username_allocator import UsernameAllocator, name_base
+
+PASSWORD_ALPHABET = string.ascii_letters + string.digits + "!@#$%"
+
+PENDING_SERVICES_QUERY = """
+    SELECT
+        cs.id as service_id,
+        cs.customer_id,
+        c.name as customer_name,
+        cs.pppoe_username,
+        cs.pppoe_password
+    FROM customer_services cs
+    JOIN customers c ON cs.customer_id = c.id
+    WHERE cs.status = 'active'
+    AND (cs.pppoe_username IS NULL OR cs.pppoe_password IS NULL)
+    AND cs.id > %s
+    ORDER BY cs.id
+    LIMIT %s
+"""
+
+
+def generate_password(length=12):
+    """Generate a secure random password"""
+    return ''.join(secrets.choice(PASSWORD_ALPHABET) for _ in range(length))
+
+
+def count_pending(cur):
+    cur.execute("""
+        SELECT COUNT(*) FROM customer_services
+        WHERE status = 'active'
+        AND (pppoe_username IS NULL OR pppoe_password IS NULL)
+    """)
+    return cur.fetchone()[0]
+
+
+def fill_credentials(cur, rows, allocator):
+    """
+    Write credentials for (service_id, customer_id, customer_name, username, password) rows
+    with a single UPDATE ... FROM (VALUES ...); returns the values written.
+    """
+    values = []
+    for service_id, customer_id, customer_name, username, password in rows:
+        if not username:
+            username = allocator.allocate(name_base(customer_name, customer_id))
+        values.append((service_id, username, password or generate_password()))
+
+    if values:
+        execute_values(cur, """
+            UPDATE customer_services cs
+            SET pppoe_username = v.username, pppoe_password = v.password
+            FROM (VALUES %s) AS v(id, username, password)
+            WHERE cs.id = v.id
+        """, values, page_size=len(values))
+    return values
+
+
+def generate_credentials(conn, chunk_size=5000, on_chunk=None, allocator=None):
+    """
+    Fill in missing credentials for all pending services, one committed chunk at a time.
+    Existing usernames/passwords are kept; only the missing half is generated.
+    Returns (services updated, seconds).
+    """
+    started = time.perf_counter()
+    cur = conn.cursor()
+    allocator = allocator or UsernameAllocator.load(conn)
+    last_id = 0
+    total = 0
+
+    while True:
+        cur.execute(PENDING_SERVICES_QUERY, (last_id, chunk_size))
+        rows = cur.fetchall()
+        if not rows:
+            break
+
+        values = fill_credentials(cur, rows, allocator)
+        conn.commit()
+
+        last_id = rows[-1][0]
+        total += len(values)
+        if on_chunk:
+            on_chunk(total, values)
+
+    cur.close()
+    return total, time.perf_counter() - started
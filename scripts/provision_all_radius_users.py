@@ -1,15 +1,36 @@
 #!/usr/bin/env python3
-import os
-import psycopg2
+import argparse
 from psycopg2.extras import RealDictCursor
 
+import backfill
+import db
+import instrumentation
+import radius_bulk
+from plan_attributes import PlanAttributes
+import radius_groups
+import radius_reconcile
+
+parser = argparse.ArgumentParser(description="Provision RADIUS users for all active services")
+parser.add_argument("--bulk", action="store_true",
+                    help="stage the desired state with COPY and apply it set-based")
+parser.add_argument("--group-profiles", action="store_true",
+                    help="switch the persisted group profiles mode on (as radius_groups.py migrate): "
+                         "rate limits are then served from per-plan radgroupreply profiles by every script")
+parser.add_argument("--dry-run", action="store_true",
+                    help="print the radcheck/radreply diff without writing it")
+backfill.add_chunk_arguments(parser)
+instrumentation.add_arguments(parser)
+args = parser.parse_args()
+instrumentation.start(args)
+if args.bulk and args.dry_run:
+    parser.error("--dry-run is not supported with --bulk")
+if args.chunked and (args.bulk or args.dry_run):
+    parser.error("--chunked cannot be combined with --bulk or --dry-run")
+
 # Connect to database
-DATABASE_URL = os.environ.get('DATABASE_URL')
-if not DATABASE_URL:
-    print("ERROR: DATABASE_URL not set")
-    exit(1)
+db.require_database_url()
 
-conn = psycopg2.connect(DATABASE_URL)
+conn = db.connect()
 cur = conn.cursor(cursor_factory=RealDictCursor)
 
 print("=" * 60)
@@ -17,30 +38,84 @@ print("RADIUS USER PROVISIONING")
 print("=" * 60)
 
 # Get all active customer services that need RADIUS users
-cur.execute("""
-    SELECT 
-        cs.id as service_id,
-        cs.customer_id,
-        c.first_name,
-        c.last_name,
-        c.email,
-        cs.pppoe_username,
-        cs.pppoe_password,
-        sp.download_speed,
-        sp.upload_speed,
-        sp.name as plan_name
-    FROM customer_services cs
-    JOIN customers c ON c.id = cs.customer_id
-    JOIN service_plans sp ON sp.id = cs.service_plan_id
-    WHERE cs.status = 'active'
-    AND cs.pppoe_username IS NOT NULL
-    AND cs.pppoe_password IS NOT NULL
-""")
-
-services = cur.fetchall()
-print(f"\nFound {len(services)} active services with PPPoE credentials")
-
-if len(services) == 0:
+if args.chunked:
+    # Each chunk selects its own services; nothing is loaded up front
+    services = None
+else:
+    with instrumentation.phase("select"):
+        cur.execute(radius_reconcile.ACTIVE_SERVICES_QUERY)
+        services = cur.fetchall()
+    instrumentation.add_rows(len(services))
+    print(f"\nFound {len(services)} active services with PPPoE credentials")
+if args.group_profiles:
+    radius_groups.set_group_profiles(conn, True)
+plans = PlanAttributes.load(conn)
+
+
+def user_replies(service):
+    """Per-user reply attributes; empty when the plan's group profile carries the rate limit"""
+    return plans.user_attributes(service['service_plan_id'])
+
+
+if (services or args.chunked) and plans.group_profiles:
+    # One profile per plan plus radusergroup memberships; per-user rate limits are then dropped
+    with instrumentation.phase("group_sync"):
+        group_counts = radius_groups.sync(conn, plans)
+        if not args.dry_run:
+            conn.commit()
+    print(f"✓ {group_counts['plans']} plan profiles, "
+          f"{group_counts['memberships_added']} memberships added, "
+          f"{group_counts['memberships_removed']} removed")
+
+if args.chunked:
+    chunk_query = radius_reconcile.ACTIVE_SERVICES_QUERY + """
+    AND cs.id > %(lo)s AND cs.id <= %(hi)s
+    ORDER BY cs.id
+"""
+    totals = {"Created": 0, "Updated": 0, "Unchanged": 0}
+
+    def provision_chunk(chunk_cur, lo, hi, context):
+        cur.execute(chunk_query, {'lo': lo, 'hi': hi})
+        chunk = cur.fetchall()
+        desired = {
+            service['pppoe_username']: radius_reconcile.desired_user(service['pppoe_password'], user_replies(service))
+            for service in chunk
+        }
+        result = radius_reconcile.reconcile(conn, desired)
+        for user in result['users'].values():
+            totals[user['action']] += 1
+        instrumentation.add_rows(len(chunk))
+        return len(chunk)
+
+    def report(last_key, done):
+        print(f"  ✓ up to service id {last_key}: {done:,} services this run")
+
+    # Progress is committed with every chunk: re-running after a failure resumes from the last one
+    try:
+        with instrumentation.phase("reconcile"):
+            done, elapsed = backfill.run_chunks(
+                conn, "provision_all_radius_users", "customer_services", provision_chunk,
+                chunk_size=args.chunk_size, max_rows_per_sec=args.max_rows_per_sec,
+                max_lag_seconds=args.max_lag_seconds, reset=args.reset,
+                restart_completed=True, on_chunk=report,
+            )
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Provisioning stopped: {e}")
+        print("   Re-run the same command to resume from the last committed chunk")
+        exit(1)
+
+    print("\n" + "=" * 60)
+    print("PROVISIONING COMPLETE")
+    print("=" * 60)
+    print(f"New users created: {totals['Created']}")
+    print(f"Existing users updated: {totals['Updated']}")
+    print(f"Existing users unchanged: {totals['Unchanged']}")
+    print(f"Services processed this run: {done:,} in {elapsed:.2f}s")
+    print("\nYour MikroTik router can now authenticate these users via RADIUS")
+    print("=" * 60)
+
+elif len(services) == 0:
     print("\nNo services found. Creating test user...")
     # Create a test user for immediate testing
     test_username = "testuser"
@@ -76,58 +151,74 @@ if len(services) == 0:
     print("\nTry connecting via PPPoE from your MikroTik router")
     print("=" * 60)
     
-else:
-    provisioned = 0
-    updated = 0
+elif args.bulk:
+    check_rows = []
+    reply_rows = []
+    for service in services:
+        username = service['pppoe_username']
+        check_rows.append((username, 'Cleartext-Password', ':=', service['pppoe_password']))
+        for attribute, value in user_replies(service).items():
+            reply_rows.append((username, attribute, ':=', value))
     
+    with instrumentation.phase("write"):
+        counts = radius_bulk.bulk_provision(conn, check_rows, reply_rows)
+    
+    print("\n" + "=" * 60)
+    print("PROVISIONING COMPLETE")
+    print("=" * 60)
+    print(f"New users created: {counts['created']}")
+    # Every existing user, as before --bulk (rows whose value already matches are not rewritten)
+    print(f"Existing users updated: {counts['updated'] + counts['unchanged']}")
+    print(f"Total RADIUS users: {counts['users']}")
+    print(f"Applied in {counts['seconds']:.2f}s ({counts['rows_per_second']:,.0f} rows/sec)")
+    print("\nYour MikroTik router can now authenticate these users via RADIUS")
+    print("=" * 60)
+
+else:
+    desired = {}
+    labels = {}
     for service in services:
         username = service['pppoe_username']
-        password = service['pppoe_password']
-        download = service['download_speed'] or 10
-        upload = service['upload_speed'] or 10
-        
-        # Check if user exists in radcheck
-        cur.execute("SELECT username FROM radcheck WHERE username = %s", (username,))
-        existing = cur.fetchone()
-        
-        if existing:
-            # Update password
-            cur.execute("""
-                UPDATE radcheck 
-                SET value = %s 
-                WHERE username = %s AND attribute = 'Cleartext-Password'
-            """, (password, username))
+        replies = user_replies(service)
+        desired[username] = radius_reconcile.desired_user(service['pppoe_password'], replies)
+        rate_limit = replies.get('Mikrotik-Rate-Limit', f"group {plans.group(service['service_plan_id'])}")
+        labels[username] = (f"{service['first_name']} {service['last_name']}", rate_limit)
+    
+    # Only attributes that differ from what is already in radcheck/radreply are written
+    with instrumentation.phase("reconcile"):
+        result = radius_reconcile.reconcile(conn, desired, dry_run=args.dry_run)
+    
+    provisioned = 0
+    updated = 0
+    unchanged = 0
+    for username, user in result['users'].items():
+        action = user['action']
+        if action == "Created":
+            provisioned += 1
+        elif action == "Updated":
             updated += 1
-            action = "Updated"
         else:
-            # Insert new user
-            cur.execute("""
-                INSERT INTO radcheck (username, attribute, op, value)
-                VALUES (%s, 'Cleartext-Password', ':=', %s)
-            """, (username, password))
-            provisioned += 1
-            action = "Created"
-        
-        # Delete old speed limits
-        cur.execute("DELETE FROM radreply WHERE username = %s", (username,))
-        
-        # Insert speed limits in MikroTik format
-        rate_limit = f"{download}M/{upload}M"
-        cur.execute("""
-            INSERT INTO radreply (username, attribute, op, value)
-            VALUES (%s, 'Mikrotik-Rate-Limit', ':=', %s)
-        """, (username, rate_limit))
-        
-        print(f"{action}: {username} ({service['first_name']} {service['last_name']}) - {rate_limit}")
+            unchanged += 1
+        name, rate_limit = labels[username]
+        print(f"{action}: {username} ({name}) - {rate_limit}")
     
-    conn.commit()
+    if args.dry_run:
+        conn.rollback()
+        print("\n" + "=" * 60)
+        print("DRY RUN - NO CHANGES WRITTEN")
+        print("=" * 60)
+        radius_reconcile.print_diff(result)
+    else:
+        with instrumentation.phase("commit"):
+            conn.commit()
     
     print("\n" + "=" * 60)
     print("PROVISIONING COMPLETE")
     print("=" * 60)
     print(f"New users created: {provisioned}")
     print(f"Existing users updated: {updated}")
-    print(f"Total RADIUS users: {provisioned + updated}")
+    print(f"Existing users unchanged: {unchanged}")
+    print(f"Total RADIUS users: {provisioned + updated + unchanged}")
     print("\nYour MikroTik router can now authenticate these users via RADIUS")
     print("=" * 60)
 
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+asyncio RADIUS provisioning driver
+Provisions the same services as provision_all_radius_users.py (radius_reconcile.ACTIVE_SERVICES_QUERY)
+over a small asyncpg pool. Each subscriber is one statement that upserts radcheck, upserts
+radreply and removes stale reply attributes, so a subscriber's writes are always atomic; a batch
+of subscribers goes out through executemany, which pipelines the statements instead of waiting a
+round trip per subscriber, and several batches run concurrently on separate connections.
+In group profiles mode (radius_groups.py migrate) the statement sets the user's plan group
+instead of writing the plan's reply attributes.
+
+Requires asyncpg (pip install asyncpg).
+
+Usage:
+    python3 scripts/provision_async.py --connections 4 --batch-size 500
+    python3 scripts/provision_async.py --compare   # also time the synchronous reconcile path
+"""
+
+import argparse
+import asyncio
+import time
+
+import db
+import radius_bulk
+import radius_groups
+import radius_reconcile
+from plan_attributes import PlanAttributes
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+# $1 username, $2 password, $3 reply attribute names, $4 reply values, $5 plan group or NULL
+UPSERT_USER = db.STATEMENTS["radius_user_apply"][1]
+
+
+def desired_rows(services, plans):
+    """(username, password, attributes, values, group) per user; the last service wins like the sync path"""
+    users = {}
+    for service in services:
+        replies = plans.user_attributes(service['service_plan_id'])
+        users[service['pppoe_username']] = (
+            service['pppoe_username'], service['pppoe_password'], list(replies), list(replies.values()),
+            plans.group(service['service_plan_id']),
+        )
+    return list(users.values())
+
+
+def load_plans():
+    """Plan attributes and the group profiles mode; in that mode the profiles are brought up to date"""
+    conn = db.connect()
+    try:
+        plans = PlanAttributes.load(conn)
+        radius_groups.ensure_profiles(conn, plans)
+        conn.commit()
+        return plans
+    finally:
+        conn.close()
+
+
+async def provision_batch(pool, batch):
+    """Pipeline one batch; if it fails, retry subscriber by subscriber. Returns failures."""
+    async with pool.acquire() as conn:
+        try:
+            await conn.executemany(UPSERT_USER, batch)
+            return []
+        except asyncpg.PostgresError:
+            pass
+
+        failures = []
+        for row in batch:
+            try:
+                await conn.execute(UPSERT_USER, *row)
+            except asyncpg.PostgresError as e:
+                failures.append((row[0], str(e)))
+        return failures
+
+
+async def provision(database_url, connections, batch_size, plans):
+    pool = await asyncpg.create_pool(
+        database_url,
+        min_size=connections,
+        max_size=connections,
+        server_settings={
+            'application_name': db.default_application_name(),
+            'statement_timeout': str(db.DEFAULT_STATEMENT_TIMEOUT_MS),
+        },
+    )
+    try:
+        services = await pool.fetch(radius_reconcile.ACTIVE_SERVICES_QUERY)
+        rows = desired_rows(services, plans)
+        print(f"\nFound {len(services)} active services with PPPoE credentials ({len(rows)} users)")
+
+        started = time.perf_counter()
+        batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+        # The pool caps concurrency at one in-flight batch per connection
+        results = await asyncio.gather(*(provision_batch(pool, batch) for batch in batches))
+        elapsed = time.perf_counter() - started
+    finally:
+        await pool.close()
+
+    failures = [failure for batch_failures in results for failure in batch_failures]
+    return len(rows), failures, elapsed
+
+
+def provision_sync(plans):
+    """The provision_all_radius_users.py reconcile path, timed the same way"""
+    conn = db.connect()
+    cur = conn.cursor()
+    cur.execute(radius_reconcile.ACTIVE_SERVICES_QUERY)
+    columns = [c.name for c in cur.description]
+    services = [dict(zip(columns, row)) for row in cur.fetchall()]
+    cur.close()
+
+    started = time.perf_counter()
+    rows = desired_rows(services, plans)
+    desired = {
+        username: radius_reconcile.desired_user(password, dict(zip(attributes, values)))
+        for username, password, attributes, values, _ in rows
+    }
+    result = radius_reconcile.reconcile(conn, desired)
+    if plans.group_profiles:
+        with conn.cursor() as membership_cur:
+            radius_bulk.apply_memberships(membership_cur, [(row[0], row[4]) for row in rows])
+    conn.commit()
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return len(desired), result['writes'], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Provision RADIUS users with asyncio and pipelined batches")
+    parser.add_argument("--connections", type=int, default=4, help="concurrent connections")
+    parser.add_argument("--batch-size", type=int, default=500, help="subscribers per pipelined batch")
+    parser.add_argument("--compare", action="store_true",
+                        help="afterwards, time the synchronous reconcile path and a second async run")
+    args = parser.parse_args()
+
+    if asyncpg is None:
+        print("❌ asyncpg is not installed (pip install asyncpg)")
+        exit(1)
+    database_url = db.require_database_url()
+
+    print("=" * 60)
+    print("ASYNC RADIUS USER PROVISIONING")
+    print("=" * 60)
+
+    plans = load_plans()
+    users, failures, elapsed = asyncio.run(provision(database_url, args.connections, args.batch_size, plans))
+    for username, error in failures:
+        print(f"❌ {username}: {error}")
+
+    print("\n" + "=" * 60)
+    print("PROVISIONING COMPLETE")
+    print("=" * 60)
+    print(f"Users provisioned: {users - len(failures)}")
+    print(f"Failed: {len(failures)}")
+    print(f"Wall clock: {elapsed:.2f}s ({users / elapsed if elapsed > 0 else 0:,.0f} users/sec) "
+          f"on {args.connections} connection(s)")
+
+    if args.compare:
+        # Both runs below start from the state the first run just wrote
+        sync_users, writes, sync_elapsed = provision_sync(plans)
+        _, _, async_elapsed = asyncio.run(provision(database_url, args.connections, args.batch_size, plans))
+        print("\nComparison on the provisioned state:")
+        print(f"  sync reconcile: {sync_elapsed:.2f}s for {sync_users} users ({writes} writes)")
+        print(f"  async pipeline: {async_elapsed:.2f}s")
+        if async_elapsed > 0:
+            print(f"  speedup: {sync_elapsed / async_elapsed:.1f}x")
+
+    if failures:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
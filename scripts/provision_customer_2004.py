@@ -1,24 +1,26 @@
-import os
-import psycopg2
+import argparse
 from psycopg2.extras import RealDictCursor
 import secrets
 import string
 
+import db
+import radius_groups
+import radius_reconcile
+from plan_attributes import PlanAttributes
+from username_allocator import UsernameAllocator, clean_base
+
 def generate_password(length=12):
     """Generate a secure random password"""
     alphabet = string.ascii_letters + string.digits
     return ''.join(secrets.choice(alphabet) for _ in range(length))
 
-def provision_customer_to_radius():
-    """Provision customer 2004's active services to FreeRADIUS"""
+def provision_customer_to_radius(dry_run=False):
+    """Provision customer 2004's active services to FreeRADIUS (any customer: activate_services.py)"""
     
-    database_url = os.environ.get('DATABASE_URL')
-    if not database_url:
-        print("❌ DATABASE_URL environment variable not found")
-        return
+    db.require_database_url()
     
     try:
-        conn = psycopg2.connect(database_url)
+        conn = db.connect()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         print("🔍 Checking customer 2004's active services...")
@@ -33,9 +35,10 @@ def provision_customer_to_radius():
                 c.first_name,
                 c.last_name,
                 c.email,
+                cs.pppoe_username,
+                cs.pppoe_password,
+                cs.service_plan_id,
                 sp.name as plan_name,
-                sp.speed_download,
-                sp.speed_upload,
                 sp.data_limit
             FROM customer_services cs
             JOIN customers c ON cs.customer_id = c.id
@@ -53,68 +56,77 @@ def provision_customer_to_radius():
         
         print(f"✅ Found {len(services)} active service(s) for customer 2004")
         
+        # Existing radcheck/customer_services usernames, so generated names never collide
+        allocator = UsernameAllocator.load(conn)
+        plans = PlanAttributes.load(conn)
+        radius_groups.ensure_profiles(conn, plans)
+        
         for service in services:
             print(f"\n📋 Processing service {service['service_id']}...")
             print(f"   Customer: {service['first_name']} {service['last_name']}")
             print(f"   Plan: {service['plan_name']}")
+            download, upload = plans.speeds(service['service_plan_id'])
             print(f"   IP: {service['ip_address']}")
-            print(f"   Download: {service['speed_download']} Mbps")
-            print(f"   Upload: {service['speed_upload']} Mbps")
-            
-            # Generate PPPoE username from email or customer ID
-            if service['email']:
-                username = service['email'].split('@')[0] + str(service['customer_id'])
-            else:
-                username = f"customer{service['customer_id']}"
+            print(f"   Download: {download} Mbps")
+            print(f"   Upload: {upload} Mbps")
             
-            password = generate_password()
+            username = service['pppoe_username']
+            password = service['pppoe_password']
             
-            print(f"   Generated credentials:")
-            print(f"   Username: {username}")
-            print(f"   Password: {password}")
-            
-            # Check if already exists in radcheck
-            cur.execute("SELECT username FROM radcheck WHERE username = %s", (username,))
-            existing = cur.fetchone()
-            
-            if existing:
-                print(f"   ⚠️  User already exists in RADIUS, updating password...")
-                # Update password
+            if not username or not password:
+                # Generate PPPoE username from email or customer ID
+                if not username:
+                    if service['email']:
+                        base = clean_base(service['email'].split('@')[0]) + str(service['customer_id'])
+                    else:
+                        base = f"customer{service['customer_id']}"
+                    username = allocator.allocate(base)
+                password = password or generate_password()
+                
                 cur.execute("""
-                    UPDATE radcheck 
-                    SET value = %s 
-                    WHERE username = %s AND attribute = 'Cleartext-Password'
-                """, (password, username))
+                    UPDATE customer_services
+                    SET pppoe_username = %s, pppoe_password = %s
+                    WHERE id = %s
+                """, (username, password, service['service_id']))
+                
+                print(f"   Generated credentials:")
+                print(f"   Username: {username}")
+                print(f"   Password: {password}")
             else:
-                print(f"   ➕ Creating new RADIUS user...")
-                # Insert into radcheck (authentication)
-                cur.execute("""
-                    INSERT INTO radcheck (username, attribute, op, value)
-                    VALUES (%s, 'Cleartext-Password', ':=', %s)
-                """, (username, password))
+                print(f"   Using stored credentials for {username}")
             
-            # Delete existing radreply entries for this user
-            cur.execute("DELETE FROM radreply WHERE username = %s", (username,))
+            # Authorization attributes - the plan's compiled set (or its group profile) plus this service's IP
+            replies = dict(plans.user_attributes(service['service_plan_id']))
+            replies['Framed-IP-Address'] = service['ip_address'] or '0.0.0.0'
+            desired = {username: radius_reconcile.desired_user(password, replies)}
             
-            # Convert speeds from Mbps to bits per second for MikroTik
-            download_bps = int(service['speed_download'] * 1000000) if service['speed_download'] else 10000000
-            upload_bps = int(service['speed_upload'] * 1000000) if service['speed_upload'] else 10000000
-            
-            # Insert into radreply (authorization attributes) - MikroTik format
-            attributes = [
-                (username, 'Mikrotik-Rate-Limit', ':=', f"{upload_bps}/{download_bps}"),
-                (username, 'Framed-IP-Address', ':=', service['ip_address'] or '0.0.0.0'),
-            ]
-            
-            for attr in attributes:
-                cur.execute("""
-                    INSERT INTO radreply (username, attribute, op, value)
-                    VALUES (%s, %s, %s, %s)
-                """, attr)
+            # Only write the radcheck/radreply attributes that differ from what is stored
+            result = radius_reconcile.reconcile(conn, desired, dry_run=dry_run)
+            action = result['users'][username]['action']
+            if action == "Created":
+                print(f"   ➕ Creating new RADIUS user...")
+            elif action == "Updated":
+                print(f"   ⚠️  User already exists in RADIUS, updating changed attributes...")
+            else:
+                print(f"   ✓ RADIUS user already up to date")
+            group = plans.group(service['service_plan_id'])
+            if group:
+                db.execute_prepared(conn, "radius_user_group", (username, group), cur=cur)
+                print(f"   👥 Rate limit from plan group {group}")
+            if dry_run:
+                radius_reconcile.print_diff(result)
+                continue
             
             print(f"   ✅ Successfully provisioned to FreeRADIUS!")
             print(f"   📡 Physical router can now authenticate this user")
-            print(f"   🔒 Rate limit: {service['speed_upload']}Mbps up / {service['speed_download']}Mbps down")
+            print(f"   🔒 Rate limit: {upload}Mbps up / {download}Mbps down")
+        
+        if dry_run:
+            conn.rollback()
+            cur.close()
+            conn.close()
+            print("\nDry run - no changes written")
+            return
         
         conn.commit()
         cur.close()
@@ -131,4 +143,8 @@ def provision_customer_to_radius():
         traceback.print_exc()
 
 if __name__ == "__main__":
-    provision_customer_to_radius()
+    parser = argparse.ArgumentParser(description="Provision customer 2004's services to FreeRADIUS")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print the radcheck/radreply diff without writing it")
+    args = parser.parse_args()
+    provision_customer_to_radius(dry_run=args.dry_run)
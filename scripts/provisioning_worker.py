@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Provisioning queue worker
+Drains provisioning_queue (1020_add_provisioning_queue.sql) with a pool of workers, each on its
+own connection. Rows are claimed in batches with SELECT ... FOR UPDATE SKIP LOCKED, so workers
+never block each other or process the same row twice. Failed rows are retried with exponential
+backoff until max_attempts (see 1063_add_provisioning_queue_retry.sql).
+
+Which rows are whose:
+  - The app (lib/router-push.ts) queues add_pppoe_user/remove_pppoe_user for Ubiquiti/EdgeRouter
+    and Juniper routers, which need the user configured on the router over SSH/NETCONF. Those are
+    router pushes (PUSH_VENDOR_PATTERN) and belong to router_push.py; this worker never claims them.
+  - This worker owns the same actions for routers that authenticate PPPoE through RADIUS (or rows
+    without a router), where adding a user means writing radcheck/radreply.
+
+Usage:
+    python3 scripts/provisioning_worker.py --workers 8 --batch-size 200 --drain
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import socket
+import threading
+import time
+from psycopg2.extras import RealDictCursor, execute_values
+
+import db
+import radius_bulk
+import radius_reconcile
+
+# Rows stuck in 'processing' longer than this belonged to a crashed worker and are reclaimed
+LEASE_SECONDS = 300
+
+# network_devices.type values whose queue rows are pushed to the router by router_push.py
+PUSH_VENDOR_PATTERN = "ubiquiti|edgerouter|juniper"
+
+# Rows this worker owns: its actions, for routers that are not router pushes
+OWNED = """
+    action = ANY(%(actions)s)
+    AND NOT EXISTS (
+        SELECT 1 FROM network_devices nd
+        WHERE nd.id = provisioning_queue.router_id AND nd.type ~* %(push_vendors)s
+    )
+"""
+
+# Rows left 'processing' by a crashed worker go back to pending (idx_provisioning_queue_processing)
+RECLAIM_QUERY = f"""
+    UPDATE provisioning_queue
+    SET status = 'pending', claimed_by = NULL, next_attempt_at = NOW()
+    WHERE status = 'processing' AND updated_at < NOW() - make_interval(secs => %(lease)s)
+    AND {OWNED}
+"""
+
+# Due rows in next_attempt_at order, straight off idx_provisioning_queue_pending_due
+CLAIM_QUERY = f"""
+    UPDATE provisioning_queue q
+    SET status = 'processing',
+        attempts = COALESCE(q.attempts, 0) + 1,
+        claimed_by = %(worker)s,
+        updated_at = NOW()
+    FROM (
+        SELECT id FROM provisioning_queue
+        WHERE status = 'pending' AND next_attempt_at <= NOW()
+        AND {OWNED}
+        ORDER BY next_attempt_at, id
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ) claimed
+    WHERE q.id = claimed.id
+    RETURNING q.id, q.router_id, q.action, q.username, q.password, q.static_ip, q.profile,
+              q.attempts, COALESCE(q.max_attempts, 3) as max_attempts
+"""
+
+
+def handle_add_user(conn, rows):
+    """Write radcheck/radreply for add_pppoe_user rows (only the attributes the row carries)"""
+    desired = {}
+    for row in rows:
+        if not row['username'] or not row['password']:
+            raise ValueError(f"queue row {row['id']} has no username/password")
+        replies = {}
+        if row['static_ip']:
+            replies['Framed-IP-Address'] = row['static_ip']
+        if row['profile']:
+            replies['Mikrotik-Group'] = row['profile']
+        desired[row['username']] = radius_reconcile.desired_user(row['password'], replies)
+    radius_reconcile.reconcile(conn, desired, partial=True)
+
+
+def handle_remove_user(conn, rows):
+    """Remove RADIUS users for remove_pppoe_user rows unless an active service still uses them"""
+    radius_bulk.deprovision(conn, [row['username'] for row in rows if row['username']])
+
+
+# Queue actions this worker handles (for RADIUS routers only, see OWNED); anything else stays
+# in the queue for its own consumer
+HANDLERS = {
+    'add_pppoe_user': handle_add_user,
+    'remove_pppoe_user': handle_remove_user,
+}
+
+
+def backoff_seconds(attempts, base=5.0, cap=600.0):
+    """Exponential backoff with jitter: base, 2*base, 4*base... capped"""
+    delay = min(cap, base * (2 ** max(attempts - 1, 0)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim_batch(conn, worker_name, batch_size):
+    """Claim up to batch_size due rows and commit, so row locks are held only for the claim"""
+    params = {
+        'worker': worker_name,
+        'actions': list(HANDLERS),
+        'lease': LEASE_SECONDS,
+        'limit': batch_size,
+        'push_vendors': PUSH_VENDOR_PATTERN,
+    }
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(RECLAIM_QUERY, params)
+    cur.execute(CLAIM_QUERY, params)
+    rows = cur.fetchall()
+    conn.commit()
+    cur.close()
+    return rows
+
+
+def run_handlers(conn, rows):
+    """
+    Apply a batch grouped by action in one transaction. If the batch fails, fall back to
+    one row per transaction so a single bad row does not fail its neighbours.
+    Returns {row_id: error message or None}.
+    """
+    by_action = {}
+    for row in rows:
+        by_action.setdefault(row['action'], []).append(row)
+
+    try:
+        for action, action_rows in by_action.items():
+            HANDLERS[action](conn, action_rows)
+        conn.commit()
+        return {row['id']: None for row in rows}
+    except Exception:
+        conn.rollback()
+
+    results = {}
+    for row in rows:
+        try:
+            HANDLERS[row['action']](conn, [row])
+            conn.commit()
+            results[row['id']] = None
+        except Exception as e:
+            conn.rollback()
+            results[row['id']] = str(e)
+    return results
+
+
+def record_results(conn, rows, results):
+    """Mark completed rows, reschedule retryable failures and give up after max_attempts"""
+    done = []
+    retry = []
+    failed = []
+    for row in rows:
+        error = results[row['id']]
+        if error is None:
+            done.append((row['id'],))
+        elif row['attempts'] >= row['max_attempts']:
+            failed.append((row['id'], error))
+        else:
+            retry.append((row['id'], error, backoff_seconds(row['attempts'])))
+
+    cur = conn.cursor()
+    if done:
+        execute_values(cur, """
+            UPDATE provisioning_queue q
+            SET status = 'completed', processed_at = NOW(), updated_at = NOW(),
+                error_message = NULL, claimed_by = NULL
+            FROM (VALUES %s) AS d(id)
+            WHERE q.id = d.id
+        """, done)
+    if retry:
+        execute_values(cur, """
+            UPDATE provisioning_queue q
+            SET status = 'pending', error_message = r.error, claimed_by = NULL, updated_at = NOW(),
+                next_attempt_at = NOW() + make_interval(secs => r.delay)
+            FROM (VALUES %s) AS r(id, error, delay)
+            WHERE q.id = r.id
+        """, retry, template="(%s, %s, %s::float8)")
+    if failed:
+        execute_values(cur, """
+            UPDATE provisioning_queue q
+            SET status = 'failed', error_message = f.error, claimed_by = NULL,
+                processed_at = NOW(), updated_at = NOW()
+            FROM (VALUES %s) AS f(id, error)
+            WHERE q.id = f.id
+        """, failed)
+    conn.commit()
+    cur.close()
+    return len(done), len(retry), len(failed)
+
+
+def worker_loop(worker_id, use_pool, batch_size, drain, poll_interval, stats=None):
+    """One worker on its own connection (pooled for threads), processing batches until drained"""
+    worker_name = f"{socket.gethostname()}:{os.getpid()}:{worker_id}"
+    application_name = f"isp-scripts/provisioning_worker-{worker_id}"
+    if use_pool:
+        with db.pooled() as conn:
+            return _work(conn, worker_id, worker_name, batch_size, drain, poll_interval, stats)
+    conn = db.connect(application_name=application_name)
+    try:
+        return _work(conn, worker_id, worker_name, batch_size, drain, poll_interval, stats)
+    finally:
+        conn.close()
+
+
+def _work(conn, worker_id, worker_name, batch_size, drain, poll_interval, stats):
+    totals = [0, 0, 0]
+    while True:
+        rows = claim_batch(conn, worker_name, batch_size)
+        if not rows:
+            if drain:
+                break
+            time.sleep(poll_interval)
+            continue
+        results = run_handlers(conn, rows)
+        for i, n in enumerate(record_results(conn, rows, results)):
+            totals[i] += n
+
+    print(f"  worker {worker_id}: {totals[0]} completed, {totals[1]} retrying, {totals[2]} failed")
+    if stats is not None:
+        stats.append(totals)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drain provisioning_queue with a pool of workers")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4,
+                        help="number of workers (default: CPU count)")
+    parser.add_argument("--mode", choices=("process", "thread"), default="process",
+                        help="run workers as processes or threads")
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="queue rows claimed per round trip")
+    parser.add_argument("--drain", action="store_true",
+                        help="exit once the queue has no due rows instead of polling")
+    parser.add_argument("--poll-interval", type=float, default=2.0,
+                        help="seconds to sleep when the queue is empty")
+    args = parser.parse_args()
+
+    db.require_database_url()
+
+    print(f"Starting {args.workers} {args.mode} worker(s), batch size {args.batch_size}")
+    started = time.perf_counter()
+    if args.mode == "thread":
+        # Threads share one pool sized to the worker count
+        db.get_pool(maxconn=args.workers, minconn=args.workers)
+        worker_args = (True, args.batch_size, args.drain, args.poll_interval)
+        stats = []
+        workers = [
+            threading.Thread(target=worker_loop, args=(i, *worker_args, stats))
+            for i in range(args.workers)
+        ]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        completed = sum(s[0] for s in stats)
+        db.close_pool()
+    else:
+        # Each process opens its own connection
+        worker_args = (False, args.batch_size, args.drain, args.poll_interval)
+        with multiprocessing.Pool(args.workers) as pool:
+            stats = pool.starmap(worker_loop, [(i, *worker_args) for i in range(args.workers)])
+        completed = sum(s[0] for s in stats)
+
+    elapsed = time.perf_counter() - started
+    print(f"✓ Processed {completed} queue rows in {elapsed:.2f}s "
+          f"({completed / elapsed if elapsed > 0 else 0:,.0f} rows/sec)")
+
+
+if __name__ == "__main__":
+    main()
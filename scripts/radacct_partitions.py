@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+radacct partition lifecycle manager
+1021_add_radius_indexes.sql partitions radacct by month (radacct_YYYY_MM, RANGE on acctstarttime)
+but only creates 24 partitions once. This keeps the range open and the table set small:
+
+  - creates the partitions for the next --months-ahead months (IF NOT EXISTS)
+  - detaches partitions that ended more than --retain-months ago
+  - streams each detached partition with COPY ... TO STDOUT into
+    <archive-dir>/radacct_YYYY_MM.csv.gz (CSV with header), then drops it
+
+Partition DDL goes through migrate.run_step, so a busy radacct makes the step give up under
+lock_timeout and retry instead of stalling accounting inserts. The export is written to a
+.partial file, fsynced and renamed before the table is dropped in the same transaction; a run
+interrupted anywhere is finished by the next one. Safe to schedule daily:
+    15 3 * * * DATABASE_URL=... python3 scripts/radacct_partitions.py --archive-dir /var/backups/radacct
+
+Restore an archive with:
+    gunzip -c radacct_2024_01.csv.gz | psql "$DATABASE_URL" -c "\\copy radacct FROM STDIN CSV HEADER"
+
+Usage:
+    python3 scripts/radacct_partitions.py --months-ahead 3 --retain-months 13
+    python3 scripts/radacct_partitions.py --dry-run
+"""
+
+import argparse
+import gzip
+import os
+import re
+import time
+from datetime import date
+
+import db
+import migrate
+
+# Only one manager at a time
+LOCK_KEY = 1067
+
+PARTITION_NAME = re.compile(r"^radacct_(\d{4})_(\d{2})$")
+
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"radacct_{month:%Y_%m}"
+
+
+def is_partitioned(cur):
+    cur.execute("SELECT 1 FROM pg_class WHERE relname = 'radacct' AND relkind = 'p'")
+    return cur.fetchone() is not None
+
+
+def monthly_tables(cur):
+    """{month: attached} for every radacct_YYYY_MM table, attached or left detached"""
+    cur.execute("""
+        SELECT c.relname, i.inhrelid IS NOT NULL
+        FROM pg_class c
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = 'radacct'::regclass
+        WHERE c.relnamespace = (SELECT relnamespace FROM pg_class WHERE oid = 'radacct'::regclass)
+        AND c.relkind = 'r'
+        AND c.relname ~ '^radacct_[0-9]{4}_[0-9]{2}$'
+    """)
+    tables = {}
+    for name, attached in cur.fetchall():
+        year, month = PARTITION_NAME.match(name).groups()
+        tables[date(int(year), int(month), 1)] = attached
+    return tables
+
+
+def create_partition(conn, month, lock_timeout_ms, retries):
+    sql = (f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF radacct "
+           f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')")
+    return migrate.run_step(conn, migrate.step(sql), lock_timeout_ms, retries)
+
+
+def detach_partition(conn, month, lock_timeout_ms, retries):
+    sql = f"ALTER TABLE radacct DETACH PARTITION {partition_name(month)}"
+    return migrate.run_step(conn, migrate.step(sql), lock_timeout_ms, retries)
+
+
+def archive_and_drop(conn, month, archive_dir, compresslevel=6):
+    """Stream a detached partition into a gzip file, then drop it; returns (rows, bytes)"""
+    table = partition_name(month)
+    final = os.path.join(archive_dir, f"{table}.csv.gz")
+    partial = final + ".partial"
+
+    cur = conn.cursor()
+    try:
+        # Nothing may write to the table between the count and the drop
+        cur.execute(f"LOCK TABLE {table} IN SHARE MODE")
+        cur.execute(f"SELECT COUNT(*) FROM {table}")
+        expected = cur.fetchone()[0]
+
+        with open(partial, "wb") as raw:
+            with gzip.GzipFile(filename=f"{table}.csv", mode="wb", fileobj=raw,
+                               compresslevel=compresslevel) as out:
+                # psycopg2 hands COPY data to out.write as it arrives; nothing is buffered here
+                cur.copy_expert(f"COPY {table} TO STDOUT WITH (FORMAT csv, HEADER)", out)
+                copied = cur.rowcount
+            raw.flush()
+            os.fsync(raw.fileno())
+        if copied != expected:
+            raise RuntimeError(f"{table}: exported {copied} rows, expected {expected}; table kept")
+        os.replace(partial, final)
+
+        cur.execute(f"DROP TABLE {table}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        cur.close()
+    return expected, os.path.getsize(final)
+
+
+def plan(tables, current, months_ahead, retain_months):
+    """(months to create, attached months to detach, detached months to archive)"""
+    cutoff = add_months(current, -retain_months)
+    create = [add_months(current, i) for i in range(months_ahead + 1)
+              if add_months(current, i) not in tables]
+    detach = sorted(m for m, attached in tables.items() if attached and m < cutoff)
+    archive = sorted(m for m, attached in tables.items() if m < cutoff)
+    return create, detach, archive
+
+
+def manage(conn, archive_dir, months_ahead=3, retain_months=13, dry_run=False,
+           lock_timeout_ms=migrate.DEFAULT_LOCK_TIMEOUT_MS, retries=migrate.DEFAULT_RETRIES):
+    """Run one maintenance pass; returns the plan, or None when another run holds the lock"""
+    cur = conn.cursor()
+    cur.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_KEY,))
+    if not cur.fetchone()[0]:
+        cur.close()
+        return None
+
+    try:
+        if not is_partitioned(cur):
+            raise RuntimeError("radacct is not partitioned (run 1021_add_radius_indexes.sql first)")
+        cur.execute("SELECT date_trunc('month', NOW())::date")
+        current = cur.fetchone()[0]
+        create, detach, archive = plan(monthly_tables(cur), current, months_ahead, retain_months)
+        conn.commit()
+        result = {'created': create, 'detached': detach, 'archived': []}
+        if dry_run:
+            result['archived'] = [(m, None, None) for m in archive]
+            return result
+
+        for month in create:
+            attempts, lock_ms, _ = create_partition(conn, month, lock_timeout_ms, retries)
+            print(f"  ✓ created {partition_name(month)} ({lock_ms:.0f} ms lock, {attempts} attempt(s))")
+        for month in detach:
+            attempts, lock_ms, _ = detach_partition(conn, month, lock_timeout_ms, retries)
+            print(f"  ✓ detached {partition_name(month)} ({lock_ms:.0f} ms lock, {attempts} attempt(s))")
+
+        if archive:
+            os.makedirs(archive_dir, exist_ok=True)
+        for month in archive:
+            started = time.perf_counter()
+            rows, size = archive_and_drop(conn, month, archive_dir)
+            print(f"  ✓ archived and dropped {partition_name(month)}: {rows:,} rows, "
+                  f"{size / 1024 / 1024:.1f} MB in {time.perf_counter() - started:.1f}s")
+            result['archived'].append((month, rows, size))
+        return result
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+        conn.commit()
+        cur.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create, detach and archive monthly radacct partitions")
+    parser.add_argument("--months-ahead", type=int, default=3,
+                        help="keep partitions for this many months after the current one")
+    parser.add_argument("--retain-months", type=int, default=13,
+                        help="archive partitions that ended more than this many months ago")
+    parser.add_argument("--archive-dir", default=os.environ.get("RADACCT_ARCHIVE_DIR", "radacct_archive"),
+                        help="where detached partitions are written (default: $RADACCT_ARCHIVE_DIR "
+                             "or ./radacct_archive)")
+    parser.add_argument("--lock-timeout-ms", type=int, default=migrate.DEFAULT_LOCK_TIMEOUT_MS,
+                        help="give up waiting for the radacct lock after this long, then retry")
+    parser.add_argument("--retries", type=int, default=migrate.DEFAULT_RETRIES)
+    parser.add_argument("--dry-run", action="store_true", help="only show what would be done")
+    args = parser.parse_args()
+
+    if args.retain_months < 1:
+        parser.error("--retain-months must be at least 1")
+
+    print("=" * 60)
+    print("RADACCT PARTITION MAINTENANCE")
+    print("=" * 60)
+
+    conn = db.connect()
+    started = time.perf_counter()
+    try:
+        result = manage(conn, args.archive_dir, args.months_ahead, args.retain_months, args.dry_run,
+                        args.lock_timeout_ms, args.retries)
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        exit(1)
+    finally:
+        conn.close()
+
+    if result is None:
+        print("⚠️  Another partition maintenance run is in progress, skipping")
+        return
+
+    if args.dry_run:
+        print("\nDry run:")
+        print(f"  would create: {', '.join(map(partition_name, result['created'])) or '-'}")
+        print(f"  would detach: {', '.join(map(partition_name, result['detached'])) or '-'}")
+        print(f"  would archive and drop: "
+              f"{', '.join(partition_name(m) for m, _, _ in result['archived']) or '-'}")
+        return
+
+    rows = sum(r for _, r, _ in result['archived'])
+    print(f"\n✓ Done in {time.perf_counter() - started:.2f}s: {len(result['created'])} created, "
+          f"{len(result['detached'])} detached, {len(result['archived'])} archived ({rows:,} rows)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Incremental radacct usage rollup
+Folds acctinputoctets/acctoutputoctets/acctsessiontime deltas from radacct into
+subscriber_usage_daily (1065_add_radacct_usage_rollup.sql; the radacct index comes from
+migrate.py radacct_stoptime_index). Each accounting row's last folded counters are kept in
+radacct_rollup_sessions, so interim updates only add what changed since the previous run and
+a counter that goes backwards (NAS/session restart) counts from zero.
+
+An incremental run only reads rows newer than the stored radacctid checkpoint, open sessions
+and sessions stopped since the last run. --backfill rebuilds the rollup from scratch, walking
+the radacct partitions in parallel.
+
+Usage:
+    python3 scripts/radacct_rollup.py                       # incremental, e.g. every 5 minutes
+    python3 scripts/radacct_rollup.py --backfill --workers 4
+"""
+
+import argparse
+import multiprocessing
+import time
+
+import db
+
+STATE_NAME = "radacct"
+
+# Advisory lock so an incremental run and a backfill never fold the same rows twice
+LOCK_KEY = 1065
+
+FOLD_QUERY = """
+    WITH candidates AS (
+        SELECT
+            r.radacctid,
+            COALESCE(r.username, '') AS username,
+            COALESCE(r.acctinputoctets, 0) AS input_octets,
+            COALESCE(r.acctoutputoctets, 0) AS output_octets,
+            COALESCE(r.acctsessiontime, 0) AS session_time,
+            r.acctstoptime,
+            {activity}::date AS day
+        FROM {table} r
+        WHERE {where}
+    ),
+    deltas AS (
+        SELECT
+            c.*,
+            s.radacctid IS NULL AS is_new,
+            CASE WHEN s.radacctid IS NULL OR c.input_octets < s.input_octets
+                 THEN c.input_octets ELSE c.input_octets - s.input_octets END AS input_delta,
+            CASE WHEN s.radacctid IS NULL OR c.output_octets < s.output_octets
+                 THEN c.output_octets ELSE c.output_octets - s.output_octets END AS output_delta,
+            CASE WHEN s.radacctid IS NULL OR c.session_time < s.session_time
+                 THEN c.session_time ELSE c.session_time - s.session_time END AS time_delta
+        FROM candidates c
+        LEFT JOIN radacct_rollup_sessions s ON s.radacctid = c.radacctid
+    ),
+    folded AS (
+        INSERT INTO radacct_rollup_sessions
+            (radacctid, username, input_octets, output_octets, session_time, stopped_at, updated_at)
+        SELECT radacctid, username, input_octets, output_octets, session_time, acctstoptime, NOW()
+        FROM deltas
+        ORDER BY radacctid
+        ON CONFLICT (radacctid) DO UPDATE
+        SET input_octets = EXCLUDED.input_octets,
+            output_octets = EXCLUDED.output_octets,
+            session_time = EXCLUDED.session_time,
+            stopped_at = EXCLUDED.stopped_at,
+            updated_at = EXCLUDED.updated_at
+        WHERE (radacct_rollup_sessions.input_octets, radacct_rollup_sessions.output_octets,
+               radacct_rollup_sessions.session_time, radacct_rollup_sessions.stopped_at)
+              IS DISTINCT FROM
+              (EXCLUDED.input_octets, EXCLUDED.output_octets,
+               EXCLUDED.session_time, EXCLUDED.stopped_at)
+        RETURNING 1
+    ),
+    usage AS (
+        -- Sorted so parallel backfill workers take row locks in the same order
+        INSERT INTO subscriber_usage_daily
+            (username, day, input_octets, output_octets, session_time, sessions, updated_at)
+        SELECT username, day, SUM(input_delta), SUM(output_delta), SUM(time_delta),
+               COUNT(*) FILTER (WHERE is_new), NOW()
+        FROM deltas
+        WHERE is_new OR input_delta > 0 OR output_delta > 0 OR time_delta > 0
+        GROUP BY username, day
+        ORDER BY username, day
+        ON CONFLICT (username, day) DO UPDATE
+        SET input_octets = subscriber_usage_daily.input_octets + EXCLUDED.input_octets,
+            output_octets = subscriber_usage_daily.output_octets + EXCLUDED.output_octets,
+            session_time = subscriber_usage_daily.session_time + EXCLUDED.session_time,
+            sessions = subscriber_usage_daily.sessions + EXCLUDED.sessions,
+            updated_at = EXCLUDED.updated_at
+        RETURNING 1
+    )
+    SELECT
+        (SELECT COUNT(*) FROM deltas),
+        (SELECT COUNT(*) FROM folded),
+        (SELECT COUNT(*) FROM usage),
+        (SELECT COALESCE(MAX(radacctid), 0) FROM candidates)
+"""
+
+# New rows, open sessions (partial index idx_radacct_username_active) and recently stopped ones.
+# The stop-time overlap also covers rows whose radacctid committed out of order.
+INCREMENTAL_WHERE = """
+    r.radacctid > %(last_id)s
+    OR r.acctstoptime IS NULL
+    OR r.acctstoptime >= %(since)s
+"""
+
+RANGE_WHERE = "r.radacctid > %(lo)s AND r.radacctid <= %(hi)s"
+
+
+def activity_expression(cur):
+    """
+    When the usage happened: stop time for closed sessions, otherwise the last interim update
+    (AcctUpdateTime exists in the standard schema but not in the partitioned 1021 table).
+    """
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'radacct' AND column_name = 'acctupdatetime'
+    """)
+    if cur.fetchone():
+        return "COALESCE(r.acctstoptime, r.acctupdatetime, NOW())"
+    return "COALESCE(r.acctstoptime, NOW())"
+
+
+def fold(cur, table, where, params, activity):
+    """Run one fold statement; returns (rows read, sessions updated, usage rows, max radacctid)"""
+    cur.execute(FOLD_QUERY.format(table=table, where=where, activity=activity), params)
+    return cur.fetchone()
+
+
+def acquire_lock(cur):
+    cur.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_KEY,))
+    return cur.fetchone()[0]
+
+
+def load_state(cur):
+    cur.execute("""
+        SELECT last_radacctid, last_run_at FROM radacct_rollup_state WHERE name = %s
+    """, (STATE_NAME,))
+    row = cur.fetchone()
+    return row if row else (0, None)
+
+
+def save_state(cur, last_id, rows_folded, run_at=None):
+    """Record progress; run_at (default: this transaction's start) bounds the next run's re-read"""
+    cur.execute("""
+        INSERT INTO radacct_rollup_state (name, last_radacctid, last_run_at, rows_folded)
+        VALUES (%s, %s, COALESCE(%s, NOW()), %s)
+        ON CONFLICT (name) DO UPDATE
+        SET last_radacctid = GREATEST(radacct_rollup_state.last_radacctid, EXCLUDED.last_radacctid),
+            last_run_at = EXCLUDED.last_run_at,
+            rows_folded = radacct_rollup_state.rows_folded + EXCLUDED.rows_folded
+    """, (STATE_NAME, last_id, run_at, rows_folded))
+
+
+def prune_sessions(cur, retain_days):
+    """Forget folded counters for sessions closed long enough ago that they won't change again"""
+    cur.execute("""
+        DELETE FROM radacct_rollup_sessions
+        WHERE stopped_at < NOW() - make_interval(days => %s)
+    """, (retain_days,))
+    return cur.rowcount
+
+
+def incremental(conn, overlap_seconds=600, retain_days=7):
+    """Fold everything that changed since the checkpoint in one transaction"""
+    cur = conn.cursor()
+    if not acquire_lock(cur):
+        cur.close()
+        return None
+
+    try:
+        last_id, last_run_at = load_state(cur)
+        cur.execute("SELECT COALESCE(%s::timestamptz, NOW()) - make_interval(secs => %s)",
+                    (last_run_at, overlap_seconds))
+        since = cur.fetchone()[0]
+
+        activity = activity_expression(cur)
+        read, updated, usage_rows, max_id = fold(
+            cur, "radacct", INCREMENTAL_WHERE, {'last_id': last_id, 'since': since}, activity
+        )
+        save_state(cur, max(last_id, max_id), updated)
+        pruned = prune_sessions(cur, retain_days)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+        conn.commit()
+        cur.close()
+
+    return {'rows_read': read, 'sessions_updated': updated, 'usage_rows': usage_rows,
+            'checkpoint': max(last_id, max_id), 'sessions_pruned': pruned}
+
+
+def partitions(cur):
+    """radacct partitions (or radacct itself when the table is not partitioned)"""
+    cur.execute("""
+        SELECT inhrelid::regclass::text
+        FROM pg_inherits
+        WHERE inhparent = 'radacct'::regclass
+        ORDER BY 1
+    """)
+    names = [row[0] for row in cur.fetchall()]
+    return names or ["radacct"]
+
+
+def backfill_partition(table, activity, chunk_size):
+    """Fold one partition in committed radacctid chunks on its own connection"""
+    conn = db.connect(application_name="isp-scripts/radacct_rollup-backfill")
+    cur = conn.cursor()
+    started = time.perf_counter()
+    cur.execute(f"SELECT COALESCE(MIN(radacctid), 1) - 1, COALESCE(MAX(radacctid), 0) FROM {table}")
+    lo, last = cur.fetchone()
+    rows = 0
+    try:
+        while lo < last:
+            hi = lo + chunk_size
+            read, _, _, _ = fold(cur, table, RANGE_WHERE, {'lo': lo, 'hi': hi}, activity)
+            conn.commit()
+            rows += read
+            lo = hi
+    finally:
+        cur.close()
+        conn.close()
+    elapsed = time.perf_counter() - started
+    print(f"  ✓ {table}: {rows:,} rows in {elapsed:.1f}s")
+    return rows
+
+
+def backfill(conn, workers=4, chunk_size=50000):
+    """Rebuild the rollup from all of radacct, one worker per partition"""
+    cur = conn.cursor()
+    if not acquire_lock(cur):
+        cur.close()
+        return None
+
+    try:
+        # Rows above this id, and sessions stopped after this moment, are left to the next
+        # incremental run: last_run_at must not be stamped when the (long) backfill finishes
+        cur.execute("SELECT COALESCE(MAX(radacctid), 0), NOW() FROM radacct")
+        checkpoint, started_at = cur.fetchone()
+        activity = activity_expression(cur)
+        tables = partitions(cur)
+        cur.execute("TRUNCATE subscriber_usage_daily, radacct_rollup_sessions")
+        cur.execute("DELETE FROM radacct_rollup_state WHERE name = %s", (STATE_NAME,))
+        conn.commit()
+
+        print(f"Backfilling {len(tables)} partition(s) with {workers} worker(s)")
+        with multiprocessing.Pool(max(1, min(workers, len(tables)))) as pool:
+            counts = pool.starmap(backfill_partition, [(t, activity, chunk_size) for t in tables])
+
+        save_state(cur, checkpoint, sum(counts), started_at)
+        conn.commit()
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+        conn.commit()
+        cur.close()
+
+    return {'rows_read': sum(counts), 'partitions': len(tables), 'checkpoint': checkpoint}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Roll radacct up into per-subscriber daily usage")
+    parser.add_argument("--backfill", action="store_true",
+                        help="rebuild the rollup from all radacct partitions")
+    parser.add_argument("--workers", type=int, default=4, help="parallel partitions for --backfill")
+    parser.add_argument("--chunk-size", type=int, default=50000,
+                        help="radacctid range folded per transaction during --backfill")
+    parser.add_argument("--overlap-seconds", type=int, default=600,
+                        help="re-read sessions stopped this long before the last run")
+    parser.add_argument("--retain-days", type=int, default=7,
+                        help="keep folded counters of closed sessions this long")
+    args = parser.parse_args()
+
+    conn = db.connect()
+    started = time.perf_counter()
+    try:
+        if args.backfill:
+            result = backfill(conn, workers=args.workers, chunk_size=args.chunk_size)
+        else:
+            result = incremental(conn, overlap_seconds=args.overlap_seconds,
+                                 retain_days=args.retain_days)
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        exit(1)
+    finally:
+        conn.close()
+
+    if result is None:
+        print("⚠️  Another rollup is running, skipping")
+        return
+
+    elapsed = time.perf_counter() - started
+    print(f"✓ Read {result['rows_read']:,} accounting rows in {elapsed:.2f}s")
+    if not args.backfill:
+        print(f"  Sessions updated: {result['sessions_updated']:,}")
+        print(f"  Usage rows touched: {result['usage_rows']:,}")
+        print(f"  Closed sessions pruned: {result['sessions_pruned']:,}")
+    print(f"  Checkpoint: radacctid {result['checkpoint']}")
+
+
+if __name__ == "__main__":
+    main()
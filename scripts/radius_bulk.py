@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Set-based bulk RADIUS provisioning
+Stages the desired radcheck/radreply state with COPY into temp tables and applies it
+with a handful of INSERT ... ON CONFLICT / DELETE ... USING statements instead of
+several round trips per subscriber. In group profiles mode the plan group memberships
+(radusergroup) are applied the same way.
+"""
+
+import io
+import time
+
+from plan_attributes import GROUP_PREFIX, GROUP_PRIORITY
+
+CHECK_STAGE = "radcheck_stage"
+REPLY_STAGE = "radreply_stage"
+
+
+def _copy_escape(value):
+    """Escape a value for COPY text format"""
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_rows(cur, table, columns, rows):
+    """Stream rows into a table with COPY FROM STDIN"""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(_copy_escape(v) for v in row))
+        buf.write("\n")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
+def dedupe(rows):
+    """Keep the last (username, attribute) row, matching per-row last-write-wins"""
+    latest = {}
+    for username, attribute, op, value in rows:
+        latest[(username, attribute)] = (username, attribute, op, value)
+    return list(latest.values())
+
+
+def stage(cur, check_rows, reply_rows):
+    """COPY the desired radcheck/radreply rows into per-transaction temp tables"""
+    for table in (CHECK_STAGE, REPLY_STAGE):
+        cur.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS {table} (
+                username TEXT NOT NULL,
+                attribute TEXT NOT NULL,
+                op VARCHAR(2) NOT NULL,
+                value TEXT NOT NULL
+            ) ON COMMIT DROP
+        """)
+        cur.execute(f"TRUNCATE {table}")
+
+    columns = ("username", "attribute", "op", "value")
+    copy_rows(cur, CHECK_STAGE, columns, dedupe(check_rows))
+    copy_rows(cur, REPLY_STAGE, columns, dedupe(reply_rows))
+
+    cur.execute(f"ANALYZE {CHECK_STAGE}")
+    cur.execute(f"ANALYZE {REPLY_STAGE}")
+
+
+def classify(cur):
+    """Count staged users that will be created, updated or left unchanged"""
+    cur.execute(f"""
+        WITH staged_users AS (
+            SELECT DISTINCT username FROM {CHECK_STAGE}
+        ),
+        check_changed AS (
+            SELECT s.username
+            FROM {CHECK_STAGE} s
+            JOIN radcheck r ON r.username = s.username AND r.attribute = s.attribute
+            WHERE r.op IS DISTINCT FROM s.op OR r.value IS DISTINCT FROM s.value
+        ),
+        reply_changed AS (
+            SELECT s.username
+            FROM {REPLY_STAGE} s
+            LEFT JOIN radreply r ON r.username = s.username AND r.attribute = s.attribute
+            WHERE r.id IS NULL OR r.op IS DISTINCT FROM s.op OR r.value IS DISTINCT FROM s.value
+            UNION
+            SELECT r.username
+            FROM radreply r
+            JOIN staged_users u ON u.username = r.username
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {REPLY_STAGE} s
+                WHERE s.username = r.username AND s.attribute = r.attribute
+            )
+        ),
+        existing AS (
+            SELECT DISTINCT r.username
+            FROM radcheck r
+            JOIN staged_users u ON u.username = r.username
+        )
+        SELECT
+            COUNT(*) FILTER (WHERE e.username IS NULL) AS created,
+            COUNT(*) FILTER (
+                WHERE e.username IS NOT NULL
+                AND (u.username IN (SELECT username FROM check_changed)
+                     OR u.username IN (SELECT username FROM reply_changed))
+            ) AS updated,
+            COUNT(*) AS total
+        FROM staged_users u
+        LEFT JOIN existing e ON e.username = u.username
+    """)
+    created, updated, total = cur.fetchone()
+    return {
+        "created": created,
+        "updated": updated,
+        "unchanged": total - created - updated,
+    }
+
+
+def apply(cur):
+    """Apply the staged state; rows whose value already matches are not rewritten"""
+    cur.execute(f"""
+        INSERT INTO radcheck (username, attribute, op, value)
+        SELECT username, attribute, op, value FROM {CHECK_STAGE}
+        ON CONFLICT (username, attribute) DO UPDATE
+        SET op = EXCLUDED.op, value = EXCLUDED.value
+        WHERE radcheck.op IS DISTINCT FROM EXCLUDED.op
+           OR radcheck.value IS DISTINCT FROM EXCLUDED.value
+    """)
+    check_written = cur.rowcount
+
+    # Reply attributes that are no longer part of the desired state
+    cur.execute(f"""
+        DELETE FROM radreply r
+        USING (SELECT DISTINCT username FROM {CHECK_STAGE}) u
+        WHERE r.username = u.username
+        AND NOT EXISTS (
+            SELECT 1 FROM {REPLY_STAGE} s
+            WHERE s.username = r.username AND s.attribute = r.attribute
+        )
+    """)
+    reply_deleted = cur.rowcount
+
+    cur.execute(f"""
+        INSERT INTO radreply (username, attribute, op, value)
+        SELECT username, attribute, op, value FROM {REPLY_STAGE}
+        ON CONFLICT (username, attribute) DO UPDATE
+        SET op = EXCLUDED.op, value = EXCLUDED.value
+        WHERE radreply.op IS DISTINCT FROM EXCLUDED.op
+           OR radreply.value IS DISTINCT FROM EXCLUDED.value
+    """)
+    reply_written = cur.rowcount
+
+    return {
+        "radcheck_written": check_written,
+        "radreply_written": reply_written,
+        "radreply_deleted": reply_deleted,
+    }
+
+
+def apply_memberships(cur, memberships):
+    """
+    Point each user at one plan group; memberships are (username, groupname) pairs, the last
+    pair per username wins and a None groupname just removes the user's plan groups.
+    Returns (added, removed).
+    """
+    latest = dict(memberships)
+    if not latest:
+        return 0, 0
+    usernames = list(latest)
+    groups = list(latest.values())
+    cur.execute("""
+        INSERT INTO radusergroup (username, groupname, priority)
+        SELECT m.username, m.groupname, %s
+        FROM unnest(%s::text[], %s::text[]) AS m(username, groupname)
+        WHERE m.groupname IS NOT NULL
+        ON CONFLICT (username, groupname) DO NOTHING
+    """, (GROUP_PRIORITY, usernames, groups))
+    added = cur.rowcount
+    cur.execute("""
+        DELETE FROM radusergroup ug
+        USING unnest(%s::text[], %s::text[]) AS m(username, groupname)
+        WHERE ug.username = m.username
+        AND ug.groupname LIKE %s
+        AND ug.groupname IS DISTINCT FROM m.groupname
+    """, (usernames, groups, GROUP_PREFIX + '%'))
+    return added, cur.rowcount
+
+
+def provision(conn, check_rows, reply_rows, memberships=None):
+    """Stage and apply a desired state inside the caller's transaction"""
+    with conn.cursor() as cur:
+        stage(cur, check_rows, reply_rows)
+        counts = classify(cur)
+        counts.update(apply(cur))
+        if memberships is not None:
+            counts["memberships_added"], counts["memberships_removed"] = apply_memberships(cur, memberships)
+    return counts
+
+
+def deprovision(conn, usernames):
+    """
+    Remove radcheck/radreply rows and plan group memberships for usernames that no active
+    service still uses.
+    Returns the usernames that were removed.
+    """
+    if not usernames:
+        return []
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT u.username
+        FROM unnest(%s::text[]) AS u(username)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM customer_services cs
+            WHERE cs.pppoe_username = u.username
+            AND cs.status = 'active'
+            AND COALESCE(cs.is_suspended, false) = false
+            AND cs.pppoe_password IS NOT NULL
+        )
+    """, (list(set(usernames)),))
+    removed = [row[0] for row in cur.fetchall()]
+    if removed:
+        cur.execute("DELETE FROM radcheck WHERE username = ANY(%s)", (removed,))
+        cur.execute("DELETE FROM radreply WHERE username = ANY(%s)", (removed,))
+        cur.execute("DELETE FROM radusergroup WHERE username = ANY(%s) AND groupname LIKE %s",
+                    (removed, GROUP_PREFIX + '%'))
+    cur.close()
+    return removed
+
+
+def bulk_provision(conn, check_rows, reply_rows, memberships=None):
+    """
+    Provision a full desired state in one transaction.
+    check_rows/reply_rows are (username, attribute, op, value) tuples; every username
+    present in check_rows has its radreply attributes replaced by those in reply_rows.
+    memberships, when given, are applied as in apply_memberships.
+    Returns created/updated/unchanged counts plus timing.
+    """
+    started = time.perf_counter()
+    try:
+        counts = provision(conn, check_rows, reply_rows, memberships)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    elapsed = time.perf_counter() - started
+    users = counts["created"] + counts["updated"] + counts["unchanged"]
+    counts["users"] = users
+    counts["seconds"] = elapsed
+    counts["rows_per_second"] = users / elapsed if elapsed > 0 else float(users)
+    return counts
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+RADIUS drift detector
+Checks that radcheck/radreply match what customer_services says they should be, without pulling
+either side to the client. Usernames are hashed into --buckets buckets and the server computes an
+md5 digest per bucket over the expected rows (radius_reconcile.ACTIVE_SERVICES_QUERY plus the
+compiled plan attributes, sent as a few small arrays) and over the actual rows. Only the numbers
+of buckets whose digests differ come back; only those buckets' rows are fetched and diffed per
+user. A clean check of 100k users returns one row.
+
+Compared: the Cleartext-Password check item, and the reply attributes that plans render (other
+check items and per-service extras such as Framed-IP-Address are left alone). In group profiles
+mode (radius_groups.py migrate) no per-user plan attributes are expected. Reported:
+    missing   active service without a RADIUS login
+    password  radcheck password differs from customer_services.pppoe_password
+    replies   plan reply attributes differ
+    orphaned  RADIUS user without an active, unsuspended service
+
+--repair writes just those users (radius_reconcile for the first three, radius_bulk.deprovision
+for orphans). Cheap enough for cron:
+    0 * * * * DATABASE_URL=... python3 scripts/radius_drift.py --repair
+
+Usage:
+    python3 scripts/radius_drift.py
+    python3 scripts/radius_drift.py --group-profiles --repair
+"""
+
+import argparse
+import time
+
+from psycopg2.extras import execute_values
+
+import db
+import radius_bulk
+import radius_reconcile
+from plan_attributes import PlanAttributes
+
+BUCKET = "((hashtext(username) & 2147483647) %% %(buckets)s)"
+
+SCOPE = f"""
+    services AS (
+        -- The last service wins when several share a username, as in the provisioning scripts
+        SELECT DISTINCT ON (pppoe_username)
+            pppoe_username AS username, pppoe_password AS password, service_plan_id
+        FROM ({radius_reconcile.ACTIVE_SERVICES_QUERY}) active
+        ORDER BY pppoe_username, service_id DESC
+    ),
+    plan_attributes AS (
+        SELECT * FROM unnest(%(plan_ids)s::int[], %(attributes)s::text[], %(values)s::text[])
+            AS p(plan_id, attribute, value)
+    ),
+    expected AS (
+        SELECT username::text, 'radcheck' AS tbl, 'Cleartext-Password'::text AS attribute,
+               ':='::text AS op, password::text AS value
+        FROM services
+        UNION ALL
+        SELECT s.username::text, 'radreply', p.attribute, ':=', p.value
+        FROM services s
+        JOIN plan_attributes p ON p.plan_id = s.service_plan_id
+    ),
+    actual AS (
+        SELECT username::text, 'radcheck' AS tbl, attribute::text, op::text, value::text
+        FROM radcheck
+        WHERE attribute = 'Cleartext-Password'
+        UNION ALL
+        SELECT username::text, 'radreply', attribute::text, op::text, value::text
+        FROM radreply
+        WHERE attribute = ANY(%(managed)s::text[])
+    )
+"""
+
+DIGEST_QUERY = f"""
+    WITH {SCOPE},
+    e AS (
+        SELECT {BUCKET} AS bucket, COUNT(DISTINCT username) AS users,
+               md5(string_agg(concat_ws(chr(31), username, tbl, attribute, op, value), chr(30)
+                              ORDER BY username, tbl, attribute)) AS digest
+        FROM expected GROUP BY 1
+    ),
+    a AS (
+        SELECT {BUCKET} AS bucket, COUNT(DISTINCT username) AS users,
+               md5(string_agg(concat_ws(chr(31), username, tbl, attribute, op, value), chr(30)
+                              ORDER BY username, tbl, attribute)) AS digest
+        FROM actual GROUP BY 1
+    )
+    SELECT
+        (SELECT COALESCE(SUM(users), 0) FROM e),
+        (SELECT COALESCE(SUM(users), 0) FROM a),
+        ARRAY(
+            SELECT COALESCE(e.bucket, a.bucket)
+            FROM e FULL JOIN a ON a.bucket = e.bucket
+            WHERE e.digest IS DISTINCT FROM a.digest
+            ORDER BY 1
+        )
+"""
+
+DRILL_QUERY = f"""
+    WITH {SCOPE}
+    SELECT 'expected', username, tbl, attribute, op, value FROM expected
+    WHERE {BUCKET} = ANY(%(drill)s::int[])
+    UNION ALL
+    SELECT 'actual', username, tbl, attribute, op, value FROM actual
+    WHERE {BUCKET} = ANY(%(drill)s::int[])
+"""
+
+KINDS = ("missing", "password", "replies", "orphaned")
+
+
+def plan_arrays(plans, group_profiles=False):
+    """Expected per-user reply rows per plan as parallel arrays, plus every attribute plans render"""
+    plan_ids, attributes, values = [], [], []
+    managed = set()
+    for plan_id in plans.plans:
+        for attribute, value in plans.attributes(plan_id).items():
+            managed.add(attribute)
+            if not group_profiles:
+                # With group profiles the rate limit lives in radgroupreply, not per user
+                plan_ids.append(plan_id)
+                attributes.append(attribute)
+                values.append(value)
+    return {'plan_ids': plan_ids, 'attributes': attributes, 'values': values,
+            'managed': sorted(managed)}
+
+
+def classify(expected, actual):
+    """Kind of drift for one user's expected/actual {(table, attribute): (op, value)}, or None"""
+    if expected == actual:
+        return None
+    if not expected:
+        return "orphaned"
+    password = ("radcheck", "Cleartext-Password")
+    if password not in actual:
+        return "missing"
+    if expected.get(password) != actual.get(password):
+        return "password"
+    return "replies"
+
+
+def drill_down(cur, params, buckets, group_size=64):
+    """Per-user drift in the given buckets; returns {username: (kind, expected, actual)}"""
+    drift = {}
+    for i in range(0, len(buckets), group_size):
+        cur.execute(DRILL_QUERY, dict(params, drill=buckets[i:i + group_size]))
+        users = {}
+        for side, username, table, attribute, op, value in cur.fetchall():
+            state = users.setdefault(username, {'expected': {}, 'actual': {}})
+            state[side][(table, attribute)] = (op, value)
+        for username, state in users.items():
+            kind = classify(state['expected'], state['actual'])
+            if kind:
+                drift[username] = (kind, state['expected'], state['actual'])
+    return drift
+
+
+def check(conn, buckets=1024, group_profiles=None, plans=None):
+    """
+    Compare expected and actual RADIUS state; returns (expected users, actual users, buckets differing, drift).
+    group_profiles defaults to the persisted mode.
+    """
+    plans = plans or PlanAttributes.load(conn)
+    if group_profiles is None:
+        group_profiles = plans.group_profiles
+    params = dict(plan_arrays(plans, group_profiles), buckets=buckets)
+    cur = conn.cursor()
+    cur.execute(DIGEST_QUERY, params)
+    expected_users, actual_users, differing = cur.fetchone()
+    drift = drill_down(cur, params, differing) if differing else {}
+    cur.close()
+    conn.rollback()
+    return expected_users, actual_users, len(differing), drift
+
+
+def repair(conn, drift):
+    """Write just the drifted users; returns (users reconciled, users deprovisioned)"""
+    desired = {}
+    extra = []
+    orphans = []
+    for username, (kind, expected, actual) in drift.items():
+        if kind == "orphaned":
+            orphans.append(username)
+            continue
+        password = expected[("radcheck", "Cleartext-Password")][1]
+        replies = {attribute: value for (table, attribute), (_, value) in expected.items() if table == "radreply"}
+        desired[username] = radius_reconcile.desired_user(password, replies)
+        # partial reconcile leaves unlisted attributes alone; drop the managed ones the plan no longer renders
+        extra += [(username, attribute) for (table, attribute) in actual
+                  if table == "radreply" and (table, attribute) not in expected]
+
+    if desired:
+        radius_reconcile.reconcile(conn, desired, partial=True)
+    cur = conn.cursor()
+    if extra:
+        execute_values(cur, """
+            DELETE FROM radreply r
+            USING (VALUES %s) AS d(username, attribute)
+            WHERE r.username = d.username AND r.attribute = d.attribute
+        """, extra)
+    removed = radius_bulk.deprovision(conn, orphans)
+    cur.close()
+    conn.commit()
+    return len(desired), len(removed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find (and repair) drift between customer_services and radcheck/radreply")
+    parser.add_argument("--buckets", type=int, default=1024, help="hash buckets to digest usernames into")
+    parser.add_argument("--group-profiles", action="store_true", default=None,
+                        help="rate limits are served from radgroupreply "
+                             "(default: the persisted mode set by radius_groups.py migrate)")
+    parser.add_argument("--repair", action="store_true", help="rewrite the drifted users")
+    parser.add_argument("--show", type=int, default=50, help="users to list per kind of drift")
+    args = parser.parse_args()
+
+    db.require_database_url()
+    conn = db.connect()
+    try:
+        started = time.perf_counter()
+        expected_users, actual_users, differing, drift = check(conn, args.buckets, args.group_profiles)
+        elapsed = time.perf_counter() - started
+
+        print(f"Expected users: {expected_users:,}  RADIUS users: {actual_users:,}")
+        print(f"Buckets differing: {differing} of {args.buckets} (checked in {elapsed:.2f}s)")
+        if not drift:
+            print("✓ No drift")
+            return
+
+        for kind in KINDS:
+            users = sorted(u for u, (k, _, _) in drift.items() if k == kind)
+            if not users:
+                continue
+            print(f"\n⚠️  {kind}: {len(users)}")
+            for username in users[:args.show]:
+                print(f"  {username}")
+            if len(users) > args.show:
+                print(f"  ... and {len(users) - args.show} more")
+
+        if args.repair:
+            reconciled, removed = repair(conn, drift)
+            print(f"\n✓ Repaired: {reconciled} users rewritten, {removed} orphans deprovisioned")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Error: {e}")
+        exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+RADIUS group-based rate-limit profiles
+Materialises one radgroupreply profile per service plan ('plan-<id>') and maps each active
+user to their plan's profile through radusergroup. A plan speed change then becomes one
+UPDATE on radgroupreply instead of rewriting a Mikrotik-Rate-Limit row per subscriber.
+Requires 1064_add_radius_group_profiles.sql, 1069_add_radius_settings.sql and group lookups
+enabled in FreeRADIUS (read_groups = yes in the sql module).
+
+migrate switches the persisted group profiles mode on: from then on every provisioning script
+(sync_radius_delta.py and radius_listener.py, activate_services.py, provision_async.py,
+provision_all_radius_users.py, ...) writes the user's plan group to radusergroup instead of the
+plan's attributes to radreply. disable switches it off again and puts the per-user rows back.
+
+Usage:
+    python3 scripts/radius_groups.py sync              # refresh profiles and memberships
+    python3 scripts/radius_groups.py migrate [--dry-run]  # convert per-user rows to groups
+    python3 scripts/radius_groups.py disable [--dry-run]  # back to per-user rows
+"""
+
+import argparse
+
+from psycopg2.extras import execute_values
+
+import db
+from plan_attributes import (
+    GROUP_PREFIX, GROUP_PRIORITY, GROUP_PROFILES_SETTING, PlanAttributes, group_name,
+)
+
+# The one plan group per username: like the provisioning scripts, the newest service wins
+# when several active services share a username
+MEMBERSHIPS = """
+    SELECT DISTINCT ON (cs.pppoe_username)
+        cs.pppoe_username AS username, %(prefix)s || cs.service_plan_id::text AS groupname
+    FROM customer_services cs
+    WHERE cs.status = 'active'
+    AND COALESCE(cs.is_suspended, false) = false
+    AND cs.pppoe_username IS NOT NULL
+    AND cs.service_plan_id IS NOT NULL
+    ORDER BY cs.pppoe_username, cs.id DESC
+"""
+
+
+def set_group_profiles(conn, enabled):
+    """Persist the group profiles mode (radius_settings) in the caller's transaction"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO radius_settings (name, value, updated_at)
+            VALUES (%s, %s, NOW())
+            ON CONFLICT (name) DO UPDATE
+            SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+        """, (GROUP_PROFILES_SETTING, 'on' if enabled else 'off'))
+
+
+def ensure_profiles(conn, plans):
+    """In group profiles mode, bring the plan profiles up to date before users are pointed at them"""
+    if not plans.group_profiles:
+        return None
+    return sync_profiles(conn, plans)
+
+
+def sync_profiles(conn, plans=None):
+    """Upsert one radgroupreply profile per service plan; only changed rows are written"""
+    plans = plans or PlanAttributes.load(conn)
+    rows = []
+    for plan_id in plans.plans:
+        for attribute, value in plans.attributes(plan_id).items():
+            rows.append((group_name(plan_id), attribute, ':=', value))
+
+    cur = conn.cursor()
+
+    written = 0
+    if rows:
+        execute_values(cur, """
+            INSERT INTO radgroupreply (groupname, attribute, op, value)
+            VALUES %s
+            ON CONFLICT (groupname, attribute) DO UPDATE
+            SET op = EXCLUDED.op, value = EXCLUDED.value
+            WHERE radgroupreply.op IS DISTINCT FROM EXCLUDED.op
+               OR radgroupreply.value IS DISTINCT FROM EXCLUDED.value
+        """, rows, page_size=1000)
+        written = cur.rowcount
+
+    # Profiles for plans that no longer exist, and attributes a plan no longer renders
+    cur.execute("""
+        DELETE FROM radgroupreply g
+        WHERE g.groupname LIKE %s
+        AND NOT EXISTS (
+            SELECT 1 FROM unnest(%s::text[], %s::text[]) AS d(groupname, attribute)
+            WHERE d.groupname = g.groupname AND d.attribute = g.attribute
+        )
+    """, (GROUP_PREFIX + '%', [r[0] for r in rows], [r[1] for r in rows]))
+    removed = cur.rowcount
+    cur.close()
+    return {'plans': len({r[0] for r in rows}), 'profile_rows_written': written,
+            'profile_rows_removed': removed}
+
+
+def sync_memberships(conn):
+    """Point every active, unsuspended user at exactly one plan group, set-based"""
+    params = {'prefix': GROUP_PREFIX, 'priority': GROUP_PRIORITY, 'pattern': GROUP_PREFIX + '%'}
+    cur = conn.cursor()
+    cur.execute(f"""
+        INSERT INTO radusergroup (username, groupname, priority)
+        SELECT username, groupname, %(priority)s FROM ({MEMBERSHIPS}) m
+        ON CONFLICT (username, groupname) DO NOTHING
+    """, params)
+    added = cur.rowcount
+
+    # Anything else: users who left, changed plan, or had a second service's plan too
+    cur.execute(f"""
+        WITH m AS ({MEMBERSHIPS})
+        DELETE FROM radusergroup ug
+        WHERE ug.groupname LIKE %(pattern)s
+        AND NOT EXISTS (
+            SELECT 1 FROM m WHERE m.username = ug.username AND m.groupname = ug.groupname
+        )
+    """, params)
+    removed = cur.rowcount
+    cur.close()
+    return {'memberships_added': added, 'memberships_removed': removed}
+
+
+def sync(conn, plans=None):
+    counts = sync_profiles(conn, plans)
+    counts.update(sync_memberships(conn))
+    return counts
+
+
+def redundant_user_rows(cur):
+    """
+    Per-user radreply rows that now duplicate the user's plan profile. Rows whose value
+    differs from the profile are deliberate overrides and are kept.
+    """
+    cur.execute("""
+        SELECT r.id
+        FROM radreply r
+        JOIN radusergroup ug ON ug.username = r.username AND ug.groupname LIKE %s
+        JOIN radgroupreply g ON g.groupname = ug.groupname AND g.attribute = r.attribute
+        WHERE r.value = g.value
+    """, (GROUP_PREFIX + '%',))
+    return [row[0] for row in cur.fetchall()]
+
+
+def migrate(conn, dry_run=False):
+    """Build profiles/memberships, drop the per-user rows they make redundant, switch the mode on"""
+    set_group_profiles(conn, True)
+    counts = sync(conn)
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM radreply")
+    counts['radreply_before'] = cur.fetchone()[0]
+
+    ids = redundant_user_rows(cur)
+    if ids and not dry_run:
+        cur.execute("DELETE FROM radreply WHERE id = ANY(%s)", (ids,))
+    counts['rows_saved'] = len(ids)
+
+    cur.execute("""
+        SELECT COUNT(*) FROM radreply r
+        JOIN radusergroup ug ON ug.username = r.username AND ug.groupname LIKE %s
+        WHERE r.attribute IN (
+            SELECT DISTINCT attribute FROM radgroupreply WHERE groupname LIKE %s
+        )
+    """, (GROUP_PREFIX + '%', GROUP_PREFIX + '%'))
+    counts['overrides_kept'] = cur.fetchone()[0] - (len(ids) if dry_run else 0)
+    cur.close()
+    return counts
+
+
+def disable(conn):
+    """
+    Switch the mode off: copy each member's profile back to radreply (keeping per-user
+    overrides), then drop the plan group memberships. Profiles are left for a later migrate.
+    """
+    set_group_profiles(conn, False)
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO radreply (username, attribute, op, value)
+        SELECT ug.username, g.attribute, g.op, g.value
+        FROM radusergroup ug
+        JOIN radgroupreply g ON g.groupname = ug.groupname
+        WHERE ug.groupname LIKE %s
+        ON CONFLICT (username, attribute) DO NOTHING
+    """, (GROUP_PREFIX + '%',))
+    restored = cur.rowcount
+    cur.execute("DELETE FROM radusergroup WHERE groupname LIKE %s", (GROUP_PREFIX + '%',))
+    removed = cur.rowcount
+    cur.close()
+    return {'rows_restored': restored, 'memberships_removed': removed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage per-plan RADIUS group profiles")
+    parser.add_argument("command", choices=("sync", "migrate", "disable"))
+    parser.add_argument("--dry-run", action="store_true",
+                        help="report what migrate/disable would change without committing")
+    args = parser.parse_args()
+
+    conn = db.connect()
+    try:
+        if args.command == "sync":
+            counts = sync(conn)
+        elif args.command == "migrate":
+            counts = migrate(conn, dry_run=args.dry_run)
+        else:
+            counts = disable(conn)
+        if args.dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Error: {e}")
+        exit(1)
+    finally:
+        conn.close()
+
+    if args.command == "disable":
+        prefix = "Would restore" if args.dry_run else "Restored"
+        print(f"✓ {prefix} {counts['rows_restored']} per-user radreply rows from group profiles")
+        print(f"✓ Memberships removed: {counts['memberships_removed']}")
+        print("✓ Group profiles mode is off" + (" (not committed)" if args.dry_run else ""))
+        return
+
+    print(f"✓ {counts['plans']} plan profiles ({counts['profile_rows_written']} rows written, "
+          f"{counts['profile_rows_removed']} removed)")
+    print(f"✓ Memberships: {counts['memberships_added']} added, {counts['memberships_removed']} removed")
+    if args.command == "migrate":
+        prefix = "Would remove" if args.dry_run else "Removed"
+        print(f"✓ {prefix} {counts['rows_saved']} of {counts['radreply_before']} radreply rows "
+              f"now served by group profiles")
+        print(f"  Per-user overrides kept: {counts['overrides_kept']}")
+        print("✓ Group profiles mode is on" + (" (not committed)" if args.dry_run else ""))
+
+
+if __name__ == "__main__":
+    main()
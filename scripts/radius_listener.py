@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Real-time RADIUS provisioning daemon
+LISTENs on the radius_changes channel fed by the triggers in 1066_add_radius_change_notify.sql
+and provisions just the services that changed, instead of waiting for the next cron run of
+check_and_provision_radius.py / provision_all_radius_users.py to rescan everything.
+
+Notifications arriving within --coalesce-ms of each other are merged into one batch (a bulk
+UPDATE of thousands of services becomes a few set-based syncs through
+sync_radius_delta.sync_services). A full reconcile (sync_radius_delta.sync --full) only runs:
+  - at startup, after LISTEN, so nothing committed in between is missed
+  - after the connection was lost or a batch failed, since notifications may have been dropped
+  - when a batch names more than --full-threshold services
+  - on an explicit NOTIFY radius_changes, 'full'
+
+Usage:
+    python3 scripts/radius_listener.py
+    python3 scripts/radius_listener.py --coalesce-ms 50 --max-batch 1000
+"""
+
+import argparse
+import select
+import signal
+import sys
+import time
+
+import psycopg2
+
+import db
+import sync_radius_delta
+from plan_attributes import PlanAttributes
+
+CHANNEL = "radius_changes"
+
+
+class Batch:
+    """Service and plan ids collected from a burst of notifications"""
+
+    def __init__(self):
+        self.service_ids = set()
+        self.plan_ids = set()
+        self.full = False
+        self.first_at = None
+
+    def add(self, payload):
+        kind, _, value = payload.partition(":")
+        if self.first_at is None:
+            self.first_at = time.perf_counter()
+        if kind == "service" and value.isdigit():
+            self.service_ids.add(int(value))
+        elif kind == "plan" and value.isdigit():
+            self.plan_ids.add(int(value))
+        else:
+            # 'full', or anything we don't understand: reconcile everything
+            self.full = True
+
+    def __len__(self):
+        return len(self.service_ids) + len(self.plan_ids) + int(self.full)
+
+
+def drain(conn, batch):
+    conn.poll()
+    while conn.notifies:
+        batch.add(conn.notifies.pop(0).payload)
+
+
+def wait_for_batch(listen_conn, coalesce_seconds, max_batch, heartbeat_seconds):
+    """Block until notifications arrive, then keep collecting for coalesce_seconds"""
+    batch = Batch()
+    drain(listen_conn, batch)
+    while not batch:
+        if select.select([listen_conn], [], [], heartbeat_seconds) == ([], [], []):
+            # Quiet period: make sure the connection is still alive
+            with listen_conn.cursor() as cur:
+                cur.execute("SELECT 1")
+        drain(listen_conn, batch)
+
+    deadline = batch.first_at + coalesce_seconds
+    while len(batch) < max_batch:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        select.select([listen_conn], [], [], remaining)
+        drain(listen_conn, batch)
+    return batch
+
+
+def full_reconcile(conn, plans, name):
+    """
+    Catch up after a gap in notifications. Services deleted during the gap are found through
+    radius_synced_services (sync_radius_delta.CHANGED_SERVICES_QUERY), since no row is left to scan.
+    """
+    started = time.perf_counter()
+    plans.refresh(conn)
+    counts = sync_radius_delta.sync(conn, name=name, full=True, plans=plans)
+    print(f"✓ Full reconcile: {counts['scanned']} services, {counts['created']} created, "
+          f"{counts['updated']} updated, {counts['deprovisioned']} deprovisioned "
+          f"in {time.perf_counter() - started:.2f}s")
+
+
+def process(conn, plans, batch, name, full_threshold):
+    if batch.full or len(batch.service_ids) > full_threshold:
+        full_reconcile(conn, plans, name)
+        return
+
+    started = time.perf_counter()
+    if batch.plan_ids:
+        plans.refresh(conn)
+    counts = sync_radius_delta.sync_services(conn, batch.service_ids, batch.plan_ids, plans)
+    now = time.perf_counter()
+    print(f"✓ {len(batch.service_ids)} service(s), {len(batch.plan_ids)} plan(s): "
+          f"{counts['created']} created, {counts['updated']} updated, "
+          f"{counts['deprovisioned']} deprovisioned in {(now - started) * 1000:.0f} ms "
+          f"({(now - batch.first_at) * 1000:.0f} ms after the first notification)")
+
+
+def listen(args):
+    """Connect, LISTEN, reconcile, then process batches until the connection fails"""
+    listen_conn = db.connect(application_name="isp-scripts/radius_listener-listen")
+    listen_conn.autocommit = True
+    conn = db.connect()
+    try:
+        with listen_conn.cursor() as cur:
+            cur.execute(f"LISTEN {CHANNEL}")
+        print(f"👂 Listening on {CHANNEL}")
+
+        plans = PlanAttributes.load(conn)
+        full_reconcile(conn, plans, args.name)
+        while True:
+            batch = wait_for_batch(listen_conn, args.coalesce_ms / 1000, args.max_batch, args.heartbeat)
+            process(conn, plans, batch, args.name, args.full_threshold)
+    finally:
+        for c in (listen_conn, conn):
+            if not c.closed:
+                c.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Provision RADIUS changes as they are committed (LISTEN/NOTIFY)")
+    parser.add_argument("--coalesce-ms", type=float, default=50,
+                        help="collect notifications this long after the first one before syncing")
+    parser.add_argument("--max-batch", type=int, default=1000,
+                        help="sync as soon as this many ids are pending")
+    parser.add_argument("--full-threshold", type=int, default=20000,
+                        help="run a full reconcile instead when a batch names more services than this")
+    parser.add_argument("--heartbeat", type=float, default=30,
+                        help="seconds of silence before checking the connection")
+    parser.add_argument("--name", default="radius", help="sync state key for full reconciles")
+    args = parser.parse_args()
+
+    db.require_database_url()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    print("=" * 60)
+    print("RADIUS CHANGE LISTENER")
+    print("=" * 60)
+
+    delay = 1.0
+    while True:
+        started = time.monotonic()
+        try:
+            listen(args)
+        except KeyboardInterrupt:
+            print("\nStopped")
+            return
+        except (psycopg2.Error, OSError) as e:
+            # Notifications sent while we were away are lost: the next connection reconciles fully
+            if time.monotonic() - started > 60:
+                delay = 1.0
+            print(f"❌ {str(e).strip()}; reconnecting in {delay:.0f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 60.0)
+
+
+if __name__ == "__main__":
+    main()
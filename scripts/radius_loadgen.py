@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+RADIUS authentication load generator
+Fires concurrent PAP Access-Requests (RFC 2865, with Message-Authenticator) over UDP at a local
+FreeRADIUS using the credentials provisioned in customer_services/radcheck, and reports
+throughput, p50/p95/p99 latency and Accept/Reject/timeout counts. This is the end-to-end check
+of the "sub-5ms authentication queries" the 1021 indexes are meant to give.
+
+Each worker has its own socket and one request in flight (closed loop), so --concurrency is
+the number of simultaneous authentications. --reject-ratio sends that fraction with a wrong
+password; answers are checked against what was expected and against the Response Authenticator.
+
+--during runs a provisioning script (from this directory) after --baseline-seconds of load and
+keeps the load running until it finishes, reporting idle and during-provisioning latency
+separately.
+
+Everything is local: FreeRADIUS with the PostgreSQL sql module, a client entry for this host
+(the setup scripts default the secret to testing123), no routers.
+
+Usage:
+    python3 scripts/radius_loadgen.py --concurrency 32 --duration 30
+    python3 scripts/radius_loadgen.py --during "provision_all_radius_users.py --bulk" --baseline-seconds 10
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import shlex
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import db
+from activate_services import percentile
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ACCESS_REQUEST = 1
+ACCESS_ACCEPT = 2
+ACCESS_REJECT = 3
+
+USER_NAME = 1
+USER_PASSWORD = 2
+NAS_IP_ADDRESS = 4
+NAS_PORT = 5
+MESSAGE_AUTHENTICATOR = 80
+
+CREDENTIALS_QUERY = """
+    SELECT cs.pppoe_username, cs.pppoe_password
+    FROM customer_services cs
+    JOIN radcheck r ON r.username = cs.pppoe_username
+        AND r.attribute = 'Cleartext-Password'
+        AND r.value = cs.pppoe_password
+    WHERE cs.status = 'active'
+    AND COALESCE(cs.is_suspended, false) = false
+    ORDER BY random()
+    LIMIT %s
+"""
+
+
+def attribute(kind, value):
+    return struct.pack("!BB", kind, len(value) + 2) + value
+
+
+def encrypt_password(password, secret, authenticator):
+    """User-Password hiding from RFC 2865 section 5.2"""
+    data = password.encode() or b"\x00"
+    data += b"\x00" * (-len(data) % 16)
+    result = b""
+    previous = authenticator
+    for i in range(0, len(data), 16):
+        key = hashlib.md5(secret + previous).digest()
+        block = bytes(a ^ b for a, b in zip(data[i:i + 16], key))
+        result += block
+        previous = block
+    return result
+
+
+def access_request(identifier, username, password, secret, nas_ip, nas_port=0):
+    """Encoded Access-Request and its Request Authenticator"""
+    authenticator = os.urandom(16)
+    attributes = (
+        attribute(USER_NAME, username.encode())
+        + attribute(USER_PASSWORD, encrypt_password(password, secret, authenticator))
+        + attribute(NAS_IP_ADDRESS, socket.inet_aton(nas_ip))
+        + attribute(NAS_PORT, struct.pack("!I", nas_port))
+    )
+    # Message-Authenticator is an HMAC-MD5 over the packet with its own value zeroed
+    length = 20 + len(attributes) + 18
+    packet = (struct.pack("!BBH", ACCESS_REQUEST, identifier, length) + authenticator
+              + attributes + attribute(MESSAGE_AUTHENTICATOR, b"\x00" * 16))
+    signature = hmac.new(secret, packet, hashlib.md5).digest()
+    return packet[:-16] + signature, authenticator
+
+
+def response_code(data, identifier, authenticator, secret):
+    """Code of a valid reply to our request, or None if it is not one"""
+    if len(data) < 20:
+        return None
+    code, reply_id, length = struct.unpack("!BBH", data[:4])
+    if reply_id != identifier or length > len(data):
+        return None
+    expected = hashlib.md5(data[:4] + authenticator + data[20:length] + secret).digest()
+    return code if hmac.compare_digest(expected, data[4:20]) else None
+
+
+class Stats:
+    """Latencies and outcomes for one phase"""
+
+    def __init__(self):
+        self.latencies = []
+        self.outcomes = {"accept": 0, "reject": 0, "timeout": 0, "invalid": 0, "unexpected": 0}
+        self.started = None
+        self.ended = None
+
+    def merge(self, other):
+        self.latencies += other.latencies
+        for key, n in other.outcomes.items():
+            self.outcomes[key] += n
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        seconds = (self.ended or time.perf_counter()) - (self.started or time.perf_counter())
+        answered = self.outcomes["accept"] + self.outcomes["reject"]
+        return {
+            "seconds": round(seconds, 3),
+            "requests": sum(self.outcomes[k] for k in ("accept", "reject", "timeout")),
+            "per_second": round(answered / seconds, 1) if seconds > 0 else 0,
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "max_ms": round(latencies[-1], 3) if latencies else 0,
+            **self.outcomes,
+        }
+
+
+class LoadGenerator:
+    def __init__(self, server, secret, credentials, concurrency, timeout, reject_ratio, nas_ip):
+        self.server = server
+        self.secret = secret
+        self.credentials = credentials
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.reject_ratio = reject_ratio
+        self.nas_ip = nas_ip
+        self.phase = "load"
+        self.phases = {}
+        self.stop = threading.Event()
+        self._results = []
+        self._lock = threading.Lock()
+
+    def set_phase(self, name):
+        now = time.perf_counter()
+        with self._lock:
+            if self.phase in self.phases:
+                self.phases[self.phase].ended = now
+            self.phase = name
+            self.phases.setdefault(name, Stats()).started = now
+
+    def worker(self, index, max_requests):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(self.timeout)
+        local = {}
+        identifier = 0
+        rng = random.Random(index)
+        sent = 0
+        try:
+            while not self.stop.is_set() and (max_requests is None or sent < max_requests):
+                username, password = self.credentials[rng.randrange(len(self.credentials))]
+                should_accept = rng.random() >= self.reject_ratio
+                if not should_accept:
+                    password = password + "-wrong"
+                identifier = (identifier + 1) % 256
+                packet, authenticator = access_request(identifier, username, password, self.secret,
+                                                       self.nas_ip, nas_port=index)
+                phase = self.phase
+                stats = local.setdefault(phase, Stats())
+
+                started = time.perf_counter()
+                sock.sendto(packet, self.server)
+                sent += 1
+                code = None
+                try:
+                    while code is None:
+                        data, _ = sock.recvfrom(4096)
+                        code = response_code(data, identifier, authenticator, self.secret)
+                        if code is None:
+                            # Late answer to an earlier (timed out) request, or garbage
+                            stats.outcomes["invalid"] += 1
+                except socket.timeout:
+                    stats.outcomes["timeout"] += 1
+                    continue
+                stats.latencies.append((time.perf_counter() - started) * 1000)
+
+                if code == ACCESS_ACCEPT:
+                    stats.outcomes["accept"] += 1
+                elif code == ACCESS_REJECT:
+                    stats.outcomes["reject"] += 1
+                if (code == ACCESS_ACCEPT) != should_accept:
+                    stats.outcomes["unexpected"] += 1
+        finally:
+            sock.close()
+            with self._lock:
+                self._results.append(local)
+
+    def start(self, max_requests=None):
+        self.set_phase(self.phase)
+        per_worker = None if max_requests is None else -(-max_requests // self.concurrency)
+        self.threads = [
+            threading.Thread(target=self.worker, args=(i, per_worker), daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def finish(self):
+        self.stop.set()
+        for t in self.threads:
+            t.join()
+        self.set_phase("done")
+        for local in self._results:
+            for name, stats in local.items():
+                self.phases[name].merge(stats)
+        return {name: stats.report() for name, stats in self.phases.items() if name != "done"}
+
+
+def load_credentials(limit):
+    conn = db.connect()
+    try:
+        cur = conn.cursor()
+        cur.execute(CREDENTIALS_QUERY, (limit,))
+        return cur.fetchall()
+    finally:
+        conn.close()
+
+
+def run_during(generator, command, baseline_seconds):
+    """Baseline load, then the provisioning command under load; returns its exit code and log"""
+    generator.set_phase("idle")
+    generator.start()
+    time.sleep(baseline_seconds)
+
+    argv = shlex.split(command)
+    log = tempfile.TemporaryFile(mode="w+")
+    print(f"▶️  Running {command} under load...")
+    generator.set_phase("during")
+    proc = subprocess.Popen([sys.executable, os.path.join(SCRIPTS_DIR, argv[0]), *argv[1:]],
+                            stdout=log, stderr=subprocess.STDOUT, cwd=SCRIPTS_DIR)
+    code = proc.wait()
+    log.seek(0)
+    return code, log.read()
+
+
+def print_report(results):
+    for name, r in results.items():
+        print(f"\n{name}: {r['requests']:,} requests in {r['seconds']:.1f}s ({r['per_second']:,.0f} auth/sec)")
+        print(f"  latency p50 {r['p50_ms']:.2f} ms  p95 {r['p95_ms']:.2f} ms  "
+              f"p99 {r['p99_ms']:.2f} ms  max {r['max_ms']:.2f} ms")
+        print(f"  Access-Accept {r['accept']:,}  Access-Reject {r['reject']:,}  "
+              f"timeouts {r['timeout']:,}  invalid {r['invalid']:,}")
+        if r['unexpected']:
+            print(f"  ⚠️  {r['unexpected']:,} answers differed from the expected Accept/Reject")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PAP authentication load against a local FreeRADIUS")
+    parser.add_argument("--server", default="127.0.0.1", help="FreeRADIUS address (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=1812)
+    parser.add_argument("--secret", default=os.environ.get("RADIUS_SECRET", "testing123"),
+                        help="shared secret (default: $RADIUS_SECRET or testing123)")
+    parser.add_argument("--nas-ip", default="127.0.0.1", help="NAS-IP-Address to send")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load")
+    parser.add_argument("--requests", type=int, help="stop after this many requests instead")
+    parser.add_argument("--users", type=int, default=10000, help="provisioned users to sample")
+    parser.add_argument("--reject-ratio", type=float, default=0.0,
+                        help="fraction of requests sent with a wrong password")
+    parser.add_argument("--timeout", type=float, default=2.0, help="seconds to wait for a reply")
+    parser.add_argument("--during", metavar="SCRIPT",
+                        help='provisioning command to run under load, e.g. "provision_all_radius_users.py --bulk"')
+    parser.add_argument("--baseline-seconds", type=float, default=10,
+                        help="load before starting the --during command")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    db.require_database_url()
+    credentials = load_credentials(args.users)
+    if not credentials:
+        print("❌ No provisioned users found (active services with a matching radcheck password)")
+        exit(1)
+
+    print("=" * 60)
+    print("RADIUS AUTHENTICATION LOAD")
+    print("=" * 60)
+    print(f"{len(credentials):,} users, {args.concurrency} concurrent, server {args.server}:{args.port}")
+
+    generator = LoadGenerator((args.server, args.port), args.secret.encode(), credentials,
+                              args.concurrency, args.timeout, args.reject_ratio, args.nas_ip)
+    exit_code = None
+    try:
+        if args.during:
+            exit_code, output = run_during(generator, args.during, args.baseline_seconds)
+        else:
+            generator.start(args.requests)
+            deadline = None if args.requests else time.perf_counter() + args.duration
+            while any(t.is_alive() for t in generator.threads):
+                if deadline and time.perf_counter() >= deadline:
+                    break
+                time.sleep(0.1)
+    except KeyboardInterrupt:
+        print("\nStopping...")
+    results = generator.finish()
+
+    print_report(results)
+    if args.during:
+        status = "✓" if exit_code == 0 else "❌"
+        print(f"\n{status} {args.during} exited with {exit_code}")
+        if exit_code:
+            print(output[-2000:])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"concurrency": args.concurrency, "users": len(credentials),
+                       "during": args.during, "phases": results}, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Diff-based radcheck/radreply writer
+Loads the current RADIUS rows for a batch of users in one query, diffs them against the
+desired attributes in memory and only writes the attributes that actually changed.
+Unchanged users cost no DELETE/INSERT churn (no dead tuples or WAL on radreply).
+"""
+
+from psycopg2.extras import execute_values
+
+TABLES = ("radcheck", "radreply")
+
+# Services provisioned by provision_all_radius_users.py (and provision_async.py, for comparison)
+ACTIVE_SERVICES_QUERY = """
+    SELECT 
+        cs.id as service_id,
+        cs.customer_id,
+        c.first_name,
+        c.last_name,
+        c.email,
+        cs.pppoe_username,
+        cs.pppoe_password,
+        sp.download_speed,
+        sp.upload_speed,
+        sp.name as plan_name,
+        cs.service_plan_id
+    FROM customer_services cs
+    JOIN customers c ON c.id = cs.customer_id
+    JOIN service_plans sp ON sp.id = cs.service_plan_id
+    WHERE cs.status = 'active'
+    AND COALESCE(cs.is_suspended, false) = false
+    AND cs.pppoe_username IS NOT NULL
+    AND cs.pppoe_password IS NOT NULL
+"""
+
+
+def desired_user(password, reply_attributes, op=":="):
+    """Build the desired state for one user from a password and {attribute: value} replies"""
+    return {
+        "radcheck": {"Cleartext-Password": (op, password)},
+        "radreply": {attr: (op, str(value)) for attr, value in reply_attributes.items()},
+    }
+
+
+def load_current(cur, usernames):
+    """Fetch existing radcheck and radreply rows for all usernames in one round trip"""
+    current = {username: {"radcheck": {}, "radreply": {}} for username in usernames}
+    if not usernames:
+        return current
+    cur.execute("""
+        SELECT 'radcheck', username, attribute, op, value FROM radcheck WHERE username = ANY(%(u)s)
+        UNION ALL
+        SELECT 'radreply', username, attribute, op, value FROM radreply WHERE username = ANY(%(u)s)
+    """, {"u": list(usernames)})
+    for table, username, attribute, op, value in cur.fetchall():
+        current[username][table][attribute] = (op, value)
+    return current
+
+
+def diff(desired, current, partial=False):
+    """
+    Compare desired vs current state per user.
+    radcheck is only touched for the attributes we manage (other check items such as
+    Simultaneous-Use are left alone); radreply is fully owned, so extra attributes are deleted,
+    unless partial is set, in which case radreply is treated like radcheck.
+    """
+    changes = {
+        table: {"insert": [], "update": [], "delete": []} for table in TABLES
+    }
+    users = {}
+    avoided = {"insert": 0, "update": 0, "delete": 0}
+
+    for username, want in desired.items():
+        have = current.get(username, {"radcheck": {}, "radreply": {}})
+        user_changes = []
+        for table in TABLES:
+            wanted = want.get(table, {})
+            existing = have.get(table, {})
+            for attribute, (op, value) in wanted.items():
+                if attribute not in existing:
+                    changes[table]["insert"].append((username, attribute, op, value))
+                    user_changes.append(("+", table, attribute, None, value))
+                elif existing[attribute] != (op, value):
+                    changes[table]["update"].append((username, attribute, op, value))
+                    user_changes.append(("~", table, attribute, existing[attribute][1], value))
+                    if table == "radreply":
+                        # A delete-and-reinsert writer would have done both
+                        avoided["delete"] += 1
+                        avoided["insert"] += 1
+                elif table == "radreply":
+                    avoided["delete"] += 1
+                    avoided["insert"] += 1
+                else:
+                    avoided["update"] += 1
+            if table == "radreply" and not partial:
+                for attribute, (op, value) in existing.items():
+                    if attribute not in wanted:
+                        changes[table]["delete"].append((username, attribute))
+                        user_changes.append(("-", table, attribute, value, None))
+
+        if not have["radcheck"]:
+            action = "Created"
+        elif user_changes:
+            action = "Updated"
+        else:
+            action = "Unchanged"
+        users[username] = {"action": action, "changes": user_changes}
+
+    return changes, users, avoided
+
+
+def apply_changes(cur, changes):
+    """Issue one batched statement per table and kind of change"""
+    for table in TABLES:
+        inserts = changes[table]["insert"]
+        updates = changes[table]["update"]
+        deletes = changes[table]["delete"]
+        if deletes:
+            execute_values(cur, f"""
+                DELETE FROM {table} t
+                USING (VALUES %s) AS d(username, attribute)
+                WHERE t.username = d.username AND t.attribute = d.attribute
+            """, deletes)
+        if updates:
+            execute_values(cur, f"""
+                UPDATE {table} t
+                SET op = v.op, value = v.value
+                FROM (VALUES %s) AS v(username, attribute, op, value)
+                WHERE t.username = v.username AND t.attribute = v.attribute
+            """, updates)
+        if inserts:
+            execute_values(cur, f"""
+                INSERT INTO {table} (username, attribute, op, value)
+                VALUES %s
+            """, inserts)
+
+
+def count_writes(changes):
+    return {
+        kind: sum(len(changes[table][kind]) for table in TABLES)
+        for kind in ("insert", "update", "delete")
+    }
+
+
+def reconcile(conn, desired, dry_run=False, batch_size=1000, partial=False):
+    """
+    Bring radcheck/radreply in line with desired ({username: desired_user(...)}).
+    Users are processed in batches of batch_size (one read + at most six writes each).
+    In dry-run mode nothing is written; the computed diff is still returned.
+    """
+    result = {
+        "users": {},
+        "writes": {"insert": 0, "update": 0, "delete": 0},
+        "avoided": {"insert": 0, "update": 0, "delete": 0},
+    }
+    usernames = list(desired)
+    cur = conn.cursor()
+    for start in range(0, len(usernames), batch_size):
+        batch = {u: desired[u] for u in usernames[start:start + batch_size]}
+        current = load_current(cur, list(batch))
+        changes, users, avoided = diff(batch, current, partial=partial)
+        if not dry_run:
+            apply_changes(cur, changes)
+        result["users"].update(users)
+        for kind, n in count_writes(changes).items():
+            result["writes"][kind] += n
+        for kind, n in avoided.items():
+            result["avoided"][kind] += n
+    cur.close()
+    return result
+
+
+def print_diff(result):
+    """Print the per-user diff and write counts"""
+    for username, user in result["users"].items():
+        for sign, table, attribute, old, new in user["changes"]:
+            if sign == "~":
+                print(f"  ~ {username} {table} {attribute}: {old!r} -> {new!r}")
+            elif sign == "+":
+                print(f"  + {username} {table} {attribute} = {new!r}")
+            else:
+                print(f"  - {username} {table} {attribute} (was {old!r})")
+    writes = result["writes"]
+    avoided = result["avoided"]
+    print(f"Writes: {writes['insert']} inserts, {writes['update']} updates, {writes['delete']} deletes")
+    print(f"Avoided: {avoided['insert']} inserts, {avoided['update']} updates, {avoided['delete']} deletes")
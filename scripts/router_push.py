@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+Router push worker
+Consumes the provisioning_queue rows that provisioning_worker.py leaves alone: PPPoE users on
+Ubiquiti/EdgeRouter and Juniper routers (provisioning_worker.PUSH_VENDOR_PATTERN), which are
+configured over SSH rather than through RADIUS. Opening a session to one of these routers costs far
+more than the commands sent over it, so the queue is coalesced before anything is pushed:
+  - only the newest action per (router_id, username) is pushed; older pending rows for the same
+    user are marked 'superseded' (activate, change plan, suspend = one delete)
+  - each claim takes up to --batch-size users of one router and applies them in one session
+    (one configure ... commit)
+  - at most --per-router sessions run against a router at a time: usernames are hashed into that
+    many slots, each held under an advisory lock, so one user's actions are still pushed in order.
+    Every pusher process must use the same --per-router. --workers bounds sessions overall.
+
+enqueue() is the Python side of lib/router-push.ts; it supersedes the user's pending rows in the
+same statement as the insert. Failed sessions are retried with provisioning_worker's backoff.
+Routers must be in the pusher's known_hosts. --endpoint sends each session to router_standin.py
+over HTTP instead of SSH, for testing without routers.
+
+Usage:
+    python3 scripts/router_push.py --drain
+    python3 scripts/router_push.py --workers 16 --per-router 2 --batch-size 500
+    python3 scripts/router_push.py --enqueue add_pppoe_user --router 3 --username jdoe --password s3cret
+    python3 scripts/router_standin.py & python3 scripts/router_push.py --endpoint http://127.0.0.1:8729 --drain
+"""
+
+import argparse
+import functools
+import ipaddress
+import json
+import os
+import re
+import socket
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2.extras import RealDictCursor
+
+import db
+from provisioning_worker import LEASE_SECONDS, PUSH_VENDOR_PATTERN, record_results
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+# Queue actions this pusher owns, and whether the user exists on the router afterwards
+ACTIONS = {
+    'add_pppoe_user': True,
+    'remove_pppoe_user': False,
+}
+
+DUE = """
+    (status = 'pending' AND COALESCE(next_attempt_at, created_at) <= NOW())
+    OR (status = 'processing' AND updated_at < NOW() - make_interval(secs => %(lease)s))
+"""
+
+ROUTERS_QUERY = f"""
+    SELECT nd.id, nd.name, nd.type, to_jsonb(nd) AS device
+    FROM network_devices nd
+    WHERE nd.type ~* %(vendors)s
+    AND EXISTS (
+        SELECT 1 FROM provisioning_queue
+        WHERE router_id = nd.id AND action = ANY(%(actions)s) AND ({DUE})
+    )
+    ORDER BY nd.id
+"""
+
+ENQUEUE_QUERY = """
+    WITH superseded AS (
+        UPDATE provisioning_queue
+        SET status = 'superseded', processed_at = NOW(), updated_at = NOW()
+        WHERE router_id = %(router)s AND username = %(username)s
+        AND status = 'pending' AND action = ANY(%(actions)s)
+        RETURNING id
+    )
+    INSERT INTO provisioning_queue (router_id, action, username, password, static_ip, profile, status)
+    VALUES (%(router)s, %(action)s, %(username)s, %(password)s, %(static_ip)s, %(profile)s, 'pending')
+    RETURNING id, (SELECT COUNT(*) FROM superseded)
+"""
+
+# A user's newest due row is pushed unless any newer action for the user exists: a row reclaimed
+# after a crashed session (lease expired) must not undo what was pushed after it, so it is only
+# superseded. Older rows the winner replaces, pending or left 'processing' past their lease, are
+# superseded in the same statement. The advisory lock on (router, slot) makes this the only claimer
+# for these users; SKIP LOCKED only steps around a concurrent enqueue().
+CLAIM_QUERY = f"""
+    WITH latest AS (
+        SELECT DISTINCT ON (username) id, username
+        FROM provisioning_queue
+        WHERE router_id = %(router)s AND action = ANY(%(actions)s) AND username IS NOT NULL
+        AND ((hashtext(username) & 2147483647) %% %(slots)s) = %(slot)s
+        AND ({DUE})
+        ORDER BY username, id DESC
+    ),
+    targets AS (
+        SELECT l.id, l.username, NOT EXISTS (
+            SELECT 1 FROM provisioning_queue n
+            WHERE n.router_id = %(router)s AND n.username = l.username
+            AND n.action = ANY(%(actions)s) AND n.id > l.id AND n.status <> 'superseded'
+        ) AS current
+        FROM latest l
+    ),
+    winners AS (
+        (SELECT id, username, current FROM targets WHERE current ORDER BY id LIMIT %(limit)s)
+        UNION ALL
+        SELECT id, username, current FROM targets WHERE NOT current
+    ),
+    locked AS (
+        SELECT q.id, q.id = w.id AND w.current AS winner
+        FROM provisioning_queue q
+        JOIN winners w ON w.username = q.username
+        WHERE q.router_id = %(router)s AND q.action = ANY(%(actions)s) AND q.id <= w.id
+        AND (
+            q.id = w.id
+            OR q.status = 'pending'
+            OR (q.status = 'processing' AND q.updated_at < NOW() - make_interval(secs => %(lease)s))
+        )
+        FOR UPDATE OF q SKIP LOCKED
+    ),
+    superseded AS (
+        UPDATE provisioning_queue q
+        SET status = 'superseded', processed_at = NOW(), updated_at = NOW(), claimed_by = NULL
+        FROM locked l
+        WHERE q.id = l.id AND NOT l.winner
+        RETURNING q.id
+    )
+    UPDATE provisioning_queue q
+    SET status = 'processing',
+        attempts = COALESCE(q.attempts, 0) + 1,
+        claimed_by = %(worker)s,
+        updated_at = NOW()
+    FROM locked l
+    WHERE q.id = l.id AND l.winner
+    RETURNING q.id, q.action, q.username, q.password, host(q.static_ip) as static_ip, q.profile,
+              q.attempts, COALESCE(q.max_attempts, 3) as max_attempts,
+              (SELECT COUNT(*) FROM superseded) as superseded
+"""
+
+# Access profile Juniper BNGs authenticate local PPPoE clients against
+JUNOS_PROFILE = "pppoe-users"
+
+# vbash needs the Vyatta script template before configuration commands
+EDGEOS_TEMPLATE = "source /opt/vyatta/etc/functions/script-template"
+
+SHELLS = {
+    'edgeos': "vbash -s",
+    'junos': "cli",
+}
+
+# Both CLIs keep going after a bad statement; the commit output is what tells us it failed
+FAILURE = re.compile(r"^\s*error:|commit failed|configuration check-out failed", re.IGNORECASE | re.MULTILINE)
+
+CONTROL_CHARACTERS = re.compile(r"[\x00-\x1f\x7f]")
+
+
+def vendor_of(device_type):
+    return "junos" if "juniper" in (device_type or "").lower() else "edgeos"
+
+
+def quote(value):
+    """Double-quoted CLI string; both CLIs take backslash escapes inside quotes"""
+    if CONTROL_CHARACTERS.search(value):
+        raise ValueError("control character in value")
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def user_commands(vendor, row):
+    """Commands that bring one user to the row's state (replacing whatever the router had)"""
+    if not row['username']:
+        raise ValueError(f"queue row {row['id']} has no username")
+    present = ACTIONS[row['action']]
+    if present and not row['password']:
+        raise ValueError(f"queue row {row['id']} has no password")
+    if row['static_ip']:
+        ipaddress.ip_address(row['static_ip'])
+
+    if vendor == "junos":
+        node = f"access profile {JUNOS_PROFILE} client {quote(row['username'])}"
+        commands = [f"delete {node}"]
+        if present:
+            commands.append(f"set {node} chap-secret {quote(row['password'])}")
+            if row['static_ip']:
+                commands.append(f"set {node} ppp framed-ip-address {row['static_ip']}")
+    else:
+        node = f"service pppoe-server authentication local-users username {quote(row['username'])}"
+        commands = [f"delete {node}"]
+        if present:
+            commands.append(f"set {node} password {quote(row['password'])}")
+            if row['static_ip']:
+                commands.append(f"set {node} static-ip {row['static_ip']}")
+    return commands
+
+
+def session_commands(vendor, rows):
+    """
+    One configuration session applying every row. Rows that cannot be rendered are left out;
+    returns (commands, rows in the session, {row_id: error} for the rest).
+    """
+    commands = []
+    pushed = []
+    errors = {}
+    for row in rows:
+        try:
+            commands += user_commands(vendor, row)
+            pushed.append(row)
+        except ValueError as e:
+            errors[row['id']] = str(e)
+
+    if vendor == "junos":
+        commands = ["configure private"] + commands + ["commit and-quit"]
+    else:
+        commands = [EDGEOS_TEMPLATE, "configure"] + commands + ["commit", "save", "exit"]
+    return commands, pushed, errors
+
+
+def ssh_push(router, vendor, commands, rows, timeout=30.0):
+    """Run the session over SSH with the router's network_devices credentials"""
+    device = router['device']
+    client = paramiko.SSHClient()
+    client.load_system_host_keys()
+    try:
+        client.connect(device['ip_address'], port=device.get('ssh_port') or 22,
+                       username=device.get('username'), password=device.get('password'),
+                       timeout=timeout)
+        stdin, stdout, stderr = client.exec_command(SHELLS[vendor], timeout=timeout)
+        stdin.write("\n".join(commands) + "\n")
+        stdin.channel.shutdown_write()
+        output = stdout.read().decode(errors="replace") + stderr.read().decode(errors="replace")
+        status = stdout.channel.recv_exit_status()
+    finally:
+        client.close()
+
+    failure = FAILURE.search(output)
+    if status != 0 or failure:
+        line = output[failure.start():].strip().splitlines()[0] if failure else f"exit status {status}"
+        raise RuntimeError(line)
+
+
+def http_push(endpoint, router, vendor, commands, rows, timeout=30.0):
+    """POST the session to a stand-in router (router_standin.py)"""
+    body = json.dumps({
+        'router_id': router['id'],
+        'vendor': vendor,
+        'commands': commands,
+        'actions': [
+            {
+                'action': row['action'],
+                'username': row['username'],
+                'password': row['password'],
+                'static_ip': row['static_ip'],
+                'profile': row['profile'],
+            }
+            for row in rows
+        ],
+    }).encode()
+    request = urllib.request.Request(endpoint.rstrip("/") + "/push", data=body,
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        result = json.load(response)
+    if not result.get('ok'):
+        raise RuntimeError(result.get('error') or "push rejected")
+
+
+def enqueue(conn, router_id, action, username, password=None, static_ip=None, profile=None):
+    """
+    Queue an action for a user on a router, superseding the user's older pending actions there.
+    Does not commit. Returns (queue row id, rows superseded).
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"unknown action {action!r}")
+    cur = conn.cursor()
+    cur.execute(ENQUEUE_QUERY, {
+        'router': router_id,
+        'action': action,
+        'username': username,
+        'password': password,
+        'static_ip': static_ip,
+        'profile': profile,
+        'actions': list(ACTIONS),
+    })
+    row_id, superseded = cur.fetchone()
+    cur.close()
+    return row_id, superseded
+
+
+def due_routers(conn):
+    """Push-managed routers with due queue rows"""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(ROUTERS_QUERY, {
+        'vendors': PUSH_VENDOR_PATTERN,
+        'actions': list(ACTIONS),
+        'lease': LEASE_SECONDS,
+    })
+    routers = cur.fetchall()
+    conn.commit()
+    cur.close()
+    return routers
+
+
+def claim(conn, router_id, slot, slots, worker_name, batch_size):
+    """Claim the net action of up to batch_size users in one router slot and commit"""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(CLAIM_QUERY, {
+        'router': router_id,
+        'slot': slot,
+        'slots': slots,
+        'worker': worker_name,
+        'limit': batch_size,
+        'actions': list(ACTIONS),
+        'lease': LEASE_SECONDS,
+    })
+    rows = cur.fetchall()
+    conn.commit()
+    cur.close()
+    return rows
+
+
+def push_slot(router, slot, slots, transport, worker_name, batch_size):
+    """
+    Drain one slot of a router under its advisory lock, one session per claimed batch.
+    Returns counts, or None when another pusher holds the slot.
+    """
+    with db.pooled() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_lock(%s, %s)", (router['id'], slot))
+        locked = cur.fetchone()[0]
+        conn.commit()
+        if not locked:
+            cur.close()
+            return None
+
+        counts = dict.fromkeys(("sessions", "superseded", "completed", "retrying", "failed"), 0)
+        vendor = vendor_of(router['type'])
+        try:
+            while True:
+                rows = claim(conn, router['id'], slot, slots, worker_name, batch_size)
+                if not rows:
+                    break
+                counts['superseded'] += rows[0]['superseded']
+
+                commands, pushed, results = session_commands(vendor, rows)
+                error = None
+                started = time.perf_counter()
+                if pushed:
+                    try:
+                        transport(router, vendor, commands, pushed)
+                    except Exception as e:
+                        error = str(e) or type(e).__name__
+                    counts['sessions'] += 1
+                results.update({row['id']: error for row in pushed})
+                elapsed_ms = (time.perf_counter() - started) * 1000
+
+                completed, retrying, failed = record_results(conn, rows, results)
+                counts['completed'] += completed
+                counts['retrying'] += retrying
+                counts['failed'] += failed
+                if error:
+                    print(f"  ❌ {router['name']} [{slot}]: {len(pushed)} user(s) not pushed: {error}")
+                else:
+                    print(f"  ✓ {router['name']} [{slot}]: {len(pushed)} user(s) in one session "
+                          f"({rows[0]['superseded']} superseded) in {elapsed_ms:.0f} ms")
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s, %s)", (router['id'], slot))
+            conn.commit()
+            cur.close()
+    return counts
+
+
+def run(transport, workers=8, per_router=1, batch_size=500, drain=False, poll_interval=2.0):
+    """Push due queue rows router by router until drained (or forever); returns total counts"""
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+    totals = dict.fromkeys(("sessions", "superseded", "completed", "retrying", "failed"), 0)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            with db.pooled() as conn:
+                routers = due_routers(conn)
+            futures = [
+                executor.submit(push_slot, router, slot, per_router, transport, worker_name, batch_size)
+                for router in routers
+                for slot in range(per_router)
+            ]
+            processed = 0
+            for future in futures:
+                counts = future.result()
+                if counts:
+                    processed += counts['completed'] + counts['retrying'] + counts['failed']
+                    for key, n in counts.items():
+                        totals[key] += n
+
+            if not processed:
+                # Nothing due, or only in slots another pusher holds
+                if drain:
+                    break
+                time.sleep(poll_interval)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Push coalesced provisioning_queue actions to SSH-managed routers")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent router sessions overall")
+    parser.add_argument("--per-router", type=int, default=1,
+                        help="concurrent sessions per router (same value on every pusher)")
+    parser.add_argument("--batch-size", type=int, default=500, help="users applied per session")
+    parser.add_argument("--drain", action="store_true",
+                        help="exit once the queue has no due rows instead of polling")
+    parser.add_argument("--poll-interval", type=float, default=2.0,
+                        help="seconds to sleep when the queue is empty")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-session timeout in seconds")
+    parser.add_argument("--endpoint", help="push to a stand-in router over HTTP (router_standin.py) instead of SSH")
+
+    enqueue_group = parser.add_argument_group("enqueue one action instead of pushing")
+    enqueue_group.add_argument("--enqueue", choices=sorted(ACTIONS), metavar="ACTION",
+                               help=f"one of: {', '.join(ACTIONS)}")
+    enqueue_group.add_argument("--router", type=int, help="network_devices id")
+    enqueue_group.add_argument("--username")
+    enqueue_group.add_argument("--password")
+    enqueue_group.add_argument("--static-ip")
+    enqueue_group.add_argument("--profile")
+    args = parser.parse_args()
+
+    db.require_database_url()
+
+    if args.enqueue:
+        if args.router is None or not args.username:
+            parser.error("--enqueue needs --router and --username")
+        conn = db.connect()
+        try:
+            row_id, superseded = enqueue(conn, args.router, args.enqueue, args.username,
+                                         args.password, args.static_ip, args.profile)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Error: {e}")
+            exit(1)
+        finally:
+            conn.close()
+        print(f"✓ Queued {args.enqueue} for {args.username} on router {args.router} "
+              f"(row {row_id}, {superseded} pending row(s) superseded)")
+        return
+
+    if args.endpoint:
+        transport = functools.partial(http_push, args.endpoint, timeout=args.timeout)
+    elif paramiko is None:
+        print("❌ Pushing over SSH needs paramiko (pip install paramiko), or use --endpoint")
+        exit(1)
+    else:
+        transport = functools.partial(ssh_push, timeout=args.timeout)
+
+    print("=" * 60)
+    print("ROUTER PUSH")
+    print("=" * 60)
+    print(f"{args.workers} session(s) overall, {args.per_router} per router, "
+          f"up to {args.batch_size} users per session")
+
+    # One pooled connection per concurrent session, plus one for router discovery
+    db.get_pool(maxconn=args.workers + 1)
+    started = time.perf_counter()
+    try:
+        totals = run(transport, args.workers, args.per_router, args.batch_size, args.drain, args.poll_interval)
+    except KeyboardInterrupt:
+        print("\nStopped")
+        return
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        exit(1)
+    finally:
+        db.close_pool()
+
+    elapsed = time.perf_counter() - started
+    print(f"\n✓ {totals['completed']} users pushed in {totals['sessions']} session(s), "
+          f"{totals['superseded']} superseded actions skipped, {totals['retrying']} retrying, "
+          f"{totals['failed']} failed in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Stand-in router endpoint
+A local HTTP server that takes the configuration sessions router_push.py --endpoint sends and
+applies them to an in-memory PPPoE user table per router, so the queue, coalescing and
+per-router concurrency can be exercised without real Ubiquiti or Juniper hardware.
+
+    POST /push   {"router_id", "vendor", "commands", "actions"} -> {"ok": true} or {"ok": false, "error"}
+    GET  /state  users per router, sessions and actions received, and the most sessions that
+                 were open at once against each router (compare with router_push.py --per-router)
+
+--session-ms holds each session open for that long (an SSH login and commit are slow),
+--fail-rate rejects that fraction of sessions so retries and backoff can be watched.
+
+Usage:
+    python3 scripts/router_standin.py
+    python3 scripts/router_standin.py --port 8729 --session-ms 300 --fail-rate 0.1
+    curl -s http://127.0.0.1:8729/state
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Routers:
+    """User tables and session statistics for every router that has been pushed to"""
+
+    def __init__(self, session_seconds=0.0, fail_rate=0.0):
+        self.session_seconds = session_seconds
+        self.fail_rate = fail_rate
+        self.lock = threading.Lock()
+        self.users = {}
+        self.stats = {}
+
+    def _stats(self, router_id):
+        return self.stats.setdefault(router_id, {
+            'sessions': 0, 'failed_sessions': 0, 'actions': 0, 'commands': 0,
+            'open_sessions': 0, 'max_concurrent_sessions': 0,
+        })
+
+    def push(self, session):
+        """Apply one session's actions all-or-nothing; returns an error message or None"""
+        router_id = str(session['router_id'])
+        with self.lock:
+            stats = self._stats(router_id)
+            stats['open_sessions'] += 1
+            stats['max_concurrent_sessions'] = max(stats['max_concurrent_sessions'], stats['open_sessions'])
+        try:
+            time.sleep(self.session_seconds)
+            with self.lock:
+                stats['sessions'] += 1
+                stats['commands'] += len(session.get('commands', []))
+                if random.random() < self.fail_rate:
+                    stats['failed_sessions'] += 1
+                    return "commit failed (injected)"
+
+                users = self.users.setdefault(router_id, {})
+                for action in session['actions']:
+                    stats['actions'] += 1
+                    if action['action'] == 'add_pppoe_user':
+                        users[action['username']] = {
+                            'password': action['password'],
+                            'static_ip': action.get('static_ip'),
+                            'profile': action.get('profile'),
+                        }
+                    else:
+                        users.pop(action['username'], None)
+            return None
+        finally:
+            with self.lock:
+                stats['open_sessions'] -= 1
+
+    def state(self):
+        with self.lock:
+            return {
+                router_id: dict(self.stats[router_id], users=self.users.get(router_id, {}))
+                for router_id in self.stats
+            }
+
+
+class Handler(BaseHTTPRequestHandler):
+    routers = None
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/state":
+            self._reply(404, {'ok': False, 'error': "not found"})
+            return
+        self._reply(200, self.routers.state())
+
+    def do_POST(self):
+        if self.path != "/push":
+            self._reply(404, {'ok': False, 'error': "not found"})
+            return
+        try:
+            session = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError as e:
+            self._reply(400, {'ok': False, 'error': f"bad session: {e}"})
+            return
+        if not isinstance(session, dict) or 'router_id' not in session or not isinstance(session.get('actions'), list):
+            self._reply(400, {'ok': False, 'error': "bad session: needs router_id and actions"})
+            return
+        error = self.routers.push(session)
+        self._reply(200, {'ok': error is None, 'error': error})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for SSH-managed routers (router_push.py --endpoint)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8729)
+    parser.add_argument("--session-ms", type=float, default=200, help="how long each session stays open")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of sessions to reject")
+    args = parser.parse_args()
+
+    Handler.routers = Routers(args.session_ms / 1000, args.fail_rate)
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"🖧  Stand-in router listening on http://{args.host}:{args.port} "
+          f"({args.session_ms:.0f} ms sessions, {args.fail_rate:.0%} failing)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped")
+        for router_id, state in sorted(Handler.routers.state().items()):
+            print(f"  router {router_id}: {len(state['users'])} users, {state['sessions']} sessions, "
+                  f"max {state['max_concurrent_sessions']} concurrent")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Service expiry sweeper
+Suspends services whose service_end has passed (1025_billing_lifecycle_schema.sql) and stops
+them authenticating. Each batch is one statement in one transaction: expired services are
+picked through the partial index idx_customer_services_service_end (is_active = true), their
+is_active/is_suspended flags are flipped, their radcheck rows are removed and service_events
+rows are written in bulk.
+
+Rows are claimed with FOR UPDATE SKIP LOCKED and leave the partial index once swept, so
+overlapping runs never block each other. Safe to run every minute from cron:
+    * * * * * DATABASE_URL=... python3 scripts/sweep_expired_services.py
+
+Reactivation (wallet/billing) sets is_active = true, is_suspended = false again, and the
+RADIUS sync re-provisions the user.
+"""
+
+import argparse
+import time
+
+import db
+
+SWEEP_QUERY = """
+    WITH expired AS (
+        SELECT id, is_suspended AS was_suspended
+        FROM customer_services
+        WHERE is_active = true
+        AND service_end < NOW()
+        ORDER BY service_end
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    flipped AS (
+        UPDATE customer_services cs
+        SET is_active = false, is_suspended = true
+        FROM expired
+        WHERE cs.id = expired.id
+        RETURNING cs.id, cs.pppoe_username, cs.service_end, expired.was_suspended
+    ),
+    removed AS (
+        -- Keep the login if another live service still uses the same username
+        DELETE FROM radcheck r
+        USING flipped f
+        WHERE r.username = f.pppoe_username
+        AND NOT EXISTS (
+            SELECT 1 FROM customer_services other
+            WHERE other.pppoe_username = f.pppoe_username
+            AND other.id NOT IN (SELECT id FROM expired)
+            AND other.status = 'active'
+            AND COALESCE(other.is_suspended, false) = false
+        )
+        RETURNING r.username
+    ),
+    events AS (
+        INSERT INTO service_events (service_id, event_type, description, metadata)
+        SELECT id, 'suspended', 'Service automatically suspended due to expiry',
+               jsonb_build_object('service_end', service_end, 'source', 'sweep_expired_services')
+        FROM flipped
+        WHERE NOT COALESCE(was_suspended, false)
+        RETURNING 1
+    )
+    SELECT
+        (SELECT COUNT(*) FROM flipped),
+        (SELECT COUNT(DISTINCT username) FROM removed),
+        (SELECT COUNT(*) FROM events)
+"""
+
+COUNT_QUERY = """
+    SELECT COUNT(*) FROM customer_services
+    WHERE is_active = true AND service_end < NOW()
+"""
+
+
+def sweep(conn, batch_size=5000, max_batches=None, on_batch=None):
+    """Sweep expired services batch by batch; returns totals (services, logins, events)"""
+    cur = conn.cursor()
+    totals = [0, 0, 0]
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        cur.execute(SWEEP_QUERY, {'limit': batch_size})
+        counts = cur.fetchone()
+        conn.commit()
+        batches += 1
+        for i, n in enumerate(counts):
+            totals[i] += n
+        if on_batch:
+            on_batch(batches, counts)
+        if counts[0] < batch_size:
+            break
+    cur.close()
+    return tuple(totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Suspend expired services and remove their RADIUS logins")
+    parser.add_argument("--batch-size", type=int, default=5000, help="services per transaction")
+    parser.add_argument("--max-batches", type=int, help="stop after this many batches")
+    parser.add_argument("--dry-run", action="store_true", help="only count expired services")
+    args = parser.parse_args()
+
+    conn = db.connect()
+    try:
+        if args.dry_run:
+            cur = conn.cursor()
+            cur.execute(COUNT_QUERY)
+            print(f"{cur.fetchone()[0]} expired services would be suspended")
+            cur.close()
+            return
+
+        def report(batch, counts):
+            if counts[0]:
+                print(f"  ✓ batch {batch}: {counts[0]} suspended, {counts[1]} logins removed")
+
+        started = time.perf_counter()
+        services, logins, events = sweep(conn, args.batch_size, args.max_batches, on_batch=report)
+        elapsed = time.perf_counter() - started
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Error: {e}")
+        exit(1)
+    finally:
+        conn.close()
+
+    print(f"✓ Suspended {services} expired services in {elapsed:.2f}s "
+          f"({logins} RADIUS logins removed, {events} service events written)")
+
+
+if __name__ == "__main__":
+    main()
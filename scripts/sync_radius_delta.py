@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Incremental RADIUS sync
+Provisions only the services whose status, credentials or plan changed since the last run,
+tracked by an updated_at watermark in radius_sync_state (see 1062_add_radius_sync_watermark.sql).
+Services that went inactive or were renamed are deprovisioned. In group profiles mode
+(radius_groups.py migrate) users are pointed at their plan group instead of getting the
+plan's reply attributes.
+
+Safe to run every minute from cron:
+    * * * * * DATABASE_URL=... python3 scripts/sync_radius_delta.py
+"""
+
+import argparse
+from psycopg2.extras import RealDictCursor, execute_values
+
+import db
+import instrumentation
+import radius_bulk
+import radius_groups
+from plan_attributes import PlanAttributes
+
+# Rows committed late can carry an updated_at slightly older than the watermark;
+# re-reading a short window behind it is harmless because writes are idempotent.
+DEFAULT_OVERLAP_SECONDS = 120
+
+# {changed} yields the service ids to look at; services that no longer exist come back with
+# NULL columns so their previous username is deprovisioned
+SERVICES_QUERY = """
+    WITH changed AS ({changed})
+    SELECT
+        changed.id as service_id,
+        cs.status,
+        COALESCE(cs.is_suspended, false) as is_suspended,
+        cs.pppoe_username,
+        cs.pppoe_password,
+        cs.service_plan_id,
+        GREATEST(cs.updated_at, sp.updated_at) as changed_at,
+        rs.username as synced_username
+    FROM changed
+    LEFT JOIN customer_services cs ON cs.id = changed.id
+    LEFT JOIN service_plans sp ON sp.id = cs.service_plan_id
+    LEFT JOIN radius_synced_services rs ON rs.service_id = changed.id
+    ORDER BY changed.id
+"""
+
+CHANGED_SERVICES_QUERY = SERVICES_QUERY.format(changed="""
+        SELECT id FROM customer_services
+        WHERE updated_at > %(since)s
+        UNION
+        SELECT cs.id
+        FROM customer_services cs
+        JOIN service_plans sp ON sp.id = cs.service_plan_id
+        WHERE sp.updated_at > %(since)s
+        UNION
+        -- Deleted services leave no updated_at behind; pick them up from what was synced
+        SELECT rs.service_id FROM radius_synced_services rs
+        WHERE NOT EXISTS (SELECT 1 FROM customer_services cs WHERE cs.id = rs.service_id)
+""")
+
+# Services named by id (including deleted ones still in radius_synced_services) or on the given plans
+SERVICES_BY_ID_QUERY = SERVICES_QUERY.format(changed="""
+        SELECT id FROM customer_services
+        WHERE id = ANY(%(service_ids)s::int[]) OR service_plan_id = ANY(%(plan_ids)s::int[])
+        UNION
+        SELECT service_id FROM radius_synced_services
+        WHERE service_id = ANY(%(service_ids)s::int[])
+""")
+
+
+def load_watermark(cur, name):
+    """Return the stored watermark for this sync, or None on first run"""
+    cur.execute("SELECT watermark FROM radius_sync_state WHERE name = %s", (name,))
+    row = cur.fetchone()
+    return row['watermark'] if row else None
+
+
+def save_watermark(cur, name, watermark, services_synced):
+    cur.execute("""
+        INSERT INTO radius_sync_state (name, watermark, last_run_at, services_synced)
+        VALUES (%s, %s, NOW(), %s)
+        ON CONFLICT (name) DO UPDATE
+        SET watermark = GREATEST(radius_sync_state.watermark, EXCLUDED.watermark),
+            last_run_at = EXCLUDED.last_run_at,
+            services_synced = EXCLUDED.services_synced
+    """, (name, watermark, services_synced))
+
+
+def is_provisionable(service):
+    return (
+        service['status'] == 'active'
+        and not service['is_suspended']
+        and bool(service['pppoe_username'])
+        and bool(service['pppoe_password'])
+    )
+
+
+def apply(conn, cur, services, plans):
+    """Provision/deprovision SERVICES_QUERY rows in the current transaction; returns counts"""
+    # The mode can be switched while radius_listener.py holds the same plans for hours
+    group_profiles = plans.load_mode(conn)
+    check_rows = []
+    reply_rows = []
+    memberships = []
+    synced = []
+    unsynced_ids = []
+    stale_usernames = []
+
+    for service in services:
+        previous = service['synced_username']
+        if is_provisionable(service):
+            username = service['pppoe_username']
+            check_rows.append((username, 'Cleartext-Password', ':=', service['pppoe_password']))
+            for attribute, value in plans.user_attributes(service['service_plan_id']).items():
+                reply_rows.append((username, attribute, ':=', value))
+            if group_profiles:
+                memberships.append((username, plans.group(service['service_plan_id'])))
+            synced.append((service['service_id'], username))
+            if previous and previous != username:
+                stale_usernames.append(previous)
+        else:
+            unsynced_ids.append(service['service_id'])
+            if previous:
+                stale_usernames.append(previous)
+
+    counts = {'created': 0, 'updated': 0, 'unchanged': 0}
+    with instrumentation.phase("provision"):
+        if check_rows:
+            radius_groups.ensure_profiles(conn, plans)
+            counts.update(radius_bulk.provision(conn, check_rows, reply_rows,
+                                                memberships if group_profiles else None))
+
+    with instrumentation.phase("deprovision"):
+        removed = radius_bulk.deprovision(conn, stale_usernames)
+
+    if synced:
+        execute_values(cur, """
+            INSERT INTO radius_synced_services (service_id, username, synced_at)
+            VALUES %s
+            ON CONFLICT (service_id) DO UPDATE
+            SET username = EXCLUDED.username, synced_at = EXCLUDED.synced_at
+        """, synced, template="(%s, %s, NOW())")
+    if unsynced_ids:
+        cur.execute("DELETE FROM radius_synced_services WHERE service_id = ANY(%s)", (unsynced_ids,))
+
+    counts['scanned'] = len(services)
+    counts['deprovisioned'] = len(removed)
+    return counts
+
+
+def sync(conn, name="radius", full=False, overlap_seconds=DEFAULT_OVERLAP_SECONDS, plans=None):
+    """Run one incremental sync pass in a single short transaction"""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+
+    watermark = None if full else load_watermark(cur, name)
+    if watermark is None:
+        since = '-infinity'
+    else:
+        cur.execute("SELECT %s::timestamp - make_interval(secs => %s) AS since",
+                    (watermark, overlap_seconds))
+        since = cur.fetchone()['since']
+
+    with instrumentation.phase("select"):
+        cur.execute(CHANGED_SERVICES_QUERY, {'since': since})
+        services = cur.fetchall()
+    instrumentation.add_rows(len(services))
+
+    new_watermark = watermark
+    for service in services:
+        if service['changed_at'] and (new_watermark is None or service['changed_at'] > new_watermark):
+            new_watermark = service['changed_at']
+
+    counts = apply(conn, cur, services, plans or PlanAttributes.load(conn))
+
+    if new_watermark is not None:
+        save_watermark(cur, name, new_watermark, len(services))
+
+    with instrumentation.phase("commit"):
+        conn.commit()
+    cur.close()
+
+    counts['watermark'] = new_watermark
+    return counts
+
+
+def sync_services(conn, service_ids=(), plan_ids=(), plans=None):
+    """Sync just these services (and every service on these plans), without touching the watermark"""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    with instrumentation.phase("select"):
+        cur.execute(SERVICES_BY_ID_QUERY, {'service_ids': list(service_ids), 'plan_ids': list(plan_ids)})
+        services = cur.fetchall()
+    instrumentation.add_rows(len(services))
+
+    counts = apply(conn, cur, services, plans or PlanAttributes.load(conn))
+    with instrumentation.phase("commit"):
+        conn.commit()
+    cur.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally sync changed services to FreeRADIUS")
+    parser.add_argument("--full", action="store_true",
+                        help="ignore the stored watermark and reconcile every service")
+    parser.add_argument("--name", default="radius",
+                        help="sync state key (default: radius)")
+    parser.add_argument("--overlap-seconds", type=int, default=DEFAULT_OVERLAP_SECONDS,
+                        help="re-read this many seconds behind the watermark")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.start(args)
+
+    db.require_database_url()
+
+    try:
+        conn = db.connect()
+        counts = sync(conn, name=args.name, full=args.full, overlap_seconds=args.overlap_seconds)
+        conn.close()
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        exit(1)
+
+    print(f"Changed services scanned: {counts['scanned']}")
+    print(f"Created: {counts['created']}  Updated: {counts['updated']}  "
+          f"Unchanged: {counts['unchanged']}  Deprovisioned: {counts['deprovisioned']}")
+    print(f"Watermark: {counts['watermark']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+router_push.py against router_standin.py and a scratch PostgreSQL
+A pusher that crashes mid-session leaves its row in 'processing'; once the lease expires that
+older action must be superseded, never pushed after a newer one for the same user.
+
+THIS DROPS AND RECREATES the queue tables in the target database:
+    TEST_DATABASE_URL=postgresql://localhost/isp_test python3 -m pytest scripts/test_router_push.py
+Without TEST_DATABASE_URL a throwaway server is started via testing.postgresql, or the tests skip.
+"""
+
+import functools
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+import db
+import router_push
+import router_standin
+from provisioning_worker import LEASE_SECONDS
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCHEMA = """
+    DROP TABLE IF EXISTS provisioning_queue, network_devices, service_plans CASCADE;
+    CREATE TABLE service_plans (id SERIAL PRIMARY KEY, name VARCHAR(255));
+    CREATE TABLE network_devices (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(255),
+        type VARCHAR(50),
+        ip_address INET
+    );
+"""
+
+MIGRATIONS = [
+    "1020_add_provisioning_queue.sql",
+    "1063_add_provisioning_queue_retry.sql",
+    "1067_add_provisioning_queue_coalescing.sql",
+]
+
+
+@pytest.fixture(scope="module")
+def database_url():
+    url = os.environ.get("TEST_DATABASE_URL")
+    postgresql = None
+    if not url:
+        testing_postgresql = pytest.importorskip("testing.postgresql")
+        postgresql = testing_postgresql.Postgresql()
+        url = postgresql.url()
+
+    conn = psycopg2.connect(url)
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA)
+        for name in MIGRATIONS:
+            with open(os.path.join(SCRIPTS_DIR, name)) as f:
+                cur.execute(f.read())
+    conn.commit()
+    conn.close()
+
+    previous = os.environ.get("DATABASE_URL")
+    os.environ["DATABASE_URL"] = url
+    yield url
+    db.close_pool()
+    if previous is None:
+        os.environ.pop("DATABASE_URL", None)
+    else:
+        os.environ["DATABASE_URL"] = previous
+    if postgresql:
+        postgresql.stop()
+
+
+@pytest.fixture
+def conn(database_url):
+    conn = db.connect()
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE provisioning_queue, network_devices RESTART IDENTITY CASCADE")
+        cur.execute("""
+            INSERT INTO network_devices (name, type, ip_address)
+            VALUES ('edge-1', 'EdgeRouter', '192.0.2.1') RETURNING id
+        """)
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def standin():
+    routers = router_standin.Routers()
+    handler = type("Handler", (router_standin.Handler,), {'routers': routers})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield routers, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def push(endpoint):
+    transport = functools.partial(router_push.http_push, endpoint, timeout=5)
+    return router_push.run(transport, workers=2, per_router=1, batch_size=100, drain=True)
+
+
+def crash_mid_session(conn):
+    """Claim the user's current action as a pusher would, then never push or record it"""
+    rows = router_push.claim(conn, 1, 0, 1, "crashed-pusher", 100)
+    assert [row['action'] for row in rows] == ['add_pppoe_user']
+    return rows[0]['id']
+
+
+def expire_lease(conn, row_id):
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE provisioning_queue
+            SET updated_at = NOW() - make_interval(secs => %s)
+            WHERE id = %s
+        """, (LEASE_SECONDS + 60, row_id))
+    conn.commit()
+
+
+def statuses(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT id, status FROM provisioning_queue ORDER BY id")
+        return dict(cur.fetchall())
+
+
+def users(routers):
+    return routers.state().get("1", {}).get('users', {})
+
+
+def test_coalesces_to_net_state(conn, standin):
+    routers, endpoint = standin
+    for action in ("add_pppoe_user", "remove_pppoe_user", "add_pppoe_user"):
+        router_push.enqueue(conn, 1, action, "jdoe", "s3cret")
+    conn.commit()
+
+    totals = push(endpoint)
+
+    assert totals['sessions'] == 1
+    assert totals['completed'] == 1
+    assert users(routers) == {'jdoe': {'password': "s3cret", 'static_ip': None, 'profile': None}}
+    assert sorted(statuses(conn).values()) == ['completed', 'superseded', 'superseded']
+
+
+def test_expired_lease_before_newer_push_is_superseded(conn, standin):
+    routers, endpoint = standin
+    router_push.enqueue(conn, 1, "add_pppoe_user", "jdoe", "s3cret")
+    conn.commit()
+    crashed = crash_mid_session(conn)
+    removed, _ = router_push.enqueue(conn, 1, "remove_pppoe_user", "jdoe")
+    conn.commit()
+    expire_lease(conn, crashed)
+
+    push(endpoint)
+
+    assert "jdoe" not in users(routers)
+    assert statuses(conn) == {crashed: 'superseded', removed: 'completed'}
+
+
+def test_expired_lease_after_newer_push_is_superseded(conn, standin):
+    routers, endpoint = standin
+    router_push.enqueue(conn, 1, "add_pppoe_user", "jdoe", "s3cret")
+    conn.commit()
+    crashed = crash_mid_session(conn)
+    removed, _ = router_push.enqueue(conn, 1, "remove_pppoe_user", "jdoe")
+    conn.commit()
+
+    push(endpoint)
+    expire_lease(conn, crashed)
+    push(endpoint)
+
+    assert "jdoe" not in users(routers)
+    assert routers.state()["1"]['actions'] == 1
+    assert statuses(conn) == {crashed: 'superseded', removed: 'completed'}
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+In-memory PPPoE username allocator
+Loads every username already used by radcheck or customer_services once, then hands out
+unique names with deterministic suffixing (base, base_2, base_3, ...) without a database
+round trip per customer. Shared by all the provisioning scripts.
+
+    allocator = UsernameAllocator.load(conn)
+    username = allocator.allocate(email_base(email, customer_id))
+"""
+
+import re
+
+_INVALID_CHARS = re.compile(r"[^a-z0-9._-]")
+
+
+def clean_base(value):
+    """Lowercase and strip characters RADIUS/PPPoE clients tend to choke on"""
+    return _INVALID_CHARS.sub("", (value or "").lower())
+
+
+def email_base(email, customer_id, suffix=""):
+    """Username base from the email local part, falling back to user<customer_id>"""
+    local = clean_base(email.split('@')[0]) if email else ""
+    return f"{local or f'user{customer_id}'}{suffix}"
+
+
+def name_base(customer_name, customer_id):
+    """Username base from the customer name plus id (complete_radius_setup.py style)"""
+    clean_name = ''.join(c for c in (customer_name or '') if c.isalnum()).lower()
+    return f"{clean_name}{customer_id}"
+
+
+class UsernameAllocator:
+    """Hash-set backed allocator; allocate() is amortised O(1) per call"""
+
+    def __init__(self, taken=(), in_radcheck=()):
+        self.taken = set(taken)
+        self.in_radcheck = set(in_radcheck)
+        self.taken |= self.in_radcheck
+        # Next suffix to try per base, so repeated collisions on one base don't rescan 2..n
+        self._next_suffix = {}
+
+    @classmethod
+    def load(cls, conn):
+        """Load radcheck and customer_services usernames in one round trip"""
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT username, true FROM radcheck
+            UNION
+            SELECT pppoe_username, false FROM customer_services WHERE pppoe_username IS NOT NULL
+        """)
+        taken = set()
+        in_radcheck = set()
+        for username, from_radcheck in cur.fetchall():
+            taken.add(username)
+            if from_radcheck:
+                in_radcheck.add(username)
+        cur.close()
+        return cls(taken, in_radcheck)
+
+    def __contains__(self, username):
+        return username in self.taken
+
+    def __len__(self):
+        return len(self.taken)
+
+    def reserve(self, username):
+        """Mark an existing username as used; returns False if it was already taken"""
+        if username in self.taken:
+            return False
+        self.taken.add(username)
+        return True
+
+    def allocate(self, base):
+        """Return base if free, otherwise the first free base_<n>, and reserve it"""
+        if base not in self.taken:
+            self.taken.add(base)
+            return base
+        suffix = self._next_suffix.get(base, 2)
+        candidate = f"{base}_{suffix}"
+        while candidate in self.taken:
+            suffix += 1
+            candidate = f"{base}_{suffix}"
+        self._next_suffix[base] = suffix + 1
+        self.taken.add(candidate)
+        return candidate